@@ -3,7 +3,6 @@
 """
 from datetime import datetime, date, timedelta
 from typing import List, Dict, Optional
-from zoneinfo import ZoneInfo
 
 from bot.core.models import UserState, AdviceState
 
@@ -56,11 +55,6 @@ def get_advice_for_today(user: UserState) -> Optional[str]:
     """
     from datetime import datetime, timezone
     
-    try:
-        tz = ZoneInfo(user.settings.timezone)
-    except Exception:
-        tz = ZoneInfo("Asia/Vladivostok")
-    
     today = date.today().isoformat()
     advice_state = user.advice_state
     
@@ -0,0 +1,179 @@
+"""
+Общая статистика бота для /bot_stats.
+
+Суммы по всем пользователям (возраст, счастье, монеты, мёртвые и отпускные
+выдры, счётчики активности...) поддерживаются на каждую запись: при
+сохранении пользователя из сумм вычитается его прошлый вклад и
+прибавляется новый, инкременты статистики прибавляются как есть. Число
+дружб ведётся по изменениям FriendsRepository. Поэтому /bot_stats не
+читает ни пользователей, ни статистику, сколько бы их ни было.
+Топы для /bot_stats ведутся в bot/core/leaderboards.py.
+
+При старте всё строится одним проходом (см. bot/core/indexes.py);
+инкременты, пришедшие во время этого прохода, могут учесться дважды.
+Активность «за 7 дней» считается с точностью до дня.
+"""
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from bot.core.models import UserState, history_loaded
+from bot.core.stats import COUNTER_FIELDS, UserStats
+
+# Поля вклада одного пользователя в суммы
+USER_FIELDS = (
+    "users",
+    "age_days",
+    "happiness",
+    "energy",
+    "money",
+    "unlocked_hobbies",
+    "achievements",
+    "dead",
+    "vacation",
+    "coop_sessions",
+    "advice_requests",
+    "daily_sleep_minutes",
+)
+
+
+_ADVICE = USER_FIELDS.index("advice_requests")
+_SLEEP = USER_FIELDS.index("daily_sleep_minutes")
+
+
+def user_contribution(user: UserState, previous: Optional[Tuple[float, ...]] = None) -> Tuple[float, ...]:
+    """
+    Вклад пользователя в суммы. previous — его прошлый вклад: если история
+    не разбиралась с загрузки, она не менялась, и её часть берётся оттуда.
+    """
+    pet = user.pet
+    if previous is not None and not history_loaded(user, "advice_state"):
+        advice_requests = previous[_ADVICE]
+    else:
+        advice_requests = len(user.advice_state.shown_advice_ids)
+    if previous is not None and not history_loaded(user, "daily_stats"):
+        daily_sleep_minutes = previous[_SLEEP]
+    else:
+        daily_sleep_minutes = sum(day.sleep_minutes for day in user.daily_stats.values())
+    return (
+        1,
+        pet.age_days,
+        pet.happiness,
+        pet.energy,
+        pet.money,
+        len(pet.unlocked_hobbies),
+        len(pet.unlocked_achievements),
+        0 if pet.is_alive else 1,
+        1 if pet.vacation_mode else 0,
+        len(getattr(user, "coop_sessions", None) or []),
+        advice_requests,
+        daily_sleep_minutes,
+    )
+
+
+def _day(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).astimezone(timezone.utc).date()
+    except (TypeError, ValueError):
+        return None
+
+
+class BotAggregates:
+    def __init__(self) -> None:
+        # Сохранения и инкременты приходят из потоков хранилища
+        self._lock = threading.Lock()
+        self._totals = [0.0] * len(USER_FIELDS)
+        self._contribution: Dict[int, Tuple[float, ...]] = {}
+        # Сколько пользователей последний раз заходили / взаимодействовали с выдрой в каждый день
+        self._active_of: Dict[int, date] = {}
+        self._active_days: Counter = Counter()
+        self._interaction_of: Dict[int, date] = {}
+        self._interaction_days: Counter = Counter()
+        self._counters: Dict[str, int] = dict.fromkeys(COUNTER_FIELDS, 0)
+        # Число друзей каждого пользователя и их сумма (каждая дружба в ней дважды)
+        self._friend_count: Dict[int, int] = {}
+        self._friend_total = 0
+
+    def rebuild(
+        self,
+        users: Iterable[UserState],
+        stats: Iterable[UserStats],
+        friend_counts: Dict[int, int],
+    ) -> None:
+        with self._lock:
+            for user_id, count in friend_counts.items():
+                if user_id not in self._friend_count:
+                    self._set_friends(user_id, count)
+            for user in users:
+                # Пользователи, сохранённые во время чтения снимка, уже учтены по свежим данным
+                if user.user_id not in self._contribution:
+                    self._update(user)
+            for s in stats:
+                self._add_stats({field: getattr(s, field) for field in COUNTER_FIELDS})
+
+    def on_user_saved(self, user: UserState) -> None:
+        """Слушатель UsersRepository.add_save_listener."""
+        with self._lock:
+            self._update(user)
+
+    def on_stats_increment(self, user_id: int, deltas: Dict[str, int]) -> None:
+        """Слушатель StatsRepository.add_increment_listener."""
+        with self._lock:
+            self._add_stats(deltas)
+
+    def on_friends_changed(self, user_id: int, count: int) -> None:
+        """Слушатель FriendsRepository.add_change_listener."""
+        with self._lock:
+            self._set_friends(user_id, count)
+
+    def _set_friends(self, user_id: int, count: int) -> None:
+        self._friend_total += count - self._friend_count.get(user_id, 0)
+        self._friend_count[user_id] = count
+
+    def _update(self, user: UserState) -> None:
+        user_id = user.user_id
+        old = self._contribution.get(user_id)
+        new = user_contribution(user, old)
+        if old is None:
+            self._totals = [t + n for t, n in zip(self._totals, new)]
+        else:
+            self._totals = [t - o + n for t, o, n in zip(self._totals, old, new)]
+        self._contribution[user_id] = new
+        self._move_day(self._active_of, self._active_days, user_id, _day(user.last_main_menu_return))
+        self._move_day(self._interaction_of, self._interaction_days, user_id, _day(user.pet.last_interaction))
+
+    @staticmethod
+    def _move_day(day_of: Dict[int, date], counts: Counter, user_id: int, day: Optional[date]) -> None:
+        old = day_of.get(user_id)
+        if old == day:
+            return
+        if old is not None:
+            counts[old] -= 1
+            if not counts[old]:
+                del counts[old]
+        if day is None:
+            day_of.pop(user_id, None)
+        else:
+            day_of[user_id] = day
+            counts[day] += 1
+
+    def _add_stats(self, deltas: Dict[str, int]) -> None:
+        for field, delta in deltas.items():
+            self._counters[field] += delta
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущие суммы и число активных / новых пользователей за 7 дней."""
+        cutoff = datetime.now(timezone.utc).date() - timedelta(days=7)
+        with self._lock:
+            totals = dict(zip(USER_FIELDS, self._totals))
+            totals["active_7d"] = sum(n for day, n in self._active_days.items() if day >= cutoff)
+            totals["new_7d"] = sum(n for day, n in self._interaction_days.items() if day >= cutoff)
+            totals["friendships"] = self._friend_total // 2
+            totals.update(self._counters)
+        return totals
+
+
+bot_aggregates = BotAggregates()
@@ -0,0 +1,104 @@
+"""
+Выбор движка хранения.
+
+Все модули получают репозитории через эти функции, поэтому в процессе
+существует ровно один экземпляр каждого репозитория, а движок
+(JSON-файлы или SQLite) выбирается настройкой STORAGE_BACKEND.
+"""
+from functools import lru_cache
+
+from bot.core.repositories import (
+    AdminRepository,
+    CoopSessionsRepository,
+    FriendsRepository,
+    HobbiesRepository,
+    UsersRepository,
+)
+from bot.core.stats import StatsRepository
+from settings import STORAGE_BACKEND
+
+
+def _use_sqlite() -> bool:
+    return STORAGE_BACKEND == "sqlite"
+
+
+def _sqlite():
+    from bot.storage.sqlite_db import get_sqlite_db
+
+    return get_sqlite_db()
+
+
+@lru_cache(maxsize=None)
+def get_users_repo() -> UsersRepository:
+    if _use_sqlite():
+        from bot.storage.sqlite_db import SqliteKV
+
+        return UsersRepository(db=SqliteKV(_sqlite(), "users", key_column="user_id"))
+    return UsersRepository()
+
+
+@lru_cache(maxsize=None)
+def get_hobbies_repo() -> HobbiesRepository:
+    if _use_sqlite():
+        from bot.storage.sqlite_db import SqliteKV
+
+        return HobbiesRepository(db=SqliteKV(_sqlite(), "hobbies", key_column="hobby_id"))
+    return HobbiesRepository()
+
+
+@lru_cache(maxsize=None)
+def get_admin_repo() -> AdminRepository:
+    if _use_sqlite():
+        from bot.storage.sqlite_db import SqliteKV
+
+        return AdminRepository(db=SqliteKV(_sqlite(), "admin"))
+    return AdminRepository()
+
+
+@lru_cache(maxsize=None)
+def get_friends_repo():
+    if _use_sqlite():
+        from bot.core.sqlite_repositories import SqliteFriendsRepository
+
+        return SqliteFriendsRepository(_sqlite())
+    return FriendsRepository()
+
+
+@lru_cache(maxsize=None)
+def get_coop_sessions_repo():
+    if _use_sqlite():
+        from bot.core.sqlite_repositories import SqliteCoopSessionsRepository
+
+        return SqliteCoopSessionsRepository(_sqlite())
+    return CoopSessionsRepository()
+
+
+@lru_cache(maxsize=None)
+def get_stats_repo():
+    if _use_sqlite():
+        from bot.core.sqlite_repositories import SqliteStatsRepository
+
+        return SqliteStatsRepository(_sqlite())
+    return StatsRepository()
+
+
+@lru_cache(maxsize=None)
+def get_outbox_repo():
+    from bot.core.outbox import OutboxRepository
+
+    if _use_sqlite():
+        from bot.storage.sqlite_db import SqliteKV
+
+        return OutboxRepository(db=SqliteKV(_sqlite(), "outbox"))
+    return OutboxRepository()
+
+
+@lru_cache(maxsize=None)
+def get_broadcasts_repo():
+    from bot.core.broadcasts import BroadcastRepository
+
+    if _use_sqlite():
+        from bot.storage.sqlite_db import SqliteKV
+
+        return BroadcastRepository(db=SqliteKV(_sqlite(), "broadcasts", key_column="job_id"))
+    return BroadcastRepository()
@@ -0,0 +1,344 @@
+"""
+Рассылки администратора.
+
+/broadcast создаёт задание и сразу отвечает; отправка идёт в фоне пачками
+по BROADCAST_CONCURRENCY сообщений не быстрее BROADCAST_RATE в секунду (и в
+пределах общего лимита delivery, который делится с напоминаниями).
+
+Получателей можно отобрать фильтрами, которые стоят перед текстом:
+
+    /broadcast tz=Europe/Moscow status=alive active=7 friends=yes water=no Текст
+
+Аудитория берётся из индексов user_index, без чтения пользователей.
+
+Задание хранится в broadcasts.json (или таблице SQLite) вместе с фильтром
+и курсором — последним обработанным user_id. Курсор записывается после каждой пачки,
+поэтому после рестарта рассылка продолжается с того же места: повторно
+может уйти не больше одной пачки.
+
+Раз в BROADCAST_PROGRESS_INTERVAL секунд сообщение о ходе рассылки
+редактируется: отправлено, ошибки, сколько осталось и примерное время.
+
+Если рассылка упала с ошибкой (например, не удалось записать курсор),
+она приостанавливается: статус записывается, а продолжить её с курсора
+можно командой /broadcast_resume.
+"""
+import asyncio
+import bisect
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot.core.backends import get_broadcasts_repo
+from bot.core.delivery import DeliveryPipeline, TokenBucket, delivery
+from bot.core.user_index import PET_STATUSES, AudienceFilter, user_index
+from bot.storage.async_repo import AsyncRepository, as_async
+from bot.storage.json_db import JsonDB
+from settings import BROADCAST_CONCURRENCY, BROADCAST_PROGRESS_INTERVAL, BROADCAST_RATE
+
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+PAUSED = "paused"
+
+_STATUS_TITLES = {
+    RUNNING: "идёт",
+    DONE: "завершена",
+    CANCELLED: "отменена",
+    PAUSED: "приостановлена из-за ошибки",
+}
+
+# Сколько раз повторять сообщение после TelegramRetryAfter
+_RETRY_AFTER_ATTEMPTS = 3
+
+_YES = {"yes", "да", "1", "true"}
+_NO = {"no", "нет", "0", "false"}
+
+# Подсказка по фильтрам для админа
+AUDIENCE_HELP = (
+    "Фильтры перед текстом (любые, в любом порядке):\n"
+    "tz=Region/City — часовой пояс\n"
+    "status=alive|vacation|dead — состояние выдры\n"
+    "active=N — заходил за последние N дней\n"
+    "friends=yes|no — есть ли друзья\n"
+    "water=yes|no — задана ли норма воды"
+)
+
+
+def _parse_flag(name: str, value: str) -> bool:
+    value = value.lower()
+    if value in _YES:
+        return True
+    if value in _NO:
+        return False
+    raise ValueError(f"{name}: ожидается yes или no, а не «{value}»")
+
+
+def parse_audience(text: str) -> Tuple[AudienceFilter, str]:
+    """
+    Отделить фильтры key=value в начале текста рассылки.
+
+    Возвращает фильтр и оставшийся текст; при неверном фильтре — ValueError.
+    """
+    audience = AudienceFilter()
+    rest = text.strip()
+    while rest:
+        token, _, tail = rest.partition(" ")
+        name, sep, value = token.partition("=")
+        if not sep or name not in ("tz", "status", "active", "friends", "water"):
+            break
+        if name == "tz":
+            from bot.core.timezones import is_known_zone
+
+            if not is_known_zone(value):
+                raise ValueError(f"tz: неизвестный часовой пояс «{value}»")
+            audience.timezone = value
+        elif name == "status":
+            if value not in PET_STATUSES:
+                raise ValueError(f"status: ожидается alive, vacation или dead, а не «{value}»")
+            audience.status = value
+        elif name == "active":
+            if not value.isdigit():
+                raise ValueError(f"active: ожидается число дней, а не «{value}»")
+            audience.active_days = int(value)
+        elif name == "friends":
+            audience.has_friends = _parse_flag(name, value)
+        else:
+            audience.water_norm_set = _parse_flag(name, value)
+        rest = tail.strip()
+    return audience, rest
+
+
+def describe_audience(audience: AudienceFilter) -> str:
+    parts = []
+    if audience.timezone is not None:
+        parts.append(f"пояс {audience.timezone}")
+    if audience.status is not None:
+        parts.append(f"выдра: {audience.status}")
+    if audience.active_days is not None:
+        parts.append(f"активны за {audience.active_days} дн.")
+    if audience.has_friends is not None:
+        parts.append("есть друзья" if audience.has_friends else "без друзей")
+    if audience.water_norm_set is not None:
+        parts.append("норма воды задана" if audience.water_norm_set else "норма воды не задана")
+    return ", ".join(parts) or "все пользователи"
+
+
+@dataclass
+class BroadcastJob:
+    job_id: str
+    text: str
+    admin_chat_id: int
+    progress_message_id: Optional[int] = None
+    status: str = RUNNING
+    # Последний обработанный user_id
+    cursor: Optional[int] = None
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    created_at: float = 0.0
+    finished_at: Optional[float] = None
+    # Поля AudienceFilter
+    audience: Dict[str, Any] = field(default_factory=dict)
+
+
+class BroadcastRepository:
+    def __init__(self, db: Optional[Any] = None) -> None:
+        self._db = db if db is not None else JsonDB("broadcasts.json", mode="journal")
+        self._lock = threading.Lock()
+
+    def create(
+        self, text: str, admin_chat_id: int, total: int, audience: AudienceFilter, status: str = RUNNING
+    ) -> BroadcastJob:
+        with self._lock:
+            ids = [int(key) for key, _ in self._db.iter_items()]
+            job = BroadcastJob(
+                job_id=str(max(ids, default=0) + 1),
+                text=text,
+                admin_chat_id=admin_chat_id,
+                status=status,
+                total=total,
+                created_at=time.time(),
+                audience=asdict(audience),
+            )
+            self._db.set(job.job_id, asdict(job))
+            return job
+
+    def get(self, job_id: str) -> Optional[BroadcastJob]:
+        data = self._db.get(job_id)
+        return BroadcastJob(**data) if data else None
+
+    def save(self, job: BroadcastJob) -> None:
+        self._db.set(job.job_id, asdict(job))
+
+    def all(self) -> List[BroadcastJob]:
+        jobs = [BroadcastJob(**data) for _, data in self._db.iter_items()]
+        return sorted(jobs, key=lambda job: job.created_at)
+
+
+def format_progress(job: BroadcastJob, eta: Optional[float] = None) -> str:
+    remaining = max(job.total - job.sent - job.failed, 0) if job.status in (RUNNING, PAUSED) else 0
+    text = (
+        f"📣 Рассылка #{job.job_id}: {_STATUS_TITLES.get(job.status, job.status)}\n"
+        f"Кому: {describe_audience(AudienceFilter(**job.audience))}\n"
+        f"Отправлено: {job.sent}\n"
+        f"Ошибок: {job.failed}\n"
+        f"Осталось: {remaining}\n"
+    )
+    if job.status == RUNNING and eta is not None:
+        minutes, seconds = divmod(int(eta), 60)
+        text += f"Примерно ещё: {minutes} мин {seconds:02d} с\n"
+    return text
+
+
+class BroadcastEngine:
+    def __init__(self, repo: AsyncRepository, pipeline: DeliveryPipeline, rate: float, concurrency: int) -> None:
+        self.repo = repo
+        self._pipeline = pipeline
+        self._rate = rate
+        self._concurrency = concurrency
+        # Задания, которые сейчас отправляются в этом процессе
+        self._running: Dict[str, BroadcastJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def start(self, bot: Bot, text: str, admin_chat_id: int, audience: AudienceFilter) -> BroadcastJob:
+        """Запустить рассылку; индексы должны быть готовы (user_index.ready)."""
+        recipients = user_index.select(audience)
+        # RUNNING только после того, как админ увидел сообщение о ходе: иначе
+        # resume после рестарта разослал бы задание, о котором админ не знает
+        job = await self.repo.create(text, admin_chat_id, len(recipients), audience, status=PAUSED)
+        job.status = RUNNING
+        try:
+            progress = await bot.send_message(admin_chat_id, format_progress(job))
+        except Exception:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            await self.repo.save(job)
+            raise
+        job.progress_message_id = progress.message_id
+        await self.repo.save(job)
+        self._spawn(bot, job, recipients)
+        return job
+
+    async def resume(self, bot: Bot) -> None:
+        """Продолжить задания, прерванные остановкой бота."""
+        for job in await self.repo.all():
+            if job.status == RUNNING and job.job_id not in self._running:
+                self._spawn(bot, job)
+
+    async def resume_paused(self, bot: Bot, job_id: Optional[str] = None) -> Optional[BroadcastJob]:
+        """Продолжить приостановленное задание (по умолчанию — последнее)."""
+        paused = [job for job in await self.repo.all() if job.status == PAUSED]
+        if job_id is not None:
+            paused = [job for job in paused if job.job_id == job_id]
+        if not paused or paused[-1].job_id in self._running:
+            return None
+        job = paused[-1]
+        job.status = RUNNING
+        job.finished_at = None
+        await self.repo.save(job)
+        self._spawn(bot, job)
+        return job
+
+    async def cancel(self, job_id: Optional[str] = None) -> Optional[BroadcastJob]:
+        """Отменить задание (по умолчанию — последнее запущенное)."""
+        if job_id is None:
+            if not self._running:
+                return None
+            job_id = max(self._running, key=int)
+        job = self._running.get(job_id)
+        if job is None:
+            job = await self.repo.get(job_id)
+            if job is None or job.status not in (RUNNING, PAUSED):
+                return None
+        job.status = CANCELLED
+        job.finished_at = time.time()
+        await self.repo.save(job)
+        return job
+
+    def _spawn(self, bot: Bot, job: BroadcastJob, recipients: Optional[List[int]] = None) -> None:
+        self._running[job.job_id] = job
+        task = asyncio.create_task(self._run(bot, job, recipients))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+
+    async def _run(self, bot: Bot, job: BroadcastJob, recipients: Optional[List[int]]) -> None:
+        bucket = TokenBucket(self._rate)
+        started = time.monotonic()
+        processed = 0
+        last_report = started
+        try:
+            if recipients is None:
+                # Продолжение после рестарта: аудиторию отбираем заново по тому же фильтру
+                await user_index.ready.wait()
+                recipients = user_index.select(AudienceFilter(**job.audience))
+            position = 0 if job.cursor is None else bisect.bisect_right(recipients, job.cursor)
+            job.total = job.sent + job.failed + len(recipients) - position
+            while job.status == RUNNING:
+                batch = recipients[position:position + self._concurrency]
+                if not batch:
+                    job.status = DONE
+                    job.finished_at = time.time()
+                    break
+                results = await asyncio.gather(*(self._send_one(bot, bucket, uid, job.text) for uid in batch))
+                job.sent += sum(results)
+                job.failed += len(results) - sum(results)
+                processed += len(results)
+                # Отмена могла прийти, пока шла пачка: статус уже записан, курсор двигаем всё равно
+                job.cursor = batch[-1]
+                position += len(batch)
+                await self.repo.save(job)
+
+                now = time.monotonic()
+                if now - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                    last_report = now
+                    eta = (len(recipients) - position) * (now - started) / processed
+                    await self._report(bot, job, eta)
+            await self.repo.save(job)
+            await self._report(bot, job)
+        except Exception as e:
+            # Отмена задачи при остановке бота сюда не попадает: статус остаётся
+            # RUNNING, и resume продолжит рассылку при следующем запуске
+            print(f"Error in broadcast #{job.job_id}: {e!r}")
+            job.status = PAUSED
+            job.finished_at = time.time()
+            try:
+                await self.repo.save(job)
+            except Exception as save_error:
+                print(f"Error saving broadcast #{job.job_id}: {save_error!r}")
+            await self._report(bot, job)
+        finally:
+            self._running.pop(job.job_id, None)
+
+    async def _send_one(self, bot: Bot, bucket: TokenBucket, chat_id: int, text: str) -> bool:
+        for _ in range(_RETRY_AFTER_ATTEMPTS):
+            await bucket.acquire()
+            try:
+                await self._pipeline.send_message(bot, chat_id, text)
+                return True
+            except TelegramRetryAfter as e:
+                # Общая очередь уже стоит на паузе, ждём вместе с ней
+                await asyncio.sleep(e.retry_after)
+            except Exception:
+                return False
+        return False
+
+    async def _report(self, bot: Bot, job: BroadcastJob, eta: Optional[float] = None) -> None:
+        if job.progress_message_id is None:
+            return
+        try:
+            await bot.edit_message_text(
+                format_progress(job, eta),
+                chat_id=job.admin_chat_id,
+                message_id=job.progress_message_id,
+            )
+        except Exception:
+            # Текст не изменился, сообщение удалено или сеть моргнула — рассылку это не останавливает
+            pass
+
+
+broadcasts = BroadcastEngine(as_async(get_broadcasts_repo()), delivery, BROADCAST_RATE, BROADCAST_CONCURRENCY)
@@ -0,0 +1,96 @@
+"""
+Маршрутизация текстовых сообщений.
+
+Вместо цепочки обработчиков с фильтрами F.text.in_([...]), которые aiogram
+проверяет по очереди, все тексты идут в один обработчик TextRouter.dispatch:
+
+1. Есть состояние FSM с обработчиком — сообщение уходит ему. Кнопку, которую
+   обработчик состояния не ждёт, считаем выходом из состояния: состояние
+   сбрасывается, и кнопка обрабатывается как обычно.
+2. Текст кнопки — один поиск в словаре «текст → обработчик». Словарь
+   собирается из клавиатур bot/core/menu.py, так что список кнопок не нужно
+   повторять в фильтрах.
+3. Только если точного совпадения нет — запасные проверки по порядку
+   (кнопки с ценой, купленные хобби) и обработчик свободного текста.
+"""
+import inspect
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.types import Message, ReplyKeyboardMarkup
+
+Handler = Callable[..., Awaitable[Any]]
+
+
+def keyboard_texts(markup: ReplyKeyboardMarkup) -> List[str]:
+    """Тексты всех кнопок клавиатуры по порядку."""
+    return [button.text for row in markup.keyboard for button in row]
+
+
+async def ignore(message: Message) -> None:
+    """Для кнопок, у которых пока нет действия."""
+
+
+class _Route:
+    def __init__(self, handler: Handler) -> None:
+        self.handler = handler
+        self.takes_state = "state" in inspect.signature(handler).parameters
+
+    async def __call__(self, message: Message, state: FSMContext) -> Any:
+        if self.takes_state:
+            return await self.handler(message, state=state)
+        return await self.handler(message)
+
+
+class TextRouter:
+    def __init__(self) -> None:
+        self._buttons: Dict[str, _Route] = {}
+        # Состояние FSM -> (обработчик, кнопки, которые он ждёт)
+        self._states: Dict[str, Tuple[_Route, FrozenSet[str]]] = {}
+        self._fallbacks: List[Tuple[Callable[[str], bool], _Route]] = []
+        self._default: Optional[_Route] = None
+
+    def button(self, text: str, handler: Handler) -> None:
+        """Кнопка с текстом text. Первая регистрация текста выигрывает."""
+        self._buttons.setdefault(text, _Route(handler))
+
+    def keyboard(self, markup: ReplyKeyboardMarkup, handler: Handler) -> None:
+        """Все кнопки клавиатуры, которые ещё не заняты."""
+        for text in keyboard_texts(markup):
+            self.button(text, handler)
+
+    def state(self, state: State, handler: Handler, buttons: Iterable[str] = ()) -> None:
+        self._states[state.state] = (_Route(handler), frozenset(buttons))
+
+    def fallback(self, predicate: Callable[[str], bool], handler: Handler) -> None:
+        """Проверка для текстов, которые не совпали ни с одной кнопкой; по порядку регистрации."""
+        self._fallbacks.append((predicate, _Route(handler)))
+
+    def default(self, handler: Handler) -> None:
+        """Обработчик свободного текста."""
+        self._default = _Route(handler)
+
+    def is_button(self, text: Optional[str]) -> bool:
+        return text in self._buttons
+
+    async def dispatch(self, message: Message, state: FSMContext) -> Any:
+        text = message.text
+        current = await state.get_state()
+        if current is not None and current in self._states:
+            route, buttons = self._states[current]
+            if text not in self._buttons or text in buttons:
+                return await route(message, state)
+            await state.clear()
+
+        route = self._buttons.get(text)
+        if route is not None:
+            return await route(message, state)
+        for predicate, route in self._fallbacks:
+            if predicate(text):
+                return await route(message, state)
+        if self._default is not None:
+            return await self._default(message, state)
+
+
+text_router = TextRouter()
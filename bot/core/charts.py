@@ -0,0 +1,158 @@
+"""
+График /stats: сон, работа и хобби пользователей.
+
+Картинка рисуется matplotlib в отдельном процессе, чтобы не занимать цикл
+событий, и кэшируется по версии данных: версия увеличивается на каждый
+инкремент статистики, поэтому повторный /stats без новых данных ничего не
+читает и не рисует, а отправляет file_id уже загруженной в Telegram картинки.
+
+Пока пользователей не больше CHART_MAX_BARS, рисуется столбец на
+пользователя; дальше столбцы нечитаемы, и вместо них рисуются
+распределения (гистограммы) по пользователям.
+"""
+import asyncio
+import io
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from settings import CHART_MAX_BARS
+
+# Гистограммы: число корзин
+_BINS = 20
+
+
+def render_activity_chart(
+    labels: List[str],
+    sleep_hours: List[float],
+    work_sessions: List[int],
+    hobby_sessions: List[int],
+    max_bars: int,
+) -> bytes:
+    """Нарисовать PNG; выполняется в процессе рисования."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    if len(labels) <= max_bars:
+        fig, ax = plt.subplots(figsize=(8, 4))
+        x = range(len(labels))
+        ax.bar(x, sleep_hours, label="Часы сна")
+        ax.bar(x, work_sessions, bottom=sleep_hours, label="Сессии работы")
+        ax.bar(
+            x,
+            hobby_sessions,
+            bottom=[sleep_hours[i] + work_sessions[i] for i in x],
+            label="Сессии хобби",
+        )
+        ax.set_xticks(list(x))
+        ax.set_xticklabels(labels, rotation=45)
+        ax.set_ylabel("Условные единицы")
+        ax.set_title("Активность пользователей FEFUS")
+        ax.legend()
+    else:
+        fig, axes = plt.subplots(1, 3, figsize=(12, 4))
+        for ax, values, title in zip(
+            axes,
+            (sleep_hours, work_sessions, hobby_sessions),
+            ("Часы сна", "Сессии работы", "Сессии хобби"),
+        ):
+            ax.hist(values, bins=_BINS)
+            ax.set_title(title)
+            ax.set_xlabel("На пользователя")
+        axes[0].set_ylabel("Пользователей")
+        fig.suptitle(f"Активность пользователей FEFUS ({len(labels)})")
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+@dataclass
+class CachedChart:
+    version: int
+    png: bytes
+    # file_id картинки после первой отправки: повторно её можно не загружать
+    file_id: Optional[str] = None
+
+
+class StatsChart:
+    def __init__(self, max_bars: int) -> None:
+        self._max_bars = max_bars
+        # Версия данных; инкременты приходят из потоков хранилища
+        self._lock = threading.Lock()
+        self._version = 0
+        self._cached: Optional[CachedChart] = None
+        self._pool: Optional[Any] = None
+        # Одновременные /stats ждут одну отрисовку
+        self._render_lock = asyncio.Lock()
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def on_stats_increment(self, user_id: int, deltas: Dict[str, int]) -> None:
+        """Слушатель StatsRepository.add_increment_listener."""
+        with self._lock:
+            self._version += 1
+
+    def start(self) -> None:
+        """
+        Запустить процесс рисования. Вызывается в начале main(), пока у
+        процесса нет рабочих потоков: fork из многопоточного процесса опасен.
+        """
+        if self._pool is None:
+            # multiprocessing нужен только здесь: не тянем его при импорте
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork"))
+            self._pool.submit(int).result()
+
+    def cached(self) -> Optional[CachedChart]:
+        """Картинка, если данные не менялись с прошлой отрисовки."""
+        cached = self._cached
+        if cached is not None and cached.version == self.version:
+            return cached
+        return None
+
+    async def render(self, stats_repo) -> Optional[CachedChart]:
+        """Актуальная картинка; None, если статистика пуста."""
+        async with self._render_lock:
+            cached = self.cached()
+            if cached is not None:
+                return cached
+            # Версию берём до чтения: инкремент во время чтения даст новую отрисовку в следующий раз
+            version = self.version
+            all_stats = await stats_repo.get_all()
+            if not all_stats:
+                return None
+            labels = []
+            sleep_hours = []
+            work_sessions = []
+            hobby_sessions = []
+            for s in all_stats.values():
+                labels.append(str(s.user_id))
+                sleep_hours.append(s.total_sleep_minutes / 60)
+                work_sessions.append(s.work_sessions)
+                hobby_sessions.append(s.hobby_sessions)
+
+            self.start()
+            png = await asyncio.get_running_loop().run_in_executor(
+                self._pool,
+                render_activity_chart,
+                labels,
+                sleep_hours,
+                work_sessions,
+                hobby_sessions,
+                self._max_bars,
+            )
+            self._cached = CachedChart(version, png)
+            return self._cached
+
+
+stats_chart = StatsChart(CHART_MAX_BARS)
@@ -1,21 +1,25 @@
 from dataclasses import dataclass
 from typing import Optional
 
-from settings import BOT_TOKEN, DEFAULT_TIMEZONE
+from settings import BOT_TOKEN, DEFAULT_TIMEZONE, TELEGRAM_API_SERVER
 
 
 @dataclass(frozen=True)
 class BotConfig:
     token: str
     default_timezone: str
+    api_server: Optional[str] = None
 
 
 def load_config() -> BotConfig:
-    if BOT_TOKEN is None:
-        raise RuntimeError("BOT_TOKEN не сконфигурирован")
+    if not BOT_TOKEN:
+        raise RuntimeError(
+            "BOT_TOKEN не найден. Убедись, что в файле .env задана переменная BOT_TOKEN=..."
+        )
 
     return BotConfig(
         token=BOT_TOKEN,
         default_timezone=DEFAULT_TIMEZONE,
+        api_server=TELEGRAM_API_SERVER,
     )
 
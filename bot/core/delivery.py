@@ -0,0 +1,195 @@
+"""
+Отправка исходящих сообщений.
+
+Все массовые отправки (уведомления из outbox) идут через общую
+очередь: её разбирают DELIVERY_CONCURRENCY задач, общий темп ограничен
+ведром токенов (DELIVERY_RATE сообщений в секунду — лимит Telegram около
+30), а в один чат сообщения уходят не чаще раза в DELIVERY_CHAT_INTERVAL
+секунд. После TelegramRetryAfter очередь целиком ждёт указанное время.
+
+Сообщение в чат, куда писать ещё рано, не держит задачу очереди: время
+для него занимается сразу, а само оно возвращается в очередь к этому
+времени.
+
+Пропускная способность и задержка в очереди видны в /queue_stats.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from settings import DELIVERY_CHAT_INTERVAL, DELIVERY_CONCURRENCY, DELIVERY_RATE
+
+# Сколько последних задержек держать для перцентилей
+_LAG_SAMPLES = 1000
+# Окно (в секундах) для подсчёта текущей скорости отправки
+_RATE_WINDOW = 60.0
+
+
+class TokenBucket:
+    """
+    Не больше rate операций в секунду с запасом burst.
+
+    По умолчанию запаса нет: операции идут равномерно, и ни в одну секунду
+    их не бывает больше rate.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать токены seconds секунд (Telegram попросил подождать)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    # Сообщения обычно ставятся «выстрелил и забыл»: ошибка учитывается
+    # в метриках, а asyncio не должен ругаться на незабранное исключение
+    if not future.cancelled():
+        future.exception()
+
+
+class DeliveryPipeline:
+    def __init__(self, rate: float, concurrency: int, chat_interval: float) -> None:
+        self._bucket = TokenBucket(rate)
+        self._concurrency = concurrency
+        self._chat_interval = chat_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # Когда в чат можно отправить следующее сообщение (time.monotonic())
+        self._chat_next: Dict[int, float] = {}
+        # Сообщения, отложенные до своего времени в чате
+        self.deferred = 0
+        self._lags: Deque[float] = deque(maxlen=_LAG_SAMPLES)
+        self._sent_at: Deque[float] = deque()
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.last_error = ""
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Поставить отправку в очередь; future завершится результатом call()."""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self._concurrency)]
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        self._queue.put_nowait((chat_id, call, future, time.monotonic(), False))
+        self.submitted += 1
+        return future
+
+    def send_message(self, bot: Bot, chat_id: int, text: str, **kwargs: Any) -> asyncio.Future:
+        return self.submit(chat_id, lambda: bot.send_message(chat_id, text, **kwargs))
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id, call, future, enqueued, paced = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                if not paced:
+                    delay = self._pace(chat_id)
+                    if delay > 0:
+                        self.deferred += 1
+                        asyncio.get_running_loop().call_later(
+                            delay, self._requeue, (chat_id, call, future, enqueued, True)
+                        )
+                        continue
+                await self._bucket.acquire()
+                self._lags.append(time.monotonic() - enqueued)
+                self.in_flight += 1
+                try:
+                    result = await call()
+                except Exception as e:
+                    self.failed += 1
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    if isinstance(e, TelegramRetryAfter):
+                        # Ограничение флуда действует на весь бот, а не на один чат
+                        self._bucket.pause(e.retry_after)
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    self.sent += 1
+                    self._mark_sent(time.monotonic())
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self.in_flight -= 1
+            finally:
+                self._queue.task_done()
+
+    def _pace(self, chat_id: int) -> float:
+        """Занять время отправки в чат; возвращает, сколько до него ждать."""
+        # Время занимаем сразу, чтобы следующее сообщение в тот же чат встало за нами
+        now = time.monotonic()
+        start = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = start + self._chat_interval
+        if len(self._chat_next) > 10000:
+            self._chat_next = {cid: at for cid, at in self._chat_next.items() if at > now}
+        return start - now
+
+    def _requeue(self, item: tuple) -> None:
+        # Сначала кладём в очередь, потом уменьшаем счётчик: join не увидит «пустоты»
+        self._queue.put_nowait(item)
+        self.deferred -= 1
+
+    def _mark_sent(self, now: float) -> None:
+        self._sent_at.append(now)
+        while self._sent_at[0] < now - _RATE_WINDOW:
+            self._sent_at.popleft()
+
+    async def join(self) -> None:
+        """Дождаться, пока очередь опустеет."""
+        if self._queue is None:
+            return
+        await self._queue.join()
+        while self.deferred:
+            await asyncio.sleep(min(self._chat_interval, 0.1))
+            await self._queue.join()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        per_second = sum(1 for at in self._sent_at if at >= now - _RATE_WINDOW) / _RATE_WINDOW
+        lags = sorted(self._lags)
+
+        def pct(p: float) -> float:
+            return lags[min(len(lags) - 1, int(len(lags) * p))] * 1000 if lags else 0.0
+
+        return {
+            "rate_limit": self._bucket.rate,
+            "concurrency": self._concurrency,
+            "queued": (self._queue.qsize() if self._queue is not None else 0) + self.deferred,
+            "in_flight": self.in_flight,
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "failed": self.failed,
+            "per_second": per_second,
+            "lag_p50_ms": pct(0.5),
+            "lag_p99_ms": pct(0.99),
+            "lag_max_ms": lags[-1] * 1000 if lags else 0.0,
+            "last_error": self.last_error,
+        }
+
+
+delivery = DeliveryPipeline(DELIVERY_RATE, DELIVERY_CONCURRENCY, DELIVERY_CHAT_INTERVAL)
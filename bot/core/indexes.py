@@ -0,0 +1,34 @@
+"""
+Построение индексов в памяти при старте.
+
+Пользователи, статистика и число друзей читаются из хранилища один раз,
+и по этому снимку строятся расписание напоминаний (reminder_scheduler),
+общая статистика (bot_aggregates), рейтинги (leaderboards) и индексы
+пользователей (user_index). Дальше все они обновляются слушателями
+сохранений, изменений дружб и инкрементов.
+
+user_index.ready выставляется последним: после него все индексы готовы.
+main дожидается build_indexes до начала приёма апдейтов, поэтому ошибка
+чтения хранилища останавливает запуск, а не оставляет индексы пустыми.
+Обработчики ready не ждут (ожидание держало бы слот пула апдейтов), а
+отвечают INDEXES_NOT_READY из user_index.
+"""
+from bot.core.aggregates import bot_aggregates
+from bot.core.leaderboards import leaderboards
+from bot.core.reminders import reminder_scheduler
+from bot.core.user_index import user_index
+from bot.storage.async_repo import AsyncRepository
+
+
+async def build_indexes(
+    users_repo: AsyncRepository,
+    stats_repo: AsyncRepository,
+    friends_repo: AsyncRepository,
+) -> None:
+    users = list((await users_repo.get_all_users()).values())
+    stats = list((await stats_repo.get_all()).values())
+    friend_counts = await friends_repo.friend_counts()
+    reminder_scheduler.rebuild(users)
+    bot_aggregates.rebuild(users, stats, friend_counts)
+    leaderboards.rebuild(users, stats, friend_counts)
+    user_index.rebuild(users, friend_counts)
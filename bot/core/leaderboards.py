@@ -0,0 +1,152 @@
+"""
+Рейтинги пользователей: монеты, счастье, часы сна, число друзей и
+активность (кормления, вода, работа, хобби).
+
+Каждый рейтинг — отсортированный список (-очки, user_id), который
+обновляется на каждое сохранение пользователя, изменение дружбы и
+инкремент статистики.
+Место пользователя ищется бинарным поиском за O(log n), топ-K — срез
+начала списка, поэтому ни /leaderboard, ни /bot_stats не сортируют всех
+пользователей.
+
+При равных очках место общее: 1 + число пользователей с большими очками.
+"""
+import bisect
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bot.core.models import UserState
+from bot.core.stats import UserStats
+
+COINS = "coins"
+HAPPINESS = "happiness"
+SLEEP = "sleep"
+FRIENDS = "friends"
+ACTIVITY = "activity"
+
+_ACTIVITY_FIELDS = ("feed_events", "water_events", "work_sessions", "hobby_sessions")
+
+# Рейтинги, которые считаются по инкрементам статистики
+_STATS_BOARDS = (SLEEP, ACTIVITY)
+
+
+class Leaderboard:
+    def __init__(self) -> None:
+        self._score: Dict[int, float] = {}
+        # (-очки, user_id) по возрастанию: лучшие в начале
+        self._order: List[Tuple[float, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def load(self, scores: Dict[int, float]) -> None:
+        self._score = dict(scores)
+        self._order = sorted((-score, user_id) for user_id, score in scores.items())
+
+    def items(self) -> List[Tuple[int, float]]:
+        return list(self._score.items())
+
+    def score(self, user_id: int) -> Optional[float]:
+        return self._score.get(user_id)
+
+    def set(self, user_id: int, score: float) -> None:
+        old = self._score.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            del self._order[bisect.bisect_left(self._order, (-old, user_id))]
+        bisect.insort(self._order, (-score, user_id))
+        self._score[user_id] = score
+
+    def add(self, user_id: int, delta: float) -> None:
+        self.set(user_id, self._score.get(user_id, 0) + delta)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Место пользователя (с 1) или None, если его нет в рейтинге."""
+        score = self._score.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self._order, (-score, float("-inf"))) + 1
+
+    def top(self, k: int) -> List[Tuple[int, float]]:
+        return [(user_id, -score) for score, user_id in self._order[:k]]
+
+
+class Leaderboards:
+    def __init__(self) -> None:
+        # Сохранения и инкременты приходят из потоков хранилища
+        self._lock = threading.Lock()
+        self._boards: Dict[str, Leaderboard] = {
+            name: Leaderboard() for name in (COINS, HAPPINESS, SLEEP, FRIENDS, ACTIVITY)
+        }
+        self._names: Dict[int, str] = {}
+
+    def rebuild(
+        self,
+        users: Iterable[UserState],
+        stats: Iterable[UserStats],
+        friend_counts: Dict[int, int],
+    ) -> None:
+        scores: Dict[str, Dict[int, float]] = {name: {} for name in self._boards}
+        names: Dict[int, str] = {}
+        for user in users:
+            names[user.user_id] = user.pet.name
+            scores[COINS][user.user_id] = user.pet.money
+            scores[HAPPINESS][user.user_id] = user.pet.happiness
+        # В рейтинге друзей — те, у кого есть или были друзья
+        scores[FRIENDS].update(friend_counts)
+        for s in stats:
+            scores[SLEEP][s.user_id] = s.total_sleep_minutes / 60
+            scores[ACTIVITY][s.user_id] = sum(getattr(s, field) for field in _ACTIVITY_FIELDS)
+        with self._lock:
+            for name, board in self._boards.items():
+                merged = scores[name]
+                for user_id, score in board.items():
+                    if name in _STATS_BOARDS:
+                        # Инкременты, пришедшие во время чтения снимка, прибавляются к нему
+                        merged[user_id] = merged.get(user_id, 0) + score
+                    else:
+                        # Пользователи и дружбы, сохранённые во время чтения снимка, уже учтены по свежим данным
+                        merged[user_id] = score
+                board.load(merged)
+            names.update(self._names)
+            self._names = names
+
+    def on_user_saved(self, user: UserState) -> None:
+        """Слушатель UsersRepository.add_save_listener."""
+        with self._lock:
+            self._names[user.user_id] = user.pet.name
+            self._boards[COINS].set(user.user_id, user.pet.money)
+            self._boards[HAPPINESS].set(user.user_id, user.pet.happiness)
+
+    def on_friends_changed(self, user_id: int, count: int) -> None:
+        """Слушатель FriendsRepository.add_change_listener."""
+        with self._lock:
+            self._boards[FRIENDS].set(user_id, count)
+
+    def on_stats_increment(self, user_id: int, deltas: Dict[str, int]) -> None:
+        """Слушатель StatsRepository.add_increment_listener."""
+        with self._lock:
+            sleep = deltas.get("total_sleep_minutes", 0)
+            if sleep:
+                self._boards[SLEEP].add(user_id, sleep / 60)
+            activity = sum(deltas.get(field, 0) for field in _ACTIVITY_FIELDS)
+            if activity:
+                self._boards[ACTIVITY].add(user_id, activity)
+
+    def rank(self, board: str, user_id: int) -> Tuple[Optional[int], float, int]:
+        """(место или None, очки, всего в рейтинге)."""
+        with self._lock:
+            b = self._boards[board]
+            return b.rank(user_id), b.score(user_id) or 0, len(b)
+
+    def top(self, board: str, k: int) -> List[Tuple[int, str, float]]:
+        """Топ-k рейтинга: (user_id, имя выдры, очки)."""
+        with self._lock:
+            return [
+                (user_id, self._names.get(user_id, "Неизвестно"), score)
+                for user_id, score in self._boards[board].top(k)
+            ]
+
+
+leaderboards = Leaderboards()
@@ -0,0 +1,175 @@
+"""
+Почтовые ящики пользователей.
+
+Каждый апдейт (и фоновая работа над пользователем, например напоминания)
+кладётся в ящик своего пользователя. Ящик разбирается строго по порядку,
+поэтому работа над одним пользователем никогда не идёт параллельно сама с
+собой, а разные пользователи обслуживаются одновременно — не больше
+UPDATE_WORKERS задач сразу.
+
+Ящик существует, пока в нём есть работа: разобранный ящик удаляется.
+Для поиска «горячих» пользователей ведутся метрики — глубина очереди и
+время ожидания в ней (команда /queue_stats) — по последним
+_METRICS_USERS активным пользователям.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from settings import UPDATE_WORKERS
+
+# Сколько последних ожиданий держать для перцентилей
+_WAIT_SAMPLES = 1000
+# По скольким последним активным пользователям держать метрики
+_METRICS_USERS = 1000
+
+
+class _Mailbox:
+    def __init__(self) -> None:
+        self.queue: Deque[Tuple[Callable[[], Awaitable[Any]], asyncio.Future, float]] = deque()
+        self.running = False
+
+
+class _UserMetrics:
+    def __init__(self) -> None:
+        self.processed = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class UserMailboxes:
+    def __init__(self, workers: int) -> None:
+        self._workers = workers
+        self._semaphore = asyncio.Semaphore(workers)
+        self._boxes: Dict[int, _Mailbox] = {}
+        self._metrics: OrderedDict[int, _UserMetrics] = OrderedDict()
+        self._drainers: Set[asyncio.Task] = set()
+        self._waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self.active = 0
+
+    def submit(self, user_id: int, job: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Поставить работу в ящик пользователя; future завершится её результатом."""
+        future = asyncio.get_running_loop().create_future()
+        box = self._boxes.get(user_id)
+        if box is None:
+            box = self._boxes[user_id] = _Mailbox()
+        box.queue.append((job, future, time.monotonic()))
+        metrics = self._metrics_for(user_id)
+        metrics.max_depth = max(metrics.max_depth, len(box.queue))
+        if not box.running:
+            box.running = True
+            task = asyncio.create_task(self._drain(user_id, box))
+            self._drainers.add(task)
+            task.add_done_callback(self._drainers.discard)
+        return future
+
+    def _metrics_for(self, user_id: int) -> _UserMetrics:
+        """Метрики пользователя; самые давние вытесняются сверх _METRICS_USERS."""
+        metrics = self._metrics.get(user_id)
+        if metrics is None:
+            metrics = self._metrics[user_id] = _UserMetrics()
+            if len(self._metrics) > _METRICS_USERS:
+                self._metrics.popitem(last=False)
+        else:
+            self._metrics.move_to_end(user_id)
+        return metrics
+
+    async def _drain(self, user_id: int, box: _Mailbox) -> None:
+        try:
+            while box.queue:
+                job, future, enqueued = box.queue[0]
+                # Слот пула берём на каждую задачу, чтобы «горячий» пользователь его не занимал
+                async with self._semaphore:
+                    box.queue.popleft()
+                    wait = time.monotonic() - enqueued
+                    metrics = self._metrics_for(user_id)
+                    metrics.processed += 1
+                    metrics.total_wait += wait
+                    metrics.max_wait = max(metrics.max_wait, wait)
+                    self._waits.append(wait)
+                    if future.cancelled():
+                        continue
+                    self.active += 1
+                    try:
+                        result = await job()
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+                    finally:
+                        self.active -= 1
+        finally:
+            box.running = False
+            # Между проверкой очереди и этим местом нет await, так что новая
+            # работа сюда попасть не могла; следующая заведёт новый ящик
+            if not box.queue and self._boxes.get(user_id) is box:
+                del self._boxes[user_id]
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        """Сводка для /queue_stats: общие цифры и самые загруженные пользователи."""
+        waits = sorted(self._waits)
+
+        def pct(p: float) -> float:
+            return waits[min(len(waits) - 1, int(len(waits) * p))] * 1000 if waits else 0.0
+
+        def depth(user_id: int) -> int:
+            box = self._boxes.get(user_id)
+            return len(box.queue) if box is not None else 0
+
+        hot: List[Tuple[int, _UserMetrics]] = sorted(
+            self._metrics.items(),
+            key=lambda item: (depth(item[0]), item[1].max_wait),
+            reverse=True,
+        )[:top]
+        return {
+            "workers": self._workers,
+            "active": self.active,
+            "queued": sum(len(box.queue) for box in self._boxes.values()),
+            "users": len(self._boxes),
+            "wait_p50_ms": pct(0.5),
+            "wait_p99_ms": pct(0.99),
+            "wait_max_ms": waits[-1] * 1000 if waits else 0.0,
+            "hot_users": [
+                {
+                    "user_id": user_id,
+                    "depth": depth(user_id),
+                    "max_depth": metrics.max_depth,
+                    "processed": metrics.processed,
+                    "avg_wait_ms": metrics.total_wait / metrics.processed * 1000 if metrics.processed else 0.0,
+                    "max_wait_ms": metrics.max_wait * 1000,
+                }
+                for user_id, metrics in hot
+            ],
+        }
+
+
+class MailboxMiddleware(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: обработка апдейта выполняется в ящике его
+    отправителя. Ставится после UserContextMiddleware aiogram, который
+    кладёт отправителя в data["event_from_user"].
+    """
+
+    def __init__(self, mailboxes: UserMailboxes) -> None:
+        self._mailboxes = mailboxes
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        return await self._mailboxes.submit(user.id, lambda: handler(event, data))
+
+
+user_mailboxes = UserMailboxes(UPDATE_WORKERS)
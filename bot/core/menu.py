@@ -3,7 +3,6 @@
 """
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from datetime import datetime, date, timedelta
-from zoneinfo import ZoneInfo
 
 from bot.core.models import UserState, DailyStats
 from bot.core.advice import get_advice_for_today, get_weekly_advice_summary, get_monthly_advice_summary
@@ -104,11 +103,6 @@ def format_weekly_stats(user: UserState) -> str:
     Форматирует детальную персонализированную статистику за неделю.
     С разбивкой по дням и сравнением с выдрой.
     """
-    try:
-        tz = ZoneInfo(user.settings.timezone)
-    except Exception:
-        tz = ZoneInfo("Asia/Vladivostok")
-    
     today = date.today()
     week_dates = [today - timedelta(days=i) for i in range(7)]
     
@@ -1,8 +1,8 @@
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Set
 
 
-@dataclass
+@dataclass(slots=True)
 class PetState:
     name: str
     avatar_key: str = "awake"  # ключ для выбора изображения выдры
@@ -28,7 +28,7 @@ class PetState:
     vacation_mode: bool = False  # Режим отпуска (для редких пользователей)
 
 
-@dataclass
+@dataclass(slots=True)
 class UserSettings:
     timezone: str
     pet_name: Optional[str] = None
@@ -38,7 +38,7 @@ class UserSettings:
     sleep_norm_hours: float = 0.0  # норма сна в день (часы), 0 означает не установлена
 
 
-@dataclass
+@dataclass(slots=True)
 class DailyStats:
     """Статистика за один день"""
     date: str  # ISO дата
@@ -50,7 +50,7 @@ class DailyStats:
     pet_water_glasses: int = 0  # сколько стаканов воды выпила выдра
 
 
-@dataclass
+@dataclass(slots=True)
 class AdviceState:
     """Состояние системы советов для пользователя"""
     last_advice_date: Optional[str] = None  # дата последнего полученного совета
@@ -61,6 +61,8 @@ class AdviceState:
     weekly_answers: Dict[str, bool] = field(default_factory=dict)  # дата недели -> соблюдал ли советы (True/False)
 
 
+# Без slots: поля истории разбираются лениво (см. _LazyHistory ниже) и
+# после разбора лежат в __dict__ экземпляра
 @dataclass
 class UserState:
     user_id: int
@@ -74,16 +76,80 @@ class UserState:
     active_quests: Dict[str, Dict] = field(default_factory=dict)  # ID квеста -> данные квеста
     work_stats: Dict[str, any] = field(default_factory=dict)  # Статистика работы
     last_fatigue_update: Optional[str] = None  # ISO дата последнего обновления усталости
-    friendships: Dict[int, 'Friendship'] = field(default_factory=dict)  # friend_id -> Friendship
 
 
-@dataclass
+def daily_stats_from_dict(raw: Dict) -> Dict[str, DailyStats]:
+    return {date: DailyStats(**stats_data) for date, stats_data in raw.items()}
+
+
+def advice_state_from_dict(raw: Dict) -> AdviceState:
+    # Старые/лишние ключи игнорируются
+    names = AdviceState.__dataclass_fields__
+    return AdviceState(**{k: v for k, v in raw.items() if k in names})
+
+
+class _LazyHistory:
+    """
+    Поле истории UserState, которое разбирается при первом обращении.
+
+    user_from_dict кладёт сохранённый словарь поля в user._lazy, а сам
+    атрибут не задаёт; первое чтение разбирает словарь и записывает
+    результат в экземпляр, дальше атрибут читается как обычный.
+    """
+
+    def __init__(self, name: str, decode) -> None:
+        self.name = name
+        self.decode = decode
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        raw = instance.__dict__.get("_lazy", {}).pop(self.name, {})
+        value = self.decode(raw)
+        instance.__dict__[self.name] = value
+        return value
+
+
+# Поля истории: в записи пользователя их больше всего, а нужны они немногим обработчикам
+LAZY_USER_FIELDS = {
+    "work_hours_by_date": dict,
+    "daily_stats": daily_stats_from_dict,
+    "advice_state": advice_state_from_dict,
+}
+for _name, _decode in LAZY_USER_FIELDS.items():
+    setattr(UserState, _name, _LazyHistory(_name, _decode))
+
+
+def defer_history(user: UserState, data: Dict) -> None:
+    """Отложить разбор полей истории до первого обращения; data — сохранённый словарь пользователя."""
+    lazy = {}
+    for name in LAZY_USER_FIELDS:
+        user.__dict__.pop(name, None)
+        lazy[name] = data.get(name) or {}
+    user.__dict__["_lazy"] = lazy
+
+
+def history_loaded(user: UserState, name: str) -> bool:
+    """Разобрано ли поле истории (могло ли оно измениться с загрузки)."""
+    return name not in user.__dict__.get("_lazy", ())
+
+
+@dataclass(slots=True)
+class PetSummary:
+    """Выдра в списках (друзья, подсказки): только то, что показывается."""
+    user_id: int
+    name: str
+    age_days: int = 0
+    is_alive: bool = True
+
+
+@dataclass(slots=True)
 class AdminSettings:
     admin_ids: List[int] = field(default_factory=list)
     required_channel_username: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Hobby:
     id: str
     title: str
@@ -95,7 +161,7 @@ class Hobby:
     duration_minutes: int = 60  # длительность сессии в минутах
 
 
-@dataclass
+@dataclass(slots=True)
 class HobbySession:
     """Активная сессия хобби"""
     hobby_id: str
@@ -103,7 +169,7 @@ class HobbySession:
     duration_minutes: int
 
 
-@dataclass
+@dataclass(slots=True)
 class HobbyMastery:
     """Уровень мастерства в хобби"""
     hobby_id: str
@@ -113,34 +179,132 @@ class HobbyMastery:
     last_session_date: Optional[str] = None  # дата последней сессии (для стрика)
 
 
+# Словари для сохранения собираются вручную: dataclasses.asdict рекурсивно
+# копирует каждое значение и заметно медленнее. Списки и словари копируются
+# на один уровень, как их и хранят модели.
+
+
 def hobby_to_dict(hobby: Hobby) -> Dict:
-    return asdict(hobby)
+    return {
+        "id": hobby.id,
+        "title": hobby.title,
+        "price": hobby.price,
+        "avatar_key": hobby.avatar_key,
+        "hobby_type": hobby.hobby_type,
+        "base_happiness": hobby.base_happiness,
+        "base_fatigue_recovery": hobby.base_fatigue_recovery,
+        "duration_minutes": hobby.duration_minutes,
+    }
+
+
+def hobby_session_to_dict(session: HobbySession) -> Dict:
+    return {
+        "hobby_id": session.hobby_id,
+        "start_time": session.start_time,
+        "duration_minutes": session.duration_minutes,
+    }
+
+
+def hobby_mastery_to_dict(mastery: HobbyMastery) -> Dict:
+    return {
+        "hobby_id": mastery.hobby_id,
+        "level": mastery.level,
+        "total_sessions": mastery.total_sessions,
+        "streak": mastery.streak,
+        "last_session_date": mastery.last_session_date,
+    }
 
 
 def pet_to_dict(pet: PetState) -> Dict:
-    return asdict(pet)
+    return {
+        "name": pet.name,
+        "avatar_key": pet.avatar_key,
+        "happiness": pet.happiness,
+        "energy": pet.energy,
+        "hunger": pet.hunger,
+        "thirst": pet.thirst,
+        "age_days": pet.age_days,
+        "is_alive": pet.is_alive,
+        "free_revives_left": pet.free_revives_left,
+        "last_sleep_start": pet.last_sleep_start,
+        "last_wake_time": pet.last_wake_time,
+        "unlocked_hobbies": list(pet.unlocked_hobbies),
+        "hobby_sessions": hobby_session_to_dict(pet.hobby_sessions) if pet.hobby_sessions else None,
+        "hobby_mastery": {
+            hobby_id: hobby_mastery_to_dict(mastery) for hobby_id, mastery in pet.hobby_mastery.items()
+        },
+        "money": pet.money,
+        "at_work": pet.at_work,
+        "last_work_start": pet.last_work_start,
+        "last_interaction": pet.last_interaction,
+        "fatigue": pet.fatigue,
+        "unlocked_achievements": list(pet.unlocked_achievements),
+        "critical_state_since": pet.critical_state_since,
+        "vacation_mode": pet.vacation_mode,
+    }
+
+
+def pet_from_dict(data: Dict) -> PetState:
+    """PetState из сохранённого словаря; старые/лишние ключи игнорируются."""
+    names = PetState.__dataclass_fields__
+    pet = PetState(**{k: v for k, v in data.items() if k in names})
+    # Вложенные объекты сохранены словарями
+    if isinstance(pet.hobby_sessions, dict):
+        pet.hobby_sessions = HobbySession(**pet.hobby_sessions)
+    pet.hobby_mastery = {
+        hobby_id: HobbyMastery(**mastery) if isinstance(mastery, dict) else mastery
+        for hobby_id, mastery in pet.hobby_mastery.items()
+    }
+    return pet
 
 
 def daily_stats_to_dict(stats: DailyStats) -> Dict:
-    return asdict(stats)
+    return {
+        "date": stats.date,
+        "sleep_minutes": stats.sleep_minutes,
+        "water_liters": stats.water_liters,
+        "wake_time": stats.wake_time,
+        "sleep_time": stats.sleep_time,
+        "pet_sleep_minutes": stats.pet_sleep_minutes,
+        "pet_water_glasses": stats.pet_water_glasses,
+    }
 
 
 def advice_state_to_dict(advice: AdviceState) -> Dict:
-    return asdict(advice)
+    return {
+        "last_advice_date": advice.last_advice_date,
+        "shown_advice_ids": list(advice.shown_advice_ids),
+        "week_start_date": advice.week_start_date,
+        "monthly_advice_summary": {
+            category: list(items) for category, items in advice.monthly_advice_summary.items()
+        },
+        "first_advice_date": advice.first_advice_date,
+        "weekly_answers": dict(advice.weekly_answers),
+    }
 
 
-def friendship_to_dict(friendship: Friendship) -> Dict:
+def friendship_to_dict(friendship: 'Friendship') -> Dict:
     """Преобразует Friendship в словарь для сохранения"""
-    return asdict(friendship)
+    return {
+        "user_id_1": friendship.user_id_1,
+        "user_id_2": friendship.user_id_2,
+        "friendship_level": friendship.friendship_level,
+        "total_sessions_together": friendship.total_sessions_together,
+        "first_met_date": friendship.first_met_date,
+        "last_interaction": friendship.last_interaction,
+        "social_bonuses": dict(friendship.social_bonuses),
+    }
+
+
+def _history_to_dict(user: UserState, name: str, encode):
+    # Неразобранное поле не менялось: записываем сохранённый словарь как есть
+    lazy = user.__dict__.get("_lazy")
+    if lazy is not None and name in lazy:
+        return lazy[name]
+    return encode(getattr(user, name))
 
 
 def user_to_dict(user: UserState) -> Dict:
-    # Преобразуем friendships в словарь
-    friendships_dict = {}
-    if hasattr(user, 'friendships') and user.friendships:
-        for friend_id, friendship in user.friendships.items():
-            friendships_dict[str(friend_id)] = friendship_to_dict(friendship)
-    
     return {
         "user_id": user.user_id,
         "pet": pet_to_dict(user.pet),
@@ -153,24 +317,28 @@ def user_to_dict(user: UserState) -> Dict:
             "sleep_norm_hours": user.settings.sleep_norm_hours,
         },
         "last_reminders": user.last_reminders,
-        "work_hours_by_date": user.work_hours_by_date,
-        "daily_stats": {
-            date: daily_stats_to_dict(stats) for date, stats in user.daily_stats.items()
-        },
-        "advice_state": advice_state_to_dict(user.advice_state),
+        "work_hours_by_date": _history_to_dict(user, "work_hours_by_date", lambda hours: hours),
+        "daily_stats": _history_to_dict(
+            user,
+            "daily_stats",
+            lambda daily: {date: daily_stats_to_dict(stats) for date, stats in daily.items()},
+        ),
+        "advice_state": _history_to_dict(user, "advice_state", advice_state_to_dict),
         "last_main_menu_return": user.last_main_menu_return,
         "active_quests": user.active_quests,
         "work_stats": user.work_stats,
         "last_fatigue_update": user.last_fatigue_update,
-        "friendships": friendships_dict,
     }
 
 
 def admin_to_dict(admin: AdminSettings) -> Dict:
-    return asdict(admin)
+    return {
+        "admin_ids": list(admin.admin_ids),
+        "required_channel_username": admin.required_channel_username,
+    }
 
 
-@dataclass
+@dataclass(slots=True)
 class Friendship:
     """Дружба между двумя пользователями"""
     user_id_1: int
@@ -183,7 +351,7 @@ class Friendship:
     # bonuses: {"happiness": 10, "money": 5, "experience": 3}
 
 
-@dataclass
+@dataclass(slots=True)
 class SocialAchievement:
     """Совместное достижение (для двух и более выдр)"""
     id: str
@@ -196,7 +364,7 @@ class SocialAchievement:
     reward_experience: int = 0
 
 
-@dataclass
+@dataclass(slots=True)
 class CoopSession:
     """Сессия совместной активности"""
     id: str
@@ -0,0 +1,331 @@
+"""
+Исходящий ящик уведомлений.
+
+Напоминания и уведомления не отправляются напрямую, а записываются в
+хранилище (outbox.json в режиме "journal" или таблица SQLite) под ключом
+дедупликации, например "42:water_morning:2025-01-31". Повторная постановка
+с тем же ключом ничего не делает, поэтому после рестарта напоминание не
+уйдёт второй раз.
+
+Фоновый outbox.run(bot) отправляет записи через очередь delivery:
+- TelegramRetryAfter — ждём столько, сколько просит Telegram, и пробуем
+  снова (попыткой это не считается);
+- бот заблокирован, чат не найден, неверный запрос — повторять бесполезно,
+  запись сразу уходит в dead-letter;
+- остальные ошибки — повтор с экспоненциальной паузой, после
+  OUTBOX_MAX_ATTEMPTS попыток запись уходит в dead-letter.
+
+Ящик держит в памяти индекс ключей по статусам и кучу pending-записей по
+времени следующей попытки; строится он одним проходом при первом
+обращении, так что ни выбор очередных записей, ни счётчики, ни чистка
+не читают хранилище целиком.
+
+Отправленные записи хранятся OUTBOX_KEEP_HOURS часов (только ради ключа
+дедупликации), затем удаляются. Если процесс упал между отправкой и
+отметкой «отправлено», сообщение уйдёт ещё раз: доставка «хотя бы
+один раз».
+"""
+import asyncio
+import heapq
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import aiogram.types
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+)
+
+from bot.core.backends import get_outbox_repo
+from bot.core.delivery import DeliveryPipeline, delivery
+from bot.storage.async_repo import AsyncRepository, as_async
+from bot.storage.json_db import JsonDB
+from settings import (
+    OUTBOX_BACKOFF_BASE,
+    OUTBOX_BACKOFF_MAX,
+    OUTBOX_KEEP_HOURS,
+    OUTBOX_MAX_ATTEMPTS,
+)
+
+PENDING = "pending"
+SENT = "sent"
+DEAD = "dead"
+
+# Повторять такие ошибки бесполезно
+_PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest, TelegramNotFound)
+
+# Как часто удалять старые отправленные записи, с
+_PRUNE_INTERVAL = 3600.0
+# Пауза цикла отправки после ошибки хранилища, с
+_LOOP_ERROR_DELAY = 5.0
+
+
+@dataclass
+class OutboxMessage:
+    key: str
+    chat_id: int
+    text: str
+    # Клавиатура в виде {"type": имя класса aiogram, "data": поля}
+    reply_markup: Optional[Dict[str, Any]] = None
+    status: str = PENDING
+    attempts: int = 0
+    next_attempt_at: float = 0.0
+    created_at: float = 0.0
+    sent_at: Optional[float] = None
+    last_error: str = ""
+
+
+def dump_markup(markup: Any) -> Optional[Dict[str, Any]]:
+    if markup is None:
+        return None
+    return {"type": type(markup).__name__, "data": markup.model_dump(mode="json", exclude_none=True)}
+
+
+def load_markup(data: Optional[Dict[str, Any]]) -> Any:
+    if not data:
+        return None
+    return getattr(aiogram.types, data["type"]).model_validate(data["data"])
+
+
+class OutboxRepository:
+    def __init__(self, db: Optional[Any] = None) -> None:
+        self._db = db if db is not None else JsonDB("outbox.json", mode="journal")
+        # Делает «проверить ключ — записать» и обновление индекса атомарными между потоками
+        self._lock = threading.Lock()
+        # Индекс строится при первом обращении (_ensure_index)
+        self._indexed = False
+        self._keys: Dict[str, Set[str]] = {PENDING: set(), SENT: set(), DEAD: set()}
+        # Актуальное время попытки pending-записей, которые ещё не выданы claim
+        self._due: Dict[str, float] = {}
+        # (время попытки, ключ); устаревшие элементы отбрасываются по _due
+        self._heap: List[Tuple[float, str]] = []
+        # (время отправки, ключ) для prune_sent
+        self._sent_heap: List[Tuple[float, str]] = []
+
+    def _ensure_index(self) -> None:
+        if self._indexed:
+            return
+        for _, data in self._db.iter_items():
+            self._track(OutboxMessage(**data))
+        self._indexed = True
+
+    def _track(self, message: OutboxMessage) -> None:
+        for keys in self._keys.values():
+            keys.discard(message.key)
+        self._keys.setdefault(message.status, set()).add(message.key)
+        self._due.pop(message.key, None)
+        if message.status == PENDING:
+            self._due[message.key] = message.next_attempt_at
+            heapq.heappush(self._heap, (message.next_attempt_at, message.key))
+            # Повторные попытки оставляют в куче устаревшие элементы; не даём им копиться
+            if len(self._heap) > 4 * (len(self._due) + 1):
+                self._heap = [(at, key) for key, at in self._due.items()]
+                heapq.heapify(self._heap)
+        elif message.status == SENT:
+            heapq.heappush(self._sent_heap, (message.sent_at or 0.0, message.key))
+
+    def add(self, message: OutboxMessage) -> bool:
+        """Записать сообщение, если ключа ещё нет. Возвращает False для дубликата."""
+        with self._lock:
+            self._ensure_index()
+            if self._db.get(message.key) is not None:
+                return False
+            self._db.set(message.key, asdict(message))
+            self._track(message)
+            return True
+
+    def get(self, key: str) -> Optional[OutboxMessage]:
+        data = self._db.get(key)
+        return OutboxMessage(**data) if data else None
+
+    def save(self, message: OutboxMessage) -> None:
+        with self._lock:
+            self._ensure_index()
+            self._db.set(message.key, asdict(message))
+            self._track(message)
+
+    def claim(self, now: float) -> List[str]:
+        """
+        Ключи pending-записей, чьё время пришло, по порядку. Выданный ключ
+        снова попадёт сюда только после save со статусом pending.
+        """
+        with self._lock:
+            self._ensure_index()
+            keys = []
+            while self._heap and self._heap[0][0] <= now:
+                at, key = heapq.heappop(self._heap)
+                if self._due.get(key) == at:
+                    del self._due[key]
+                    keys.append(key)
+            return keys
+
+    def release(self, key: str, at: float) -> None:
+        """Вернуть выданный claim ключ в очередь, не трогая запись (до save дело не дошло)."""
+        with self._lock:
+            self._ensure_index()
+            if key in self._keys[PENDING] and key not in self._due:
+                self._due[key] = at
+                heapq.heappush(self._heap, (at, key))
+
+    def next_attempt_at(self) -> Optional[float]:
+        """Время ближайшей попытки среди ещё не выданных записей."""
+        with self._lock:
+            self._ensure_index()
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def dead(self) -> List[OutboxMessage]:
+        with self._lock:
+            self._ensure_index()
+            keys = list(self._keys[DEAD])
+        messages = [m for m in (self.get(key) for key in keys) if m is not None]
+        return sorted(messages, key=lambda m: m.created_at)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            self._ensure_index()
+            return {status: len(keys) for status, keys in self._keys.items()}
+
+    def prune_sent(self, before: float) -> int:
+        """Удалить отправленные записи старше before; их ключи больше не нужны."""
+        with self._lock:
+            self._ensure_index()
+            pruned = 0
+            while self._sent_heap and self._sent_heap[0][0] < before:
+                _, key = heapq.heappop(self._sent_heap)
+                if key in self._keys[SENT]:
+                    self._keys[SENT].discard(key)
+                    self._db.delete(key)
+                    pruned += 1
+            return pruned
+
+    def requeue_dead(self, now: float) -> List[OutboxMessage]:
+        """Вернуть все записи из dead-letter в очередь с нулевым счётчиком попыток."""
+        requeued = []
+        for m in self.dead():
+            m.status = PENDING
+            m.attempts = 0
+            m.next_attempt_at = now
+            self.save(m)
+            requeued.append(m)
+        return requeued
+
+
+def backoff(attempts: int) -> float:
+    """Пауза перед следующей попыткой после attempts неудачных."""
+    return min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+
+
+class Outbox:
+    def __init__(self, repo: AsyncRepository, pipeline: DeliveryPipeline) -> None:
+        self.repo = repo
+        self._pipeline = pipeline
+        self._tasks: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        # Сбои _deliver подряд по ключу: от них зависит пауза перед возвратом в очередь
+        self._failures: Dict[str, int] = {}
+
+    async def enqueue(self, key: str, chat_id: int, text: str, reply_markup: Any = None) -> bool:
+        """
+        Поставить уведомление в ящик. Возвращает False, если сообщение с
+        таким ключом уже было поставлено (или отправлено).
+        """
+        now = time.time()
+        message = OutboxMessage(
+            key=key,
+            chat_id=chat_id,
+            text=text,
+            reply_markup=dump_markup(reply_markup),
+            next_attempt_at=now,
+            created_at=now,
+        )
+        if not await self.repo.add(message):
+            return False
+        self._wake()
+        return True
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def requeue_dead(self) -> int:
+        messages = await self.repo.requeue_dead(time.time())
+        if messages:
+            self._wake()
+        return len(messages)
+
+    async def run(self, bot: Bot) -> None:
+        """Фоновая отправка; при старте подхватывает всё, что не ушло до рестарта."""
+        self._wakeup = asyncio.Event()
+        next_prune = 0.0
+
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            # Одна ошибка хранилища не должна останавливать отправку уведомлений
+            try:
+                if now >= next_prune:
+                    # Срок сдвигаем заранее: упавшая чистка повторится через час, а не на каждом круге
+                    next_prune = now + _PRUNE_INTERVAL
+                    await self.repo.prune_sent(now - OUTBOX_KEEP_HOURS * 3600)
+                for key in await self.repo.claim(now):
+                    task = asyncio.create_task(self._deliver(bot, key))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                next_at = await self.repo.next_attempt_at()
+                delay = min(next_at - now, 60.0) if next_at is not None else 60.0
+            except Exception as e:
+                print(f"Error in outbox loop: {e!r}")
+                delay = _LOOP_ERROR_DELAY
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0.0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, bot: Bot, key: str) -> None:
+        try:
+            await self._send(bot, key)
+        except Exception as e:
+            # Ключ уже выдан claim: без возврата запись ждала бы рестарта
+            failures = self._failures[key] = self._failures.get(key, 0) + 1
+            print(f"Error in outbox delivery of {key}: {e!r}")
+            await self.repo.release(key, time.time() + backoff(failures))
+            self._wake()
+        else:
+            self._failures.pop(key, None)
+
+    async def _send(self, bot: Bot, key: str) -> None:
+        message = await self.repo.get(key)
+        if message is None or message.status != PENDING:
+            return
+        markup = load_markup(message.reply_markup)
+        try:
+            await self._pipeline.send_message(bot, message.chat_id, message.text, reply_markup=markup)
+        except TelegramRetryAfter as e:
+            message.next_attempt_at = time.time() + e.retry_after
+            message.last_error = f"RetryAfter {e.retry_after}s"
+        except Exception as e:
+            message.attempts += 1
+            message.last_error = f"{type(e).__name__}: {e}"
+            if isinstance(e, _PERMANENT_ERRORS) or message.attempts >= OUTBOX_MAX_ATTEMPTS:
+                message.status = DEAD
+            else:
+                message.next_attempt_at = time.time() + backoff(message.attempts)
+        else:
+            message.status = SENT
+            message.sent_at = time.time()
+            # Для дедупликации достаточно ключа
+            message.text = ""
+            message.reply_markup = None
+        await self.repo.save(message)
+        if message.status == PENDING:
+            self._wake()
+
+
+outbox = Outbox(as_async(get_outbox_repo()), delivery)
@@ -0,0 +1,228 @@
+"""
+Расписание напоминаний.
+
+Для каждого пользователя и каждого личного события (ежедневный возраст,
+ежемесячный отчёт, лимит работы, уведомление о смерти) хранится
+ближайший момент, когда оно может сработать. Моменты лежат в куче,
+поэтому воркер напоминаний каждую минуту трогает только тех
+пользователей, у кого что-то наступило, а не всех подряд.
+
+Напоминания по времени и еженедельный отчёт зависят только от часового
+пояса, поэтому планируются один раз на пояс: когда такое событие
+наступает, воркер рассылает его всем пользователям пояса (user_index).
+
+Расписание строится из хранилища при старте и пересчитывается при каждом
+сохранении пользователя (смена часового пояса, работа, смерть выдры...).
+Решение «отправлять или нет» по-прежнему принимает reminders._process_user,
+здесь только выбирается, кого и когда будить.
+"""
+import asyncio
+import heapq
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from bot.core.models import UserState
+from bot.core.timezones import get_zone
+
+# Окно напоминаний по времени: reminders_worker отправляет их, если
+# текущая минута отличается от заданной не больше чем на одну
+_REMINDER_WINDOW = timedelta(minutes=2)
+
+# Событие еженедельного отчёта: воскресенье, 21:00 по местному времени
+WEEKLY_REPORT = "weekly_report"
+_WEEKLY_AT = time(21, 0)
+
+
+def _next_server_midnight() -> datetime:
+    # «Сегодня» для возраста и отметок в last_reminders считается по дате сервера
+    return datetime.combine(date.today() + timedelta(days=1), time()).astimezone()
+
+
+def compute_due(user: UserState, now: datetime) -> Dict[str, datetime]:
+    """Ближайшие моменты, когда для пользователя может сработать личное событие."""
+    due: Dict[str, datetime] = {}
+    last = user.last_reminders
+    pet = user.pet
+    server_today = date.today().isoformat()
+    tz = get_zone(user.settings.timezone)
+
+    # Возраст растёт раз в день
+    due["age_update"] = now if last.get("age_update") != server_today else _next_server_midnight()
+
+    # Ежемесячный отчёт: через 30 дней после первого совета
+    first_advice_date = user.advice_state.first_advice_date
+    if first_advice_date:
+        try:
+            first = date.fromisoformat(first_advice_date)
+        except ValueError:
+            first = None
+        if first is not None:
+            starts = datetime.combine(first + timedelta(days=30), time(), tzinfo=tz)
+            if last.get(f"monthly_report_{first.isoformat()}") == server_today:
+                due["monthly_report"] = max(starts, _next_server_midnight())
+            else:
+                due["monthly_report"] = max(starts, now)
+
+    # Лимит работы: 10 часов в сутки, напоминание не чаще раза в час
+    if pet.is_alive and pet.at_work and pet.last_work_start:
+        try:
+            worked_today = user.work_hours_by_date.get(server_today, 0.0)
+            limit_at = datetime.fromisoformat(pet.last_work_start) + timedelta(hours=10.0 - worked_today)
+            last_limit = last.get("work_limit_reached")
+            if last_limit:
+                limit_at = max(limit_at, datetime.fromisoformat(last_limit) + timedelta(hours=1))
+            due["work_limit"] = max(limit_at, now)
+        except (TypeError, ValueError):
+            due["work_limit"] = now
+
+    if not pet.is_alive and not last.get("death_notification_sent"):
+        due["death_notification"] = now
+
+    return due
+
+
+def compute_zone_due(zone: str, after: datetime, reminder_times: Dict[str, time]) -> Dict[str, datetime]:
+    """Первые моменты строго после after для событий часового пояса."""
+    local_after = after.astimezone(get_zone(zone))
+    due: Dict[str, datetime] = {}
+    for key, t in reminder_times.items():
+        at = local_after.replace(hour=t.hour, minute=t.minute, second=0, microsecond=0)
+        if at <= local_after:
+            at += timedelta(days=1)
+        due[key] = at
+
+    weekly = local_after.replace(hour=_WEEKLY_AT.hour, minute=_WEEKLY_AT.minute, second=0, microsecond=0)
+    weekly += timedelta(days=(6 - weekly.weekday()) % 7)
+    if weekly <= local_after:
+        weekly += timedelta(days=7)
+    due[WEEKLY_REPORT] = weekly
+    return due
+
+
+class ReminderScheduler:
+    """
+    Куча (момент, user_id, событие) с ленивым удалением: актуальной
+    считается только запись, совпадающая с self._due[user_id][событие].
+
+    Рядом отдельная куча (момент, пояс, событие) для событий часовых
+    поясов. Пояса из неё не удаляются: пустой пояс просто никого не будит.
+    """
+
+    def __init__(self, reminder_times: Dict[str, time]) -> None:
+        self._reminder_times = reminder_times
+        self._heap: List[Tuple[float, int, str]] = []
+        self._due: Dict[int, Dict[str, float]] = {}
+        # Число актуальных записей в куче (остальные — устаревшие)
+        self._live = 0
+        self._zone_heap: List[Tuple[float, str, str]] = []
+        self._zones: Set[str] = set()
+        # Сохранения приходят из потоков хранилища, поэтому куча под блокировкой
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._sleeping_until = float("inf")
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def rebuild(self, users: Iterable[UserState]) -> None:
+        """Построить расписание по снимку пользователей (вызывается при старте)."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            for user in users:
+                # Пользователи, сохранённые во время чтения снимка, уже запланированы по свежим данным
+                if user.user_id not in self._due:
+                    self._schedule(user, now, not_before=None)
+                self._add_zone(user, now)
+
+    def on_user_saved(self, user: UserState) -> None:
+        """Слушатель UsersRepository.add_save_listener (вызывается из потока хранилища)."""
+        self.reschedule(user)
+
+    def reschedule(self, user: UserState, not_before: Optional[datetime] = None) -> None:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            earliest = min(self._schedule(user, now, not_before), self._add_zone(user, now))
+        if earliest < self._sleeping_until and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def remove(self, user_id: int) -> None:
+        with self._lock:
+            self._live -= len(self._due.pop(user_id, {}))
+
+    def _schedule(self, user: UserState, now: datetime, not_before: Optional[datetime]) -> float:
+        due = compute_due(user, now)
+        floor = not_before.timestamp() if not_before is not None else None
+        entries: Dict[str, float] = {}
+        for kind, at in due.items():
+            ts = at.timestamp()
+            if floor is not None and ts < floor:
+                ts = floor
+            entries[kind] = ts
+            heapq.heappush(self._heap, (ts, user.user_id, kind))
+        self._live += len(entries) - len(self._due.get(user.user_id, {}))
+        self._due[user.user_id] = entries
+        # Выбрасываем накопившиеся устаревшие записи
+        if len(self._heap) > 4 * (self._live + 1):
+            self._heap = [(ts, uid, kind) for uid, e in self._due.items() for kind, ts in e.items()]
+            heapq.heapify(self._heap)
+        return min(entries.values(), default=float("inf"))
+
+    def _add_zone(self, user: UserState, now: datetime) -> float:
+        zone = get_zone(user.settings.timezone).key
+        if zone in self._zones:
+            return float("inf")
+        self._zones.add(zone)
+        # Напоминание, чьё окно ещё не закрылось (например, после рестарта), сработает сразу
+        due = compute_zone_due(zone, now - _REMINDER_WINDOW, self._reminder_times)
+        for kind, at in due.items():
+            heapq.heappush(self._zone_heap, (max(at.timestamp(), now.timestamp()), zone, kind))
+        return min(at.timestamp() for at in due.values())
+
+    def pop_due(self, now: datetime) -> Tuple[Set[int], List[Tuple[str, str]]]:
+        """
+        Забрать наступившие события: пользователей с личными событиями и
+        пары (пояс, событие) для рассылки по поясу.
+        """
+        now_ts = now.timestamp()
+        users: Set[int] = set()
+        zone_events: List[Tuple[str, str]] = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now_ts:
+                ts, user_id, kind = heapq.heappop(self._heap)
+                entries = self._due.get(user_id)
+                if entries is None or entries.get(kind) != ts:
+                    continue
+                del entries[kind]
+                self._live -= 1
+                users.add(user_id)
+            while self._zone_heap and self._zone_heap[0][0] <= now_ts:
+                ts, zone, kind = heapq.heappop(self._zone_heap)
+                zone_events.append((zone, kind))
+                # Следующее срабатывание — строго после этого (завтра или через неделю)
+                after = datetime.fromtimestamp(max(ts, now_ts), timezone.utc)
+                at = compute_zone_due(zone, after, self._reminder_times)[kind]
+                heapq.heappush(self._zone_heap, (at.timestamp(), zone, kind))
+        return users, zone_events
+
+    async def wait(self, max_sleep: float) -> None:
+        """Спать до ближайшего события (но не дольше max_sleep) или до пересчёта расписания."""
+        # Сначала сбрасываем событие: пересчёт после этой строки нас разбудит
+        self._wakeup.clear()
+        now_ts = datetime.now(timezone.utc).timestamp()
+        with self._lock:
+            next_ts = min(
+                self._heap[0][0] if self._heap else now_ts + max_sleep,
+                self._zone_heap[0][0] if self._zone_heap else now_ts + max_sleep,
+            )
+        delay = min(max(next_ts - now_ts, 0.0), max_sleep)
+        self._sleeping_until = now_ts + delay
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._sleeping_until = float("inf")
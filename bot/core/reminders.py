@@ -1,13 +1,18 @@
 import asyncio
-from datetime import datetime, time, date, timezone
-from typing import Dict
+import functools
+from datetime import datetime, time, date, timedelta, timezone
+from typing import Dict, Optional
 
-from aiogram import Bot
-from zoneinfo import ZoneInfo
 
-from bot.core.repositories import UsersRepository
+from bot.storage.async_repo import AsyncRepository
 from bot.core.health import get_health_state, HealthState
+from bot.core.models import UserState
+from bot.core.mailboxes import user_mailboxes
+from bot.core.outbox import outbox
+from bot.core.reminder_scheduler import ReminderScheduler, WEEKLY_REPORT
 from bot.core.menu import main_menu_keyboard
+from bot.core.timezones import get_zone
+from bot.core.user_index import user_index
 
 
 REMINDER_TIMES: Dict[str, time] = {
@@ -28,190 +33,234 @@ REMINDER_TEXTS: Dict[str, str] = {
 }
 
 
-async def reminders_worker(bot: Bot, users_repo: UsersRepository) -> None:
+reminder_scheduler = ReminderScheduler(REMINDER_TIMES)
+
+
+async def _notify(chat_id: int, key: str, text: str, reply_markup=None) -> None:
     """
-    Периодически проходит по всем пользователям и отправляет напоминания
-    в локальном времени пользователя. Также увеличивает возраст выдр раз в день.
+    Поставить уведомление в outbox. Ключ дедупликации — chat_id и key,
+    поэтому повторная обработка того же события (например, после рестарта
+    до сохранения last_reminders) второго сообщения не даст.
     """
-    while True:
-        users = users_repo.get_all_users()
-        today = date.today().isoformat()
-
-        for uid_str, user in users.items():
-            chat_id = int(uid_str)
-            last = user.last_reminders
-            pet = user.pet
-
-            try:
-                tz = ZoneInfo(user.settings.timezone)
-            except Exception:
-                tz = ZoneInfo("Asia/Vladivostok")
-
-            now_dt = datetime.now(tz)
-            now = now_dt.time()
-            today_date = now_dt.date()
-            
-            # Увеличиваем возраст выдры раз в день (при первом взаимодействии за день)
-            last_age_update = last.get("age_update")
-            if last_age_update != today:
-                pet.age_days += 1
-                last["age_update"] = today
-                users_repo.save_user(user)
-            
-            # Проверяем еженедельный отчет (воскресенье вечером, 21:00)
-            if today_date.weekday() == 6 and now.hour == 21 and now.minute == 0:  # Воскресенье
-                weekly_report_key = f"weekly_report_{today_date.isoformat()}"
-                if last.get(weekly_report_key) != today:
-                    from bot.core.advice import get_weekly_advice_summary
-                    from bot.core.menu import weekly_advice_answer_keyboard, main_menu_keyboard
-                    
-                    advice_summary = get_weekly_advice_summary(user)
-                    if advice_summary and advice_summary != "На этой неделе ты ещё не получал советы.":
-                        try:
-                            await bot.send_message(
-                                chat_id,
-                                f"📋 Еженедельный отчет по советам:\n\n{advice_summary}\n\n"
-                                f"Как успехи? Соблюдал ли ты советы?",
-                                reply_markup=weekly_advice_answer_keyboard()
-                            )
-                            last[weekly_report_key] = today
-                            users_repo.save_user(user)
-                        except Exception:
-                            pass
-            
-            # Проверяем ежемесячный отчет (через 30 дней после первого совета)
-            advice_state = user.advice_state
-            if advice_state.first_advice_date:
-                try:
-                    first_advice_date = date.fromisoformat(advice_state.first_advice_date)
-                    days_passed = (today_date - first_advice_date).days
-                    
-                    # Проверяем, не отправляли ли уже месячный отчет
-                    monthly_report_key = f"monthly_report_{first_advice_date.isoformat()}"
-                    if days_passed >= 30 and last.get(monthly_report_key) != today:
-                        from bot.core.advice import get_monthly_advice_summary
-                        
-                        monthly_summary = get_monthly_advice_summary(user)
-                        if monthly_summary and monthly_summary != "За этот месяц ты ещё не получал советы.":
-                            try:
-                                await bot.send_message(
-                                    chat_id,
-                                    f"📊 Ежемесячный отчет по советам:\n\n{monthly_summary}",
-                                    reply_markup=main_menu_keyboard()
-                                )
-                                last[monthly_report_key] = today
-                                users_repo.save_user(user)
-                            except Exception:
-                                pass
-                except Exception:
-                    pass
+    await outbox.enqueue(f"{chat_id}:{key}", chat_id, text, reply_markup)
+
+
+async def _process_user(
+    users_repo: AsyncRepository,
+    chat_id: int,
+    user: UserState,
+    today: str,
+    now_dt: Optional[datetime] = None,
+) -> None:
+    """
+    Напоминания и ежедневные обновления одного пользователя.
+
+    now_dt — местное время пользователя, если оно уже посчитано для всего
+    часового пояса.
+    """
+    last = user.last_reminders
+    pet = user.pet
+
+    tz = get_zone(user.settings.timezone)
+    if now_dt is None or now_dt.tzinfo is not tz:
+        # Пояс мог смениться после того, как событие пояса было запланировано
+        now_dt = datetime.now(tz)
+    now = now_dt.time()
+    today_date = now_dt.date()
+
+    # Увеличиваем возраст выдры раз в день (при первом взаимодействии за день)
+    last_age_update = last.get("age_update")
+    if last_age_update != today:
+        pet.age_days += 1
+        last["age_update"] = today
+        await users_repo.save_user(user)
+
+    # Проверяем еженедельный отчет (воскресенье вечером, 21:00)
+    if today_date.weekday() == 6 and now.hour == 21 and now.minute == 0:  # Воскресенье
+        weekly_report_key = f"weekly_report_{today_date.isoformat()}"
+        if last.get(weekly_report_key) != today:
+            from bot.core.advice import get_weekly_advice_summary
+            from bot.core.menu import weekly_advice_answer_keyboard
+        
+            advice_summary = get_weekly_advice_summary(user)
+            if advice_summary and advice_summary != "На этой неделе ты ещё не получал советы.":
+                await _notify(
+                    chat_id,
+                    weekly_report_key,
+                    f"📋 Еженедельный отчет по советам:\n\n{advice_summary}\n\n"
+                    f"Как успехи? Соблюдал ли ты советы?",
+                    reply_markup=weekly_advice_answer_keyboard()
+                )
+                last[weekly_report_key] = today
+                await users_repo.save_user(user)
+
+    # Проверяем ежемесячный отчет (через 30 дней после первого совета)
+    advice_state = user.advice_state
+    if advice_state.first_advice_date:
+        try:
+            first_advice_date = date.fromisoformat(advice_state.first_advice_date)
+            days_passed = (today_date - first_advice_date).days
+        
+            # Проверяем, не отправляли ли уже месячный отчет
+            monthly_report_key = f"monthly_report_{first_advice_date.isoformat()}"
+            if days_passed >= 30 and last.get(monthly_report_key) != today:
+                from bot.core.advice import get_monthly_advice_summary
             
-            # Проверяем, не работает ли выдра больше 10 часов
-            if pet.is_alive and pet.at_work and pet.last_work_start:
+                monthly_summary = get_monthly_advice_summary(user)
+                if monthly_summary and monthly_summary != "За этот месяц ты ещё не получал советы.":
+                    await _notify(
+                        chat_id,
+                        f"{monthly_report_key}:{today}",
+                        f"📊 Ежемесячный отчет по советам:\n\n{monthly_summary}",
+                        reply_markup=main_menu_keyboard()
+                    )
+                # Проверку отмечаем и без отчёта: иначе расписание будило бы
+                # пользователя каждую минуту до конца дня
+                last[monthly_report_key] = today
+                await users_repo.save_user(user)
+        except Exception:
+            pass
+
+    # Проверяем, не работает ли выдра больше 10 часов
+    if pet.is_alive and pet.at_work and pet.last_work_start:
+        try:
+            work_start = datetime.fromisoformat(pet.last_work_start)
+            work_end = datetime.now(timezone.utc)
+            work_duration_hours = (work_end - work_start).total_seconds() / 3600.0
+        
+            # Получаем уже отработанные часы за сегодня
+            worked_hours_today = user.work_hours_by_date.get(today, 0.0)
+            total_worked = worked_hours_today + work_duration_hours
+        
+            # Если выдра работает больше 10 часов, отправляем напоминание
+            if total_worked >= 10.0:
+                reminder_key = "work_limit_reached"
+                # Отправляем напоминание не чаще раза в час
+                last_reminder_time = last.get(reminder_key)
                 try:
-                    from datetime import timezone
-                    work_start = datetime.fromisoformat(pet.last_work_start)
-                    work_end = datetime.now(timezone.utc)
-                    work_duration_hours = (work_end - work_start).total_seconds() / 3600.0
-                    
-                    # Получаем уже отработанные часы за сегодня
-                    worked_hours_today = user.work_hours_by_date.get(today, 0.0)
-                    total_worked = worked_hours_today + work_duration_hours
-                    
-                    # Если выдра работает больше 10 часов, отправляем напоминание
-                    if total_worked >= 10.0:
-                        reminder_key = "work_limit_reached"
-                        # Отправляем напоминание не чаще раза в час
-                        last_reminder_time = last.get(reminder_key)
-                        if last_reminder_time:
-                            try:
-                                last_reminder_dt = datetime.fromisoformat(last_reminder_time)
-                                hours_since_reminder = (now_dt - last_reminder_dt).total_seconds() / 3600.0
-                                if hours_since_reminder < 1.0:
-                                    # Уже отправляли напоминание в последний час
-                                    pass
-                                else:
-                                    # Прошёл час, можно отправить снова
-                                    await bot.send_message(
-                                        chat_id,
-                                        "🦦 Выдра уже отработала 10 часов и ждёт тебя на лавочке! "
-                                        "Пора забирать её с работы. Она устала и хочет отдохнуть 💼😴"
-                                    )
-                                    last[reminder_key] = now_dt.isoformat()
-                                    users_repo.save_user(user)
-                            except Exception:
-                                # Если ошибка парсинга, отправляем напоминание
-                                await bot.send_message(
-                                    chat_id,
-                                    "🦦 Выдра уже отработала 10 часов и ждёт тебя на лавочке! "
-                                    "Пора забирать её с работы. Она устала и хочет отдохнуть 💼😴"
-                                )
-                                last[reminder_key] = now_dt.isoformat()
-                                users_repo.save_user(user)
-                        else:
-                            # Первое напоминание
-                            await bot.send_message(
-                                chat_id,
-                                "🦦 Выдра уже отработала 10 часов и ждёт тебя на лавочке! "
-                                "Пора забирать её с работы. Она устала и хочет отдохнуть 💼😴"
-                            )
-                            last[reminder_key] = now_dt.isoformat()
-                            users_repo.save_user(user)
-                except Exception:
-                    # Игнорируем ошибки при проверке времени работы
-                    pass
-            
-            # Проверка критического состояния отключена (навязчивые напоминания убраны)
-            
-            # Проверяем, не умерла ли выдра, и отправляем уведомление (только один раз)
+                    due = (
+                        last_reminder_time is None
+                        or (now_dt - datetime.fromisoformat(last_reminder_time)).total_seconds() >= 3600
+                    )
+                except (TypeError, ValueError):
+                    # Если ошибка парсинга, отправляем напоминание
+                    due = True
+                if due:
+                    await _notify(
+                        chat_id,
+                        f"work_limit:{now_dt.isoformat(timespec='minutes')}",
+                        "🦦 Выдра уже отработала 10 часов и ждёт тебя на лавочке! "
+                        "Пора забирать её с работы. Она устала и хочет отдохнуть 💼😴",
+                    )
+                    last[reminder_key] = now_dt.isoformat()
+                    await users_repo.save_user(user)
+        except Exception:
+            # Игнорируем ошибки при проверке времени работы
+            pass
+
+    # Проверка критического состояния отключена (навязчивые напоминания убраны)
+
+    # Проверяем, не умерла ли выдра, и отправляем уведомление (только один раз)
+    if not pet.is_alive:
+        death_notification_key = "death_notification_sent"
+        if not last.get(death_notification_key):
+            # Ключ — смерть, а не день: выдру могут воскресить, и она снова умрёт
+            # в тот же день. Воскрешение обновляет last_interaction (touch_pet),
+            # а у мёртвой выдры он не меняется, так что повтор этой же проверки
+            # после рестарта получит тот же ключ
+            await _notify(
+                chat_id,
+                f"death_notification:{pet.last_interaction or today}",
+                f"💀 К сожалению, твоя выдра {pet.name} умерла...\n\n"
+                f"Она не получила достаточной заботы и ушла в мир иной.\n\n"
+                f"Но не расстраивайся! Ты можешь попробовать воскресить её командой /revive\n\n"
+                f"У тебя есть 1 бесплатное воскрешение. После этого воскрешение будет доступно через подписку на канал.",
+                reply_markup=main_menu_keyboard()
+            )
+            last[death_notification_key] = datetime.now(timezone.utc).isoformat()
+            await users_repo.save_user(user)
+
+    for key, t in REMINDER_TIMES.items():
+        # Если напоминание за сегодня уже было — пропускаем
+        if last.get(key) == today:
+            continue
+
+        # Проверяем время с небольшой погрешностью (в пределах минуты)
+        if now.hour == t.hour and abs(now.minute - t.minute) <= 1:
+            # Не отправляем напоминания, если выдра мертва или в отпуске
             if not pet.is_alive:
-                death_notification_key = "death_notification_sent"
-                if not last.get(death_notification_key):
-                    try:
-                        await bot.send_message(
-                            chat_id,
-                            f"💀 К сожалению, твоя выдра {pet.name} умерла...\n\n"
-                            f"Она не получила достаточной заботы и ушла в мир иной.\n\n"
-                            f"Но не расстраивайся! Ты можешь попробовать воскресить её командой /revive\n\n"
-                            f"У тебя есть 1 бесплатное воскрешение. После этого воскрешение будет доступно через подписку на канал.",
-                            reply_markup=main_menu_keyboard()
-                        )
-                        last[death_notification_key] = datetime.now(timezone.utc).isoformat()
-                        users_repo.save_user(user)
-                    except Exception:
-                        pass
-            
-            for key, t in REMINDER_TIMES.items():
-                # Если напоминание за сегодня уже было — пропускаем
-                if last.get(key) == today:
+                continue
+            if pet.vacation_mode:
+                continue
+        
+            # Для напоминания о сне проверяем, что выдра еще не спит
+            if key == "sleep":
+                # Проверяем, спит ли выдра (avatar_key == "sleep" или есть last_sleep_start)
+                if pet.avatar_key == "sleep" or pet.last_sleep_start is not None:
+                    # Выдра уже спит, пропускаем напоминание
+                    last[key] = today
+                    await users_repo.save_user(user)
                     continue
+        
+            text = REMINDER_TEXTS.get(key)
+            if text:
+                await _notify(chat_id, f"{key}:{today}", text)
+            last[key] = today
+            await users_repo.save_user(user)
 
-                # Проверяем время с небольшой погрешностью (в пределах минуты)
-                if now.hour == t.hour and abs(now.minute - t.minute) <= 1:
-                    # Не отправляем напоминания, если выдра мертва или в отпуске
-                    if not pet.is_alive:
-                        continue
-                    if pet.vacation_mode:
-                        continue
-                    
-                    # Для напоминания о сне проверяем, что выдра еще не спит
-                    if key == "sleep":
-                        # Проверяем, спит ли выдра (avatar_key == "sleep" или есть last_sleep_start)
-                        if pet.avatar_key == "sleep" or pet.last_sleep_start is not None:
-                            # Выдра уже спит, пропускаем напоминание
-                            last[key] = today
-                            users_repo.save_user(user)
-                            continue
-                    
-                    text = REMINDER_TEXTS.get(key)
-                    if text:
-                        try:
-                            await bot.send_message(chat_id, text)
-                        except Exception:
-                            # Игнорируем ошибки отправки отдельным пользователям
-                            pass
-                    last[key] = today
-                    users_repo.save_user(user)
 
-        await asyncio.sleep(60)
+async def _process_due(
+    users_repo: AsyncRepository,
+    chat_id: int,
+    today: str,
+    now_dt: Optional[datetime] = None,
+) -> None:
+    # Ящик пользователя гарантирует, что параллельно с нами его апдейты не идут,
+    # поэтому читаем свежую копию и сразу работаем с ней
+    user = await users_repo.get_user(chat_id)
+    if user is None:
+        reminder_scheduler.remove(chat_id)
+        return
+    try:
+        await _process_user(users_repo, chat_id, user, today, now_dt)
+    finally:
+        # Если ничего не изменилось, событие, которое «наступило» (например,
+        # пустой отчёт), не должно будить нас снова раньше, чем через минуту
+        reminder_scheduler.reschedule(user, not_before=datetime.now(timezone.utc) + timedelta(seconds=60))
+
+
+def _report_job_error(chat_id: int, job: asyncio.Future) -> None:
+    if not job.cancelled() and job.exception() is not None:
+        print(f"Error in reminders for {chat_id}: {job.exception()!r}")
+
+
+async def reminders_worker(users_repo: AsyncRepository) -> None:
+    """
+    Отправляет напоминания в локальном времени пользователя и раз в день
+    увеличивает возраст выдр.
+
+    Ждёт, пока build_indexes построит расписание (reminder_scheduler) и
+    индекс часовых поясов (user_index), дальше будит только тех, у кого
+    наступило событие. События часового пояса (напоминания
+    по времени, еженедельный отчёт) считаются один раз на пояс и рассылаются
+    всем его пользователям.
+    """
+    await user_index.ready.wait()
+
+    while True:
+        due_users, zone_events = reminder_scheduler.pop_due(datetime.now(timezone.utc))
+        due: Dict[int, Optional[datetime]] = dict.fromkeys(due_users)
+        for zone, kind in zone_events:
+            now_dt = datetime.now(get_zone(zone))
+            # Напоминания по времени мёртвым и отпускным выдрам не нужны
+            for chat_id in user_index.users_in_zone(zone, include_muted=kind == WEEKLY_REPORT):
+                due[chat_id] = now_dt
+        if due:
+            today = date.today().isoformat()
+            # Не ждём выполнения: занятый ящик одного пользователя не должен
+            # задерживать следующий проход; ошибка одного не мешает остальным
+            for chat_id, now_dt in due.items():
+                job = user_mailboxes.submit(chat_id, functools.partial(_process_due, users_repo, chat_id, today, now_dt))
+                job.add_done_callback(functools.partial(_report_job_error, chat_id))
 
+        await reminder_scheduler.wait(max_sleep=60)
@@ -1,168 +1,124 @@
-from typing import Dict, Optional, List
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, Iterator, Optional, List, Set, Tuple
 
 from bot.core.models import (
     AdminSettings,
-    PetState,
+    PetSummary,
     UserSettings,
     UserState,
     Hobby,
-    DailyStats,
-    AdviceState,
     Friendship,
     CoopSession,
     admin_to_dict,
-    user_to_dict,
+    defer_history,
+    friendship_to_dict,
     hobby_to_dict,
+    pet_from_dict,
+    user_to_dict,
 )
 from bot.storage.json_db import JsonDB
+from bot.storage.sharded_db import ShardedJsonDB
+from settings import USERS_STORAGE
+
+
+def user_from_dict(data: Dict) -> UserState:
+    """Восстанавливает UserState из сохранённого словаря."""
+    pet = pet_from_dict(data["pet"])
+    settings_data = data.get("settings", {})
+    settings = UserSettings(
+        timezone=settings_data.get("timezone", "Asia/Vladivostok"),
+        pet_name=settings_data.get("pet_name"),
+        water_norm_liters=settings_data.get("water_norm_liters", 2.5),
+        glass_volume_ml=settings_data.get("glass_volume_ml", 300),
+        water_norm_set=settings_data.get("water_norm_set", False),
+        sleep_norm_hours=settings_data.get("sleep_norm_hours", 0.0),
+    )
+
+    user = UserState(
+        user_id=data["user_id"],
+        pet=pet,
+        settings=settings,
+        last_reminders=data.get("last_reminders", {}),
+        last_main_menu_return=data.get("last_main_menu_return"),
+        active_quests=data.get("active_quests", {}),
+        work_stats=data.get("work_stats", {}),
+        last_fatigue_update=data.get("last_fatigue_update"),
+    )
+    # Статистика дней, отработанные часы и советы разбираются при первом обращении
+    defer_history(user, data)
+    return user
+
+
+def pet_summary_from_dict(data: Dict) -> PetSummary:
+    """PetSummary из сохранённого словаря, без разбора остальной записи."""
+    pet = data.get("pet", {})
+    return PetSummary(
+        user_id=data["user_id"],
+        name=pet.get("name", ""),
+        age_days=pet.get("age_days", 0),
+        is_alive=pet.get("is_alive", True),
+    )
 
 
 class UsersRepository:
-    def __init__(self) -> None:
-        self._db = JsonDB("users.json")
+    """
+    Репозиторий пользователей.
+
+    По умолчанию все пользователи лежат в одном users.json; при
+    USERS_STORAGE=sharded каждый пользователь хранится в своём файле
+    bot/data/users/<user_id>.json (см. scripts/migrate_users_to_shards.py).
+    """
+
+    def __init__(self, db=None) -> None:
+        if db is None:
+            db = ShardedJsonDB("users") if USERS_STORAGE == "sharded" else JsonDB("users.json")
+        self._db = db
+        self._save_listeners: List[Callable[[UserState], None]] = []
+
+    def add_save_listener(self, listener: Callable[[UserState], None]) -> None:
+        """
+        Подписаться на сохранения пользователей.
+
+        Слушатель вызывается после каждой успешной записи в том потоке,
+        где выполнялся save_user, и должен быть быстрым.
+        """
+        self._save_listeners.append(listener)
 
     def get_user(self, user_id: int) -> Optional[UserState]:
         data = self._db.get(str(user_id))
         if not data:
             return None
-
-        pet_data = data["pet"]
-        pet = PetState(**pet_data)
-        settings_data = data.get("settings", {})
-        settings = UserSettings(
-            timezone=settings_data.get("timezone", "Asia/Vladivostok"),
-            pet_name=settings_data.get("pet_name"),
-            water_norm_liters=settings_data.get("water_norm_liters", 2.5),
-            glass_volume_ml=settings_data.get("glass_volume_ml", 300),
-            water_norm_set=settings_data.get("water_norm_set", False),
-            sleep_norm_hours=settings_data.get("sleep_norm_hours", 0.0),
-        )
-        
-        # Восстанавливаем статистику дней
-        daily_stats_raw = data.get("daily_stats", {})
-        daily_stats = {}
-        for date, stats_data in daily_stats_raw.items():
-            daily_stats[date] = DailyStats(**stats_data)
-        
-        # Восстанавливаем состояние советов
-        advice_data = data.get("advice_state", {})
-        advice_state = AdviceState(**advice_data) if advice_data else AdviceState()
-        
-        # Восстанавливаем friendships
-        friendships_raw = data.get("friendships", {})
-        friendships = {}
-        for friend_id_str, friendship_data in friendships_raw.items():
-            try:
-                friend_id = int(friend_id_str)
-                friendships[friend_id] = Friendship(**friendship_data)
-            except (ValueError, TypeError, KeyError):
-                continue  # Пропускаем некорректные данные
-        
-        return UserState(
-            user_id=data["user_id"],
-            pet=pet,
-            settings=settings,
-            last_reminders=data.get("last_reminders", {}),
-            work_hours_by_date=data.get("work_hours_by_date", {}),
-            daily_stats=daily_stats,
-            advice_state=advice_state,
-            last_main_menu_return=data.get("last_main_menu_return"),
-            active_quests=data.get("active_quests", {}),
-            work_stats=data.get("work_stats", {}),
-            last_fatigue_update=data.get("last_fatigue_update"),
-            friendships=friendships,
-        )
+        return user_from_dict(data)
 
     def save_user(self, user: UserState) -> None:
         self._db.set(str(user.user_id), user_to_dict(user))
+        for listener in self._save_listeners:
+            listener(user)
+
+    def get_users(self, user_ids: Iterable[int]) -> Dict[int, UserState]:
+        """Несколько пользователей за один проход по хранилищу; ненайденные пропускаются."""
+        raw = self._db.get_many([str(user_id) for user_id in user_ids])
+        return {int(uid): user_from_dict(data) for uid, data in raw.items() if data}
+
+    def get_pet_summaries(self, user_ids: Iterable[int]) -> Dict[int, PetSummary]:
+        """Как get_users, но только поля выдры для списков."""
+        raw = self._db.get_many([str(user_id) for user_id in user_ids])
+        return {int(uid): pet_summary_from_dict(data) for uid, data in raw.items() if data}
+
+    def iter_users(self) -> Iterator[Tuple[str, UserState]]:
+        """Потоково обходит всех пользователей."""
+        for uid, data in self._db.iter_items():
+            if data:
+                yield uid, user_from_dict(data)
 
     def get_all_users(self) -> Dict[str, UserState]:
-        raw = self._db.get_all()
-        result: Dict[str, UserState] = {}
-        for uid, data in raw.items():
-            pet_data = data["pet"]
-            # Обрабатываем старые данные без новых полей
-            pet = PetState(
-                name=pet_data["name"],
-                avatar_key=pet_data.get("avatar_key", "awake"),
-                happiness=pet_data.get("happiness", 50),
-                energy=pet_data.get("energy", 50),
-                hunger=pet_data.get("hunger", 50),
-                thirst=pet_data.get("thirst", 50),
-                age_days=pet_data.get("age_days", 0),
-                is_alive=pet_data.get("is_alive", True),
-                free_revives_left=pet_data.get("free_revives_left", 1),
-                last_sleep_start=pet_data.get("last_sleep_start"),
-                last_wake_time=pet_data.get("last_wake_time"),
-                unlocked_hobbies=pet_data.get("unlocked_hobbies", []),
-                money=pet_data.get("money", 0),
-                at_work=pet_data.get("at_work", False),
-                last_work_start=pet_data.get("last_work_start"),
-                last_interaction=pet_data.get("last_interaction"),
-                fatigue=pet_data.get("fatigue", 0),
-                unlocked_achievements=pet_data.get("unlocked_achievements", []),
-                critical_state_since=pet_data.get("critical_state_since"),
-                vacation_mode=pet_data.get("vacation_mode", False),
-            )
-            settings_data = data.get("settings", {})
-            settings = UserSettings(
-                timezone=settings_data.get("timezone", "Asia/Vladivostok"),
-                pet_name=settings_data.get("pet_name"),
-                water_norm_liters=settings_data.get("water_norm_liters", 2.5),
-                glass_volume_ml=settings_data.get("glass_volume_ml", 300),
-                water_norm_set=settings_data.get("water_norm_set", False),
-            )
-            # Восстанавливаем статистику дней
-            daily_stats_raw = data.get("daily_stats", {})
-            daily_stats = {}
-            for date, stats_data in daily_stats_raw.items():
-                daily_stats[date] = DailyStats(**stats_data)
-            
-            # Восстанавливаем состояние советов
-            advice_data = data.get("advice_state", {})
-            if advice_data is not None and advice_data:
-                # Обрабатываем старые данные без новых полей
-                advice_state = AdviceState(
-                    last_advice_date=advice_data.get("last_advice_date"),
-                    shown_advice_ids=advice_data.get("shown_advice_ids", []),
-                    week_start_date=advice_data.get("week_start_date"),
-                    monthly_advice_summary=advice_data.get("monthly_advice_summary", {}),
-                    first_advice_date=advice_data.get("first_advice_date"),
-                    weekly_answers=advice_data.get("weekly_answers", {}),
-                )
-            else:
-                advice_state = AdviceState()
-            
-            # Восстанавливаем friendships
-            friendships_raw = data.get("friendships", {})
-            friendships = {}
-            for friend_id_str, friendship_data in friendships_raw.items():
-                try:
-                    friend_id = int(friend_id_str)
-                    friendships[friend_id] = Friendship(**friendship_data)
-                except (ValueError, TypeError, KeyError):
-                    continue  # Пропускаем некорректные данные
-            
-            result[uid] = UserState(
-                user_id=data["user_id"],
-                pet=pet,
-                settings=settings,
-                last_reminders=data.get("last_reminders", {}),
-                work_hours_by_date=data.get("work_hours_by_date", {}),
-                daily_stats=daily_stats,
-                advice_state=advice_state,
-                last_main_menu_return=data.get("last_main_menu_return"),
-                active_quests=data.get("active_quests", {}),
-                work_stats=data.get("work_stats", {}),
-                last_fatigue_update=data.get("last_fatigue_update"),
-                friendships=friendships,
-            )
-        return result
+        return dict(self.iter_users())
 
 
 class HobbiesRepository:
-    def __init__(self) -> None:
-        self._db = JsonDB("hobbies.json")
+    def __init__(self, db=None) -> None:
+        self._db = db if db is not None else JsonDB("hobbies.json")
 
     def get_all(self) -> Dict[str, Hobby]:
         raw = self._db.get_all()
@@ -176,8 +132,8 @@ class HobbiesRepository:
 
 
 class AdminRepository:
-    def __init__(self) -> None:
-        self._db = JsonDB("admin.json")
+    def __init__(self, db=None) -> None:
+        self._db = db if db is not None else JsonDB("admin.json")
 
     def get_settings(self) -> AdminSettings:
         data = self._db.get("settings", {})
@@ -191,15 +147,71 @@ class AdminRepository:
 
 
 class FriendsRepository:
-    """Репозиторий для управления дружбой"""
+    """
+    Репозиторий для управления дружбой.
+
+    Единственное хранилище дружб: одна запись на пару в friends.json, в
+    записях пользователей дружбы не хранятся (старые данные переносит
+    scripts/migrate_friendships.py).
+
+    Рядом с friends.json держится список смежности user_id -> id друзей:
+    он строится при старте одним проходом по ключам и обновляется в
+    save_friendship/delete_friendship, поэтому друзья пользователя ищутся
+    за O(число его друзей), а не перебором всех дружб.
+    """
     def __init__(self) -> None:
         self._db = JsonDB("friends.json")
+        # Списки смежности меняются из потоков хранилища
+        self._lock = threading.Lock()
+        self._adjacency: Dict[int, Set[int]] = {}
+        self._change_listeners: List[Callable[[int, int], None]] = []
+        for key, _ in self._db.iter_items():
+            pair = self._parse_friendship_key(key)
+            if pair is not None:
+                self._link(*pair)
     
     def _get_friendship_key(self, user_id_1: int, user_id_2: int) -> str:
         """Получить уникальный ключ для пары пользователей"""
         # Сортируем, чтобы (1,2) и (2,1) были одной дружбой
         ids = sorted([user_id_1, user_id_2])
         return f"{ids[0]}_{ids[1]}"
+
+    @staticmethod
+    def _parse_friendship_key(key: str) -> Optional[Tuple[int, int]]:
+        parts = key.split("_")
+        if len(parts) != 2:
+            return None
+        try:
+            return int(parts[0]), int(parts[1])
+        except ValueError:
+            return None
+
+    def _link(self, user_id_1: int, user_id_2: int) -> None:
+        self._adjacency.setdefault(user_id_1, set()).add(user_id_2)
+        self._adjacency.setdefault(user_id_2, set()).add(user_id_1)
+
+    def _unlink(self, user_id_1: int, user_id_2: int) -> None:
+        for a, b in ((user_id_1, user_id_2), (user_id_2, user_id_1)):
+            friends = self._adjacency.get(a)
+            if friends is not None:
+                friends.discard(b)
+                if not friends:
+                    del self._adjacency[a]
+
+    def add_change_listener(self, listener: Callable[[int, int], None]) -> None:
+        """
+        Подписаться на изменения дружб.
+
+        После save_friendship/delete_friendship слушатель вызывается для
+        каждого из двух пользователей: listener(user_id, число его друзей).
+        """
+        self._change_listeners.append(listener)
+
+    def _notify(self, user_id_1: int, user_id_2: int) -> None:
+        for user_id in (user_id_1, user_id_2):
+            count = self.friend_count(user_id)
+            for listener in self._change_listeners:
+                listener(user_id, count)
     
     def get_friendship(self, user_id_1: int, user_id_2: int) -> Optional[Friendship]:
         """Получить информацию о дружбе между двумя пользователями"""
@@ -208,38 +220,67 @@ class FriendsRepository:
         if data:
             return Friendship(**data)
         return None
+
+    def friend_ids(self, user_id: int) -> Set[int]:
+        """id друзей пользователя"""
+        with self._lock:
+            return set(self._adjacency.get(user_id, ()))
+
+    def friend_count(self, user_id: int) -> int:
+        with self._lock:
+            return len(self._adjacency.get(user_id, ()))
+
+    def friend_counts(self) -> Dict[int, int]:
+        """user_id -> число друзей для всех, у кого они есть"""
+        with self._lock:
+            return {user_id: len(friends) for user_id, friends in self._adjacency.items()}
     
     def get_all_friends(self, user_id: int) -> Dict[int, Friendship]:
         """Получить всех друзей пользователя"""
-        raw = self._db.get_all()
-        friends = {}
-        for key, data in raw.items():
-            parts = key.split("_")
-            if len(parts) == 2:
-                friend_id_1, friend_id_2 = int(parts[0]), int(parts[1])
-                if friend_id_1 == user_id:
-                    friends[friend_id_2] = Friendship(**data)
-                elif friend_id_2 == user_id:
-                    friends[friend_id_1] = Friendship(**data)
-        return friends
+        keys = {self._get_friendship_key(user_id, friend_id): friend_id for friend_id in self.friend_ids(user_id)}
+        raw = self._db.get_many(keys)
+        return {keys[key]: Friendship(**data) for key, data in raw.items()}
+
+    def mutual_friends(self, user_id_1: int, user_id_2: int) -> Set[int]:
+        """Общие друзья двух пользователей"""
+        with self._lock:
+            friends_1 = self._adjacency.get(user_id_1, set())
+            friends_2 = self._adjacency.get(user_id_2, set())
+            # Перебираем меньший из двух списков
+            if len(friends_1) > len(friends_2):
+                friends_1, friends_2 = friends_2, friends_1
+            return {friend_id for friend_id in friends_1 if friend_id in friends_2}
+
+    def suggest_friends(self, user_id: int, limit: int = 5) -> List[Tuple[int, int]]:
+        """
+        Друзья друзей, которые ещё не друзья пользователя: (user_id, число
+        общих друзей), сначала те, у кого общих друзей больше.
+        """
+        with self._lock:
+            friends = self._adjacency.get(user_id, set())
+            mutual: Counter = Counter()
+            for friend_id in friends:
+                mutual.update(self._adjacency.get(friend_id, ()))
+        mutual.pop(user_id, None)
+        for friend_id in friends:
+            mutual.pop(friend_id, None)
+        return sorted(mutual.items(), key=lambda item: (-item[1], item[0]))[:limit]
     
     def save_friendship(self, friendship: Friendship) -> None:
         """Сохранить/обновить информацию о дружбе"""
         key = self._get_friendship_key(friendship.user_id_1, friendship.user_id_2)
-        self._db.set(key, {
-            "user_id_1": friendship.user_id_1,
-            "user_id_2": friendship.user_id_2,
-            "friendship_level": friendship.friendship_level,
-            "total_sessions_together": friendship.total_sessions_together,
-            "first_met_date": friendship.first_met_date,
-            "last_interaction": friendship.last_interaction,
-            "social_bonuses": friendship.social_bonuses,
-        })
+        self._db.set(key, friendship_to_dict(friendship))
+        with self._lock:
+            self._link(friendship.user_id_1, friendship.user_id_2)
+        self._notify(friendship.user_id_1, friendship.user_id_2)
     
     def delete_friendship(self, user_id_1: int, user_id_2: int) -> None:
         """Удалить дружбу"""
         key = self._get_friendship_key(user_id_1, user_id_2)
         self._db.delete(key)
+        with self._lock:
+            self._unlink(user_id_1, user_id_2)
+        self._notify(user_id_1, user_id_2)
 
 
 class CoopSessionsRepository:
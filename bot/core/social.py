@@ -25,7 +25,7 @@ class SocialRooms:
         return {rid: Room(**data) for rid, data in raw.items()}
 
     def _save_all(self, rooms: Dict[str, Room]) -> None:
-        self._db._write({rid: asdict(room) for rid, room in rooms.items()})  # type: ignore
+        self._db.replace_all({rid: asdict(room) for rid, room in rooms.items()})
 
     def join(self, room_id: str, room_type: str, user_id: int) -> Room:
         rooms = self._load_all()
@@ -0,0 +1,315 @@
+"""
+Репозитории поверх SQLite.
+
+Повторяют интерфейсы JSON-репозиториев из repositories.py и stats.py,
+но хранят данные в нормальных таблицах с индексами, поэтому чтение и
+запись затрагивают отдельные строки, а не файл целиком.
+"""
+import json
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from bot.core.models import CoopSession, Friendship
+from bot.core.stats import UserStats
+from bot.storage.sqlite_db import SqliteDB
+
+
+class SqliteFriendsRepository:
+    """
+    Дружба: одна строка на пару.
+
+    Пара индексируется как (low_id, high_id), чтобы (1, 2) и (2, 1) были
+    одной записью; user_id_1/user_id_2 хранятся в исходном порядке.
+    """
+
+    _SELECT = (
+        "SELECT user_id_1, user_id_2, friendship_level, total_sessions_together, "
+        "first_met_date, last_interaction, social_bonuses FROM friendships"
+    )
+
+    def __init__(self, db: SqliteDB) -> None:
+        self._db = db
+        self._change_listeners: List[Callable[[int, int], None]] = []
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS friendships ("
+            "low_id INTEGER NOT NULL, "
+            "high_id INTEGER NOT NULL, "
+            "user_id_1 INTEGER NOT NULL, "
+            "user_id_2 INTEGER NOT NULL, "
+            "friendship_level INTEGER NOT NULL DEFAULT 1, "
+            "total_sessions_together INTEGER NOT NULL DEFAULT 0, "
+            "first_met_date TEXT NOT NULL DEFAULT '', "
+            "last_interaction TEXT NOT NULL DEFAULT '', "
+            "social_bonuses TEXT NOT NULL DEFAULT '{}', "
+            "PRIMARY KEY (low_id, high_id))"
+        )
+        # Первичный ключ покрывает поиск по low_id, для второго конца пары нужен свой индекс
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_friendships_high_id ON friendships (high_id)"
+        )
+
+    @staticmethod
+    def _pair(user_id_1: int, user_id_2: int) -> tuple:
+        return (user_id_1, user_id_2) if user_id_1 <= user_id_2 else (user_id_2, user_id_1)
+
+    @staticmethod
+    def _from_row(row) -> Friendship:
+        return Friendship(
+            user_id_1=row[0],
+            user_id_2=row[1],
+            friendship_level=row[2],
+            total_sessions_together=row[3],
+            first_met_date=row[4],
+            last_interaction=row[5],
+            social_bonuses=json.loads(row[6]),
+        )
+
+    def add_change_listener(self, listener: Callable[[int, int], None]) -> None:
+        """Как FriendsRepository.add_change_listener."""
+        self._change_listeners.append(listener)
+
+    def _notify(self, user_id_1: int, user_id_2: int) -> None:
+        if not self._change_listeners:
+            return
+        for user_id in (user_id_1, user_id_2):
+            count = self.friend_count(user_id)
+            for listener in self._change_listeners:
+                listener(user_id, count)
+
+    def get_friendship(self, user_id_1: int, user_id_2: int) -> Optional[Friendship]:
+        """Получить информацию о дружбе между двумя пользователями"""
+        row = self._db.query_one(
+            f"{self._SELECT} WHERE low_id = ? AND high_id = ?",
+            self._pair(user_id_1, user_id_2),
+        )
+        return self._from_row(row) if row else None
+
+    def get_all_friends(self, user_id: int) -> Dict[int, Friendship]:
+        """Получить всех друзей пользователя"""
+        rows = self._db.query_all(
+            f"{self._SELECT} WHERE low_id = ? UNION ALL {self._SELECT} WHERE high_id = ?",
+            (user_id, user_id),
+        )
+        friends = {}
+        for row in rows:
+            friend_id = row[1] if row[0] == user_id else row[0]
+            friends[friend_id] = self._from_row(row)
+        return friends
+
+    def friend_ids(self, user_id: int) -> Set[int]:
+        """id друзей пользователя"""
+        rows = self._db.query_all(
+            "SELECT high_id FROM friendships WHERE low_id = ? "
+            "UNION ALL SELECT low_id FROM friendships WHERE high_id = ?",
+            (user_id, user_id),
+        )
+        return {row[0] for row in rows}
+
+    def friend_count(self, user_id: int) -> int:
+        row = self._db.query_one(
+            "SELECT (SELECT COUNT(*) FROM friendships WHERE low_id = ?) "
+            "+ (SELECT COUNT(*) FROM friendships WHERE high_id = ?)",
+            (user_id, user_id),
+        )
+        return row[0]
+
+    def friend_counts(self) -> Dict[int, int]:
+        """user_id -> число друзей для всех, у кого они есть"""
+        rows = self._db.query_all(
+            "SELECT id, COUNT(*) FROM ("
+            "SELECT low_id AS id FROM friendships UNION ALL SELECT high_id FROM friendships) "
+            "GROUP BY id"
+        )
+        return {row[0]: row[1] for row in rows}
+
+    def mutual_friends(self, user_id_1: int, user_id_2: int) -> Set[int]:
+        """Общие друзья двух пользователей"""
+        return self.friend_ids(user_id_1) & self.friend_ids(user_id_2)
+
+    def suggest_friends(self, user_id: int, limit: int = 5) -> List[Tuple[int, int]]:
+        """
+        Друзья друзей, которые ещё не друзья пользователя: (user_id, число
+        общих друзей), сначала те, у кого общих друзей больше.
+        """
+        rows = self._db.query_all(
+            "WITH f(id) AS ("
+            "SELECT high_id FROM friendships WHERE low_id = ? "
+            "UNION ALL SELECT low_id FROM friendships WHERE high_id = ?), "
+            "ff(id) AS ("
+            "SELECT high_id FROM friendships JOIN f ON low_id = f.id "
+            "UNION ALL SELECT low_id FROM friendships JOIN f ON high_id = f.id) "
+            "SELECT id, COUNT(*) AS mutual FROM ff "
+            "WHERE id != ? AND id NOT IN (SELECT id FROM f) "
+            "GROUP BY id ORDER BY mutual DESC, id LIMIT ?",
+            (user_id, user_id, user_id, limit),
+        )
+        return [(row[0], row[1]) for row in rows]
+
+    def save_friendship(self, friendship: Friendship) -> None:
+        """Сохранить/обновить информацию о дружбе"""
+        low_id, high_id = self._pair(friendship.user_id_1, friendship.user_id_2)
+        self._db.execute(
+            "INSERT INTO friendships (low_id, high_id, user_id_1, user_id_2, friendship_level, "
+            "total_sessions_together, first_met_date, last_interaction, social_bonuses) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(low_id, high_id) DO UPDATE SET "
+            "user_id_1 = excluded.user_id_1, "
+            "user_id_2 = excluded.user_id_2, "
+            "friendship_level = excluded.friendship_level, "
+            "total_sessions_together = excluded.total_sessions_together, "
+            "first_met_date = excluded.first_met_date, "
+            "last_interaction = excluded.last_interaction, "
+            "social_bonuses = excluded.social_bonuses",
+            (
+                low_id,
+                high_id,
+                friendship.user_id_1,
+                friendship.user_id_2,
+                friendship.friendship_level,
+                friendship.total_sessions_together,
+                friendship.first_met_date,
+                friendship.last_interaction,
+                json.dumps(friendship.social_bonuses, ensure_ascii=False),
+            ),
+        )
+        self._notify(friendship.user_id_1, friendship.user_id_2)
+
+    def delete_friendship(self, user_id_1: int, user_id_2: int) -> None:
+        """Удалить дружбу"""
+        self._db.execute(
+            "DELETE FROM friendships WHERE low_id = ? AND high_id = ?",
+            self._pair(user_id_1, user_id_2),
+        )
+        self._notify(user_id_1, user_id_2)
+
+
+class SqliteCoopSessionsRepository:
+    """Совместные сессии и их участники."""
+
+    def __init__(self, db: SqliteDB) -> None:
+        self._db = db
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS coop_sessions ("
+            "id TEXT PRIMARY KEY, "
+            "start_time TEXT NOT NULL, "
+            "data TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_coop_sessions_start_time ON coop_sessions (start_time)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS coop_participants ("
+            "session_id TEXT NOT NULL REFERENCES coop_sessions (id) ON DELETE CASCADE, "
+            "user_id INTEGER NOT NULL, "
+            "PRIMARY KEY (user_id, session_id))"
+        )
+
+    def save_session(self, session: CoopSession) -> None:
+        """Сохранить сессию совместной активности"""
+        data = {
+            "id": session.id,
+            "activity_type": session.activity_type,
+            "user_ids": session.user_ids,
+            "start_time": session.start_time,
+            "duration_minutes": session.duration_minutes,
+            "result_happiness": session.result_happiness,
+            "result_money": session.result_money,
+            "event_triggered": session.event_triggered,
+        }
+        with self._db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO coop_sessions (id, start_time, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET start_time = excluded.start_time, data = excluded.data",
+                (session.id, session.start_time, json.dumps(data, ensure_ascii=False)),
+            )
+            conn.execute("DELETE FROM coop_participants WHERE session_id = ?", (session.id,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO coop_participants (session_id, user_id) VALUES (?, ?)",
+                [(session.id, uid) for uid in session.user_ids],
+            )
+
+    def get_user_coop_history(self, user_id: int, limit: int = 10) -> List[CoopSession]:
+        """Получить историю совместных активностей пользователя"""
+        rows = self._db.query_all(
+            "SELECT s.data FROM coop_participants p "
+            "JOIN coop_sessions s ON s.id = p.session_id "
+            "WHERE p.user_id = ? "
+            "ORDER BY s.start_time DESC LIMIT ?",
+            (user_id, limit),
+        )
+        # Прогоняем через JSON так же, как JSON-репозиторий (ключи словарей — строки)
+        return [CoopSession(**json.loads(row[0])) for row in rows]
+
+
+class SqliteStatsRepository:
+    """Счётчики активности: одна строка на пользователя, инкремент — один UPDATE."""
+
+    _COLUMNS = (
+        "user_id",
+        "total_sleep_minutes",
+        "feed_events",
+        "water_events",
+        "work_sessions",
+        "hobby_sessions",
+    )
+
+    def __init__(self, db: SqliteDB) -> None:
+        self._db = db
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS user_stats ("
+            "user_id INTEGER PRIMARY KEY, "
+            "total_sleep_minutes INTEGER NOT NULL DEFAULT 0, "
+            "feed_events INTEGER NOT NULL DEFAULT 0, "
+            "water_events INTEGER NOT NULL DEFAULT 0, "
+            "work_sessions INTEGER NOT NULL DEFAULT 0, "
+            "hobby_sessions INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._sql_select = f"SELECT {', '.join(self._COLUMNS)} FROM user_stats"
+        self._increment_listeners: List[Callable[[int, Dict[str, int]], None]] = []
+
+    def add_increment_listener(self, listener: Callable[[int, Dict[str, int]], None]) -> None:
+        """Подписаться на инкременты: listener(user_id, deltas) после записи, в потоке хранилища."""
+        self._increment_listeners.append(listener)
+
+    def increment(self, user_id: int, **deltas: int) -> None:
+        """Прибавить к счётчикам пользователя сразу несколько значений одним UPSERT."""
+        if not deltas:
+            return
+        columns = list(deltas)
+        for column in columns:
+            if column not in self._COLUMNS[1:]:
+                raise ValueError(f"Неизвестный счётчик: {column}")
+        updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in columns)
+        self._db.execute(
+            f"INSERT INTO user_stats (user_id, {', '.join(columns)}) "
+            f"VALUES (?{', ?' * len(columns)}) "
+            f"ON CONFLICT(user_id) DO UPDATE SET {updates}",
+            (user_id, *deltas.values()),
+        )
+        for listener in self._increment_listeners:
+            listener(user_id, deltas)
+
+    def get_user_stats(self, user_id: int) -> UserStats:
+        """Публичный метод для получения статистики пользователя."""
+        row = self._db.query_one(f"{self._sql_select} WHERE user_id = ?", (user_id,))
+        if row is None:
+            self._db.execute("INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)", (user_id,))
+            return UserStats(user_id=user_id)
+        return UserStats(*row)
+
+    def inc_feed(self, user_id: int) -> None:
+        self.increment(user_id, feed_events=1)
+
+    def inc_water(self, user_id: int) -> None:
+        self.increment(user_id, water_events=1)
+
+    def inc_work(self, user_id: int) -> None:
+        self.increment(user_id, work_sessions=1)
+
+    def inc_hobby(self, user_id: int) -> None:
+        self.increment(user_id, hobby_sessions=1)
+
+    def add_sleep_minutes(self, user_id: int, minutes: int) -> None:
+        self.increment(user_id, total_sleep_minutes=max(0, minutes))
+
+    def get_all(self) -> Dict[str, UserStats]:
+        return {str(row[0]): UserStats(*row) for row in self._db.query_all(self._sql_select)}
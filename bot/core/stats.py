@@ -1,8 +1,10 @@
-from dataclasses import dataclass, asdict
+import threading
+from dataclasses import dataclass, asdict, fields
 from datetime import datetime
-from typing import Dict
+from typing import Any, Callable, Dict, List, Optional
 
 from bot.storage.json_db import JsonDB
+from settings import STATS_JSONDB_MODE
 
 
 @dataclass
@@ -15,64 +17,73 @@ class UserStats:
     hobby_sessions: int = 0
 
 
+COUNTER_FIELDS = tuple(f.name for f in fields(UserStats) if f.name != "user_id")
+
+
 class StatsRepository:
-    def __init__(self) -> None:
-        self._db = JsonDB("stats.json")
-
-    def _load_all(self) -> Dict[str, UserStats]:
-        raw = self._db.get_all()
-        return {uid: UserStats(**data) for uid, data in raw.items()}
-
-    def _save_all(self, stats: Dict[str, UserStats]) -> None:
-        self._db._write({uid: asdict(s) for uid, s in stats.items()})  # type: ignore
-
-    def _get_or_create(self, user_id: int) -> UserStats:
-        stats = self._load_all()
-        key = str(user_id)
-        if key not in stats:
-            stats[key] = UserStats(user_id=user_id)
-            self._save_all(stats)
-        return stats[key]
-    
+    """
+    Счётчики активности: одна запись на пользователя.
+
+    Инкремент читает и пишет только запись этого пользователя. По умолчанию
+    stats.json открыт в режиме "journal": таблица счётчиков живёт в памяти,
+    а каждое изменение дописывается в журнал одной строкой.
+    """
+
+    def __init__(self, db: Optional[Any] = None) -> None:
+        self._db = db if db is not None else JsonDB("stats.json", mode=STATS_JSONDB_MODE)
+        # Делает «прочитать-прибавить-записать» атомарным между потоками
+        self._lock = threading.Lock()
+        self._increment_listeners: List[Callable[[int, Dict[str, int]], None]] = []
+
+    def add_increment_listener(self, listener: Callable[[int, Dict[str, int]], None]) -> None:
+        """Подписаться на инкременты: listener(user_id, deltas) после записи, в потоке хранилища."""
+        self._increment_listeners.append(listener)
+
+    def _get(self, user_id: int) -> Optional[UserStats]:
+        data = self._db.get(str(user_id))
+        return UserStats(**data) if data else None
+
+    def increment(self, user_id: int, **deltas: int) -> None:
+        """Прибавить к счётчикам пользователя сразу несколько значений за одну запись."""
+        if not deltas:
+            return
+        for field in deltas:
+            if field not in COUNTER_FIELDS:
+                raise ValueError(f"Неизвестный счётчик: {field}")
+        with self._lock:
+            s = self._get(user_id) or UserStats(user_id=user_id)
+            for field, delta in deltas.items():
+                setattr(s, field, getattr(s, field) + delta)
+            self._db.set(str(user_id), asdict(s))
+        for listener in self._increment_listeners:
+            listener(user_id, deltas)
+
     def get_user_stats(self, user_id: int) -> UserStats:
         """Публичный метод для получения статистики пользователя."""
-        return self._get_or_create(user_id)
+        s = self._get(user_id)
+        if s is not None:
+            return s
+        with self._lock:
+            s = self._get(user_id)
+            if s is None:
+                s = UserStats(user_id=user_id)
+                self._db.set(str(user_id), asdict(s))
+            return s
 
     def inc_feed(self, user_id: int) -> None:
-        stats = self._load_all()
-        s = self._get_or_create(user_id)
-        s.feed_events += 1
-        stats[str(user_id)] = s
-        self._save_all(stats)
+        self.increment(user_id, feed_events=1)
 
     def inc_water(self, user_id: int) -> None:
-        stats = self._load_all()
-        s = self._get_or_create(user_id)
-        s.water_events += 1
-        stats[str(user_id)] = s
-        self._save_all(stats)
+        self.increment(user_id, water_events=1)
 
     def inc_work(self, user_id: int) -> None:
-        stats = self._load_all()
-        s = self._get_or_create(user_id)
-        s.work_sessions += 1
-        stats[str(user_id)] = s
-        self._save_all(stats)
+        self.increment(user_id, work_sessions=1)
 
     def inc_hobby(self, user_id: int) -> None:
-        stats = self._load_all()
-        s = self._get_or_create(user_id)
-        s.hobby_sessions += 1
-        stats[str(user_id)] = s
-        self._save_all(stats)
+        self.increment(user_id, hobby_sessions=1)
 
     def add_sleep_minutes(self, user_id: int, minutes: int) -> None:
-        stats = self._load_all()
-        s = self._get_or_create(user_id)
-        s.total_sleep_minutes += max(0, minutes)
-        stats[str(user_id)] = s
-        self._save_all(stats)
+        self.increment(user_id, total_sleep_minutes=max(0, minutes))
 
     def get_all(self) -> Dict[str, UserStats]:
-        return self._load_all()
-
+        return {uid: UserStats(**data) for uid, data in self._db.iter_items()}
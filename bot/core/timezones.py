@@ -0,0 +1,27 @@
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from settings import DEFAULT_TIMEZONE
+
+
+@lru_cache(maxsize=1024)
+def get_zone(name: str) -> ZoneInfo:
+    """
+    ZoneInfo по имени из настроек пользователя.
+
+    Неизвестное имя даёт часовой пояс по умолчанию. Результат кэшируется,
+    в том числе для неизвестных имён, чтобы не ловить исключение на
+    каждом обращении.
+    """
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def is_known_zone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return False
+    return True
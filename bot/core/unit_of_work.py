@@ -0,0 +1,185 @@
+"""
+Единица работы на один апдейт.
+
+Пока обрабатывается сообщение пользователя, его UserState загружается из
+хранилища один раз и дальше отдаётся из памяти: повторные get_user
+возвращают тот же объект, save_user только помечает его изменённым, а
+инкременты статистики копятся. После обработчика middleware записывает
+пользователя и счётчики — по одной записи в каждое хранилище.
+
+Обращения к другим пользователям (друзья, совместные активности) идут в
+хранилище как обычно.
+"""
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from bot.core.health import degrade_pet
+from bot.core.models import PetSummary, UserState
+from bot.storage.async_repo import AsyncRepository
+
+
+class UnitOfWork:
+    def __init__(self, user_id: int) -> None:
+        self.user_id = user_id
+        self.user: Optional[UserState] = None
+        self.loaded = False
+        self.dirty = False
+        self.degraded = False
+        self.stats: Dict[str, int] = {}
+
+
+_current: ContextVar[Optional[UnitOfWork]] = ContextVar("unit_of_work", default=None)
+
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    return _current.get()
+
+
+def degrade_once(user: UserState) -> None:
+    """
+    degrade_pet не чаще одного раза за апдейт.
+
+    Повторный вызов через миллисекунды не безобиден: значения округляются
+    вниз, и каждый лишний вызов отнимал у выдры по единице каждого параметра.
+    """
+    uow = _current.get()
+    if uow is not None and uow.user is user:
+        if uow.degraded:
+            return
+        uow.degraded = True
+    degrade_pet(user)
+
+
+class UnitOfWorkUsersRepository:
+    """Репозиторий пользователей, который видит единицу работы текущего апдейта."""
+
+    def __init__(self, repo: AsyncRepository) -> None:
+        self._repo = repo
+
+    async def get_user(self, user_id: int) -> Optional[UserState]:
+        uow = _current.get()
+        if uow is None or user_id != uow.user_id:
+            return await self._repo.get_user(user_id)
+        if not uow.loaded:
+            uow.user = await self._repo.get_user(user_id)
+            uow.loaded = True
+        return uow.user
+
+    async def get_users(self, user_ids: Iterable[int]) -> Dict[int, UserState]:
+        user_ids = list(user_ids)
+        users = await self._repo.get_users(user_ids)
+        uow = _current.get()
+        # Текущий пользователь мог измениться в этом апдейте: отдаём его версию из памяти
+        if uow is not None and uow.loaded and uow.user is not None and uow.user_id in user_ids:
+            users[uow.user_id] = uow.user
+        return users
+
+    async def get_pet_summaries(self, user_ids: Iterable[int]) -> Dict[int, PetSummary]:
+        user_ids = list(user_ids)
+        summaries = await self._repo.get_pet_summaries(user_ids)
+        uow = _current.get()
+        if uow is not None and uow.loaded and uow.user is not None and uow.user_id in user_ids:
+            pet = uow.user.pet
+            summaries[uow.user_id] = PetSummary(uow.user_id, pet.name, pet.age_days, pet.is_alive)
+        return summaries
+
+    async def save_user(self, user: UserState) -> None:
+        uow = _current.get()
+        if uow is None or user.user_id != uow.user_id:
+            await self._repo.save_user(user)
+            return
+        uow.user = user
+        uow.loaded = True
+        uow.dirty = True
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._repo, name)
+
+
+class UnitOfWorkStatsRepository:
+    """Статистика, которая копит инкременты текущего пользователя до конца апдейта."""
+
+    def __init__(self, repo: AsyncRepository) -> None:
+        self._repo = repo
+
+    async def _add(self, user_id: int, field: str, delta: int) -> None:
+        uow = _current.get()
+        if uow is None or user_id != uow.user_id:
+            await self._repo.increment(user_id, **{field: delta})
+            return
+        uow.stats[field] = uow.stats.get(field, 0) + delta
+
+    async def inc_feed(self, user_id: int) -> None:
+        await self._add(user_id, "feed_events", 1)
+
+    async def inc_water(self, user_id: int) -> None:
+        await self._add(user_id, "water_events", 1)
+
+    async def inc_work(self, user_id: int) -> None:
+        await self._add(user_id, "work_sessions", 1)
+
+    async def inc_hobby(self, user_id: int) -> None:
+        await self._add(user_id, "hobby_sessions", 1)
+
+    async def add_sleep_minutes(self, user_id: int, minutes: int) -> None:
+        await self._add(user_id, "total_sleep_minutes", max(0, minutes))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._repo, name)
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    Открывает единицу работы на время обработчика и фиксирует её после.
+
+    Апдейты одного пользователя сюда приходят по очереди (см. mailboxes).
+    Изменения записываются и тогда, когда обработчик упал: обычно падает
+    ответ пользователю уже после того, как монеты, сон или вода изменены,
+    и откатывать их нельзя — пользователь повторит действие и получит его
+    дважды. Ошибка обработчика после записи пробрасывается дальше как есть.
+    При отмене (остановка бота) ничего не записывается.
+    """
+
+    def __init__(self, users_repo: AsyncRepository, stats_repo: AsyncRepository) -> None:
+        self._users = users_repo
+        self._stats = stats_repo
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = getattr(event, "from_user", None)
+        if from_user is None:
+            return await handler(event, data)
+
+        uow = UnitOfWork(from_user.id)
+        token = _current.set(uow)
+        try:
+            result = await handler(event, data)
+        except Exception:
+            # Отмену задачи и KeyboardInterrupt при остановке не фиксируем: обработчик
+            # прерван на полпути. Ошибка записи не должна подменять ошибку обработчика
+            try:
+                await self._commit(uow)
+            except Exception as e:
+                print(f"Error in unit of work commit for {uow.user_id}: {e}")
+            raise
+        finally:
+            _current.reset(token)
+        await self._commit(uow)
+        return result
+
+    async def _commit(self, uow: UnitOfWork) -> None:
+        writes = []
+        if uow.dirty and uow.user is not None:
+            writes.append(self._users.save_user(uow.user))
+        if uow.stats:
+            writes.append(self._stats.increment(uow.user_id, **uow.stats))
+        if writes:
+            await asyncio.gather(*writes)
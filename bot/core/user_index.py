@@ -0,0 +1,205 @@
+"""
+Вторичные индексы пользователей в памяти.
+
+Строятся одним проходом по хранилищу при старте и поддерживаются
+слушателями сохранений UsersRepository и изменений дружб, поэтому для выборок «все
+пользователи в часовом поясе X» или «живые выдры, заходившие за неделю»
+не нужно читать и разбирать всех пользователей.
+
+Индексы: часовой пояс, состояние выдры (жива / в отпуске / умерла), день
+последней активности (last_main_menu_return), есть ли друзья, задана ли
+норма воды.
+"""
+import asyncio
+import bisect
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from bot.core.models import UserState
+from bot.core.timezones import get_zone
+
+ALIVE = "alive"
+VACATION = "vacation"
+DEAD = "dead"
+PET_STATUSES = (ALIVE, VACATION, DEAD)
+
+# Ответ обработчиков, которым нужны индексы, пока ready не выставлен
+INDEXES_NOT_READY = "Данные ещё загружаются после перезапуска, попробуй через минуту."
+
+
+@dataclass
+class AudienceFilter:
+    """Условия выборки пользователей; None — условие не задано."""
+
+    timezone: Optional[str] = None
+    status: Optional[str] = None
+    # Заходил в главное меню не раньше, чем active_days дней назад
+    active_days: Optional[int] = None
+    has_friends: Optional[bool] = None
+    water_norm_set: Optional[bool] = None
+
+
+def pet_status(user: UserState) -> str:
+    if not user.pet.is_alive:
+        return DEAD
+    if user.pet.vacation_mode:
+        return VACATION
+    return ALIVE
+
+
+def _active_day(user: UserState) -> Optional[date]:
+    if not user.last_main_menu_return:
+        return None
+    try:
+        return datetime.fromisoformat(user.last_main_menu_return).astimezone(timezone.utc).date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _move(index: Dict, old_key, new_key, user_id: int) -> None:
+    if old_key == new_key:
+        return
+    if old_key is not None:
+        index[old_key].discard(user_id)
+    if new_key is not None:
+        index.setdefault(new_key, set()).add(user_id)
+
+
+def _mark(members: Set[int], user_id: int, flag: bool) -> None:
+    if flag:
+        members.add(user_id)
+    else:
+        members.discard(user_id)
+
+
+class UserIndex:
+    def __init__(self) -> None:
+        # Сохранения приходят из потоков хранилища
+        self._lock = threading.Lock()
+        self._zone_of: Dict[int, str] = {}
+        self._by_zone: Dict[str, Set[int]] = {}
+        self._status_of: Dict[int, str] = {}
+        self._by_status: Dict[str, Set[int]] = {status: set() for status in PET_STATUSES}
+        self._active_of: Dict[int, date] = {}
+        self._by_active_day: Dict[date, Set[int]] = {}
+        self._with_friends: Set[int] = set()
+        self._water_norm_set: Set[int] = set()
+        # Все user_id по возрастанию: курсор рассылок идёт по этому списку
+        self._ids: List[int] = []
+        # Выставляется после первого построения индекса
+        self.ready = asyncio.Event()
+
+    def rebuild(self, users: Iterable[UserState], friend_counts: Dict[int, int]) -> None:
+        with self._lock:
+            self._with_friends.update(user_id for user_id, count in friend_counts.items() if count)
+            for user in users:
+                # Пользователи, сохранённые во время чтения снимка, уже проиндексированы по свежим данным
+                if user.user_id not in self._zone_of:
+                    self._update(user, keep_sorted=False)
+            self._ids = sorted(self._zone_of)
+        self.ready.set()
+
+    def on_user_saved(self, user: UserState) -> None:
+        """Слушатель UsersRepository.add_save_listener."""
+        with self._lock:
+            self._update(user)
+
+    def on_friends_changed(self, user_id: int, count: int) -> None:
+        """Слушатель FriendsRepository.add_change_listener."""
+        with self._lock:
+            _mark(self._with_friends, user_id, count > 0)
+
+    def _update(self, user: UserState, keep_sorted: bool = True) -> None:
+        user_id = user.user_id
+        if user_id not in self._zone_of and keep_sorted:
+            bisect.insort(self._ids, user_id)
+        # Ключ — каноническое имя пояса: неизвестные имена попадают в пояс по умолчанию
+        zone = get_zone(user.settings.timezone).key
+        _move(self._by_zone, self._zone_of.get(user_id), zone, user_id)
+        self._zone_of[user_id] = zone
+
+        status = pet_status(user)
+        _move(self._by_status, self._status_of.get(user_id), status, user_id)
+        self._status_of[user_id] = status
+
+        day = _active_day(user)
+        _move(self._by_active_day, self._active_of.get(user_id), day, user_id)
+        if day is None:
+            self._active_of.pop(user_id, None)
+        else:
+            self._active_of[user_id] = day
+
+        _mark(self._water_norm_set, user_id, user.settings.water_norm_set)
+
+    def zone_of(self, user_id: int) -> str:
+        with self._lock:
+            return self._zone_of.get(user_id, "")
+
+    def zones(self) -> List[str]:
+        with self._lock:
+            return [zone for zone, users in self._by_zone.items() if users]
+
+    def users_in_zone(self, zone: str, include_muted: bool = True) -> List[int]:
+        """Пользователи пояса; include_muted=False — без мёртвых и отпускных выдр."""
+        with self._lock:
+            users = self._by_zone.get(zone, set())
+            if include_muted:
+                return list(users)
+            alive = self._by_status[ALIVE]
+            return [user_id for user_id in users if user_id in alive]
+
+    def select(self, audience: AudienceFilter) -> List[int]:
+        """
+        user_id, подходящие под все условия, по возрастанию.
+
+        Перебирается самое маленькое из подходящих множеств, остальные
+        условия проверяются поиском в множествах, поэтому выборка 1%
+        пользователей стоит примерно 1% от полного прохода.
+        """
+        with self._lock:
+            # (размер, получить множество) для условий, которые можно перебирать
+            seeds: List[tuple] = []
+            checks: List[Callable[[int], bool]] = []
+
+            if audience.timezone is not None:
+                zone = self._by_zone.get(get_zone(audience.timezone).key, set())
+                seeds.append((len(zone), lambda zone=zone: zone))
+                checks.append(zone.__contains__)
+            if audience.status is not None:
+                members = self._by_status.get(audience.status, set())
+                seeds.append((len(members), lambda members=members: members))
+                checks.append(members.__contains__)
+            if audience.active_days is not None:
+                cutoff = datetime.now(timezone.utc).date() - timedelta(days=audience.active_days)
+                days = [day for day in self._by_active_day if day >= cutoff]
+                size = sum(len(self._by_active_day[day]) for day in days)
+                seeds.append((size, lambda days=days: set().union(*(self._by_active_day[day] for day in days))))
+                active_of = self._active_of
+                checks.append(lambda user_id: active_of.get(user_id, date.min) >= cutoff)
+            for flag, members in (
+                (audience.has_friends, self._with_friends),
+                (audience.water_norm_set, self._water_norm_set),
+            ):
+                if flag is True:
+                    seeds.append((len(members), lambda members=members: members))
+                    checks.append(members.__contains__)
+                elif flag is False:
+                    # Дополнение перебирать дорого, поэтому только проверка
+                    checks.append(lambda user_id, members=members: user_id not in members)
+
+            if not seeds:
+                candidates: Iterable[int] = self._ids
+            else:
+                candidates = min(seeds, key=lambda seed: seed[0])[1]()
+            if checks:
+                result = [user_id for user_id in candidates if all(check(user_id) for check in checks)]
+            else:
+                result = list(candidates)
+        if seeds:
+            result.sort()
+        return result
+
+
+user_index = UserIndex()
@@ -0,0 +1,82 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from settings import STORAGE_IO_WORKERS
+
+# Отдельный пул для файлового/SQLite ввода-вывода: его размер и есть
+# предел одновременных обращений к хранилищу
+_executor = ThreadPoolExecutor(max_workers=STORAGE_IO_WORKERS, thread_name_prefix="storage-io")
+
+
+async def run_blocking(fn: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Выполнить блокирующую функцию в пуле хранилища, не занимая цикл событий."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+class AsyncRepository:
+    """
+    Асинхронная обёртка над синхронным репозиторием.
+
+    Любой метод репозитория становится корутиной, которая выполняется в
+    пуле потоков хранилища:
+
+        user = await users_repo.get_user(user_id)
+
+    exclusive=True — вызовы выполняются строго по одному. Нужно
+    репозиториям, которые делают «прочитать всё — изменить — записать всё»
+    (комнаты на JSON), иначе параллельные вызовы теряют обновления друг друга.
+    """
+
+    def __init__(self, repo: Any, exclusive: bool = False) -> None:
+        self.sync = repo
+        self._lock = threading.Lock() if exclusive else None
+        self._methods: Dict[str, Callable] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.sync, name)
+        if not callable(attr):
+            return attr
+        method = self._methods.get(name)
+        if method is None:
+            method = self._wrap(attr)
+            self._methods[name] = method
+        return method
+
+    def _wrap(self, fn: Callable) -> Callable:
+        lock = self._lock
+        if lock is not None:
+            def locked(*args: Any, **kwargs: Any) -> Any:
+                with lock:
+                    return fn(*args, **kwargs)
+            target = locked
+        else:
+            target = fn
+
+        @functools.wraps(fn)
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await run_blocking(target, *args, **kwargs)
+
+        return call
+
+
+_wrappers: Dict[int, AsyncRepository] = {}
+_wrappers_lock = threading.Lock()
+
+
+def as_async(repo: Any, exclusive: bool = False) -> AsyncRepository:
+    """
+    Возвращает асинхронную обёртку репозитория, одну на процесс.
+
+    Модули, обернувшие один и тот же репозиторий, получают общую обёртку,
+    а значит и общую блокировку в режиме exclusive.
+    """
+    with _wrappers_lock:
+        wrapper = _wrappers.get(id(repo))
+        if wrapper is None:
+            wrapper = AsyncRepository(repo, exclusive=exclusive)
+            _wrappers[id(repo)] = wrapper
+        return wrapper
@@ -1,51 +1,336 @@
+import asyncio
+import copy
 import json
+import os
+import threading
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from bot.storage.async_repo import run_blocking
+from settings import (
+    DATA_DIR as DATA_DIR_OVERRIDE,
+    JSONDB_FLUSH_INTERVAL,
+    JSONDB_JOURNAL_MAX_BYTES,
+    JSONDB_MODE,
+)
 
 BASE_DIR = Path(__file__).resolve().parents[1]
-DATA_DIR = BASE_DIR / "data"
+DATA_DIR = Path(DATA_DIR_OVERRIDE) if DATA_DIR_OVERRIDE else BASE_DIR / "data"
 
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
+class StorageCorruptedError(RuntimeError):
+    """Файл хранилища повреждён и не может быть прочитан."""
+
+
+def _load_json_file(path: Path) -> Dict[str, Any]:
+    with path.open("r", encoding="utf-8") as f:
+        content = f.read()
+    if not content.strip():
+        return {}
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError as e:
+        # Не возвращаем {}: следующая запись молча затёрла бы все данные
+        raise StorageCorruptedError(f"Файл {path} повреждён: {e}") from e
+
+
+def _atomic_dump(path: Path, data: Any, tmp: Optional[Path] = None) -> None:
+    """Запись через временный файл и os.replace: на диске всегда целая версия."""
+    if tmp is None:
+        tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class _FileCache:
+    """
+    Резидентная копия одного JSON-файла.
+
+    Общая для всех экземпляров JsonDB, открытых на один и тот же файл,
+    чтобы разные репозитории не расходились между собой.
+    """
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
+        self.dirty = False
+        self.lock = threading.RLock()
+        # Один сброс на диск за раз: иначе старый снимок мог бы лечь поверх нового.
+        # Чтения и записи сброс не ждут, они берут только lock
+        self.flush_lock = threading.Lock()
+        # Только для режима "journal": журнал, открытый на дозапись, и его размер
+        self.journal: Optional[TextIO] = None
+        self.journal_size = 0
+
+
+# Путь к файлу -> его резидентная копия (режимы "cached" и "journal")
+_caches: Dict[Path, _FileCache] = {}
+_caches_lock = threading.Lock()
+
+# Путь к файлу -> режим, в котором его открыли первым. Режим общий для всех
+# экземпляров: прямые записи мимо резидентной копии (или две копии на файл)
+# теряли бы данные друг друга
+_modes: Dict[Path, str] = {}
+
+# Путь к файлу -> блокировка «прочитать-изменить-записать» для режима "direct":
+# репозитории вызываются из пула потоков, и без неё записи теряли бы друг друга
+_direct_locks: Dict[Path, threading.RLock] = {}
+
+
 class JsonDB:
     """
     Простое файловое JSON-хранилище.
 
     Хранит один словарь {key: value} в одном файле.
+
+    Режимы работы:
+    - "direct" — каждое обращение читает и переписывает файл целиком;
+    - "cached" — словарь держится в памяти, запись только помечает его
+      «грязным», а на диск он сбрасывается фоновым flush_worker и при
+      остановке бота (flush_all);
+    - "journal" — словарь держится в памяти, каждая запись дописывает одну
+      строку в журнал <file>.log. При старте журнал проигрывается поверх
+      снимка; когда журнал вырастает больше JSONDB_JOURNAL_MAX_BYTES,
+      снимок переписывается целиком, а журнал обнуляется.
+
+    Файл работает в том режиме, в котором его открыли первым в процессе:
+    следующие экземпляры на тот же файл получают этот режим, какой бы ни
+    просили.
     """
 
-    def __init__(self, filename: str) -> None:
+    def __init__(self, filename: str, mode: Optional[str] = None) -> None:
         self.path = DATA_DIR / filename
-        if not self.path.exists():
-            self._write({})
+        self.journal_path = self.path.with_name(self.path.name + ".log")
+        with _caches_lock:
+            self.mode = _modes.setdefault(self.path, mode or JSONDB_MODE)
+            self._lock = _direct_locks.setdefault(self.path, threading.RLock())
+        with self._lock:
+            if not self.path.exists():
+                self._write({})
+        self._cache: Optional[_FileCache] = None
+        if self.mode != "journal" and self.path not in _caches and self.journal_path.exists():
+            # Файл раньше открывали в режиме "journal": забираем хвост журнала в снимок
+            with self._lock:
+                self._fold_journal()
+        if self.mode == "cached":
+            self._cache = _get_cache(self.path, lambda: _FileCache(self._read()))
+        elif self.mode == "journal":
+            self._cache = _get_cache(self.path, self._open_journal)
 
     def _read(self) -> Dict[str, Any]:
-        with self.path.open("r", encoding="utf-8") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {}
+        return _load_json_file(self.path)
 
     def _write(self, data: Dict[str, Any]) -> None:
-        with self.path.open("w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        _atomic_dump(self.path, data)
 
     def get_all(self) -> Dict[str, Any]:
+        if self._cache is not None:
+            with self._cache.lock:
+                return copy.deepcopy(self._cache.data)
         return self._read()
 
+    def iter_items(self) -> Iterator[Tuple[str, Any]]:
+        return iter(self.get_all().items())
+
     def get(self, key: str, default: Any = None) -> Any:
+        if self._cache is not None:
+            with self._cache.lock:
+                # Отдаём копию, чтобы изменения объекта без set() не попадали в кэш
+                return copy.deepcopy(self._cache.data.get(key, default))
         return self._read().get(key, default)
 
-    def set(self, key: str, value: Any) -> None:
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Значения нескольких ключей за одно чтение; отсутствующие ключи пропускаются."""
+        if self._cache is not None:
+            with self._cache.lock:
+                data = self._cache.data
+                return {key: copy.deepcopy(data[key]) for key in keys if key in data}
         data = self._read()
-        data[key] = value
-        self._write(data)
+        return {key: data[key] for key in keys if key in data}
+
+    def set(self, key: str, value: Any) -> None:
+        if self._cache is not None:
+            with self._cache.lock:
+                self._cache.data[key] = copy.deepcopy(value)
+                if self._cache.journal is not None:
+                    self._append({"op": "set", "key": key, "value": value})
+                else:
+                    self._cache.dirty = True
+            return
+        with self._lock:
+            data = self._read()
+            data[key] = value
+            self._write(data)
 
     def delete(self, key: str) -> None:
+        if self._cache is not None:
+            with self._cache.lock:
+                if key in self._cache.data:
+                    del self._cache.data[key]
+                    if self._cache.journal is not None:
+                        self._append({"op": "delete", "key": key})
+                    else:
+                        self._cache.dirty = True
+            return
+        with self._lock:
+            data = self._read()
+            if key in data:
+                del data[key]
+                self._write(data)
+
+    def replace_all(self, data: Dict[str, Any]) -> None:
+        """Полностью заменить содержимое хранилища."""
+        if self._cache is not None:
+            with self._cache.lock:
+                self._cache.data = copy.deepcopy(data)
+                if self._cache.journal is not None:
+                    self._compact()
+                else:
+                    self._cache.dirty = True
+            return
+        with self._lock:
+            self._write(data)
+
+    def flush(self) -> None:
+        """Сбросить резидентную копию (или журнал) на диск."""
+        if self._cache is None:
+            return
+        _flush_cache(self.path, self._cache)
+
+    # ----- журнал -----
+
+    def _replay_journal(self, data: Dict[str, Any]) -> Tuple[int, bool]:
+        """
+        Проиграть журнал поверх data. Возвращает число применённых записей
+        и признак недописанной последней строки.
+        """
+        if not self.journal_path.exists():
+            return 0, False
+        with self.journal_path.open("r", encoding="utf-8") as f:
+            lines = f.readlines()
+        replayed = 0
+        for i, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                if i == len(lines) - 1:
+                    # Недописанная последняя строка: процесс упал посреди записи
+                    return replayed, True
+                raise StorageCorruptedError(
+                    f"Журнал {self.journal_path} повреждён в строке {i + 1}: {e}"
+                ) from e
+            if entry["op"] == "set":
+                data[entry["key"]] = entry["value"]
+            elif entry["op"] == "delete":
+                data.pop(entry["key"], None)
+            replayed += 1
+        return replayed, False
+
+    def _fold_journal(self) -> None:
         data = self._read()
-        if key in data:
-            del data[key]
+        replayed, _ = self._replay_journal(data)
+        if replayed:
             self._write(data)
+        self.journal_path.unlink()
+
+    def _open_journal(self) -> _FileCache:
+        cache = _FileCache(self._read())
+        replayed, torn = self._replay_journal(cache.data)
+        cache.journal = self.journal_path.open("a", encoding="utf-8")
+        cache.journal_size = self.journal_path.stat().st_size
+        if replayed or torn:
+            # Сворачиваем проигранный журнал в свежий снимок. Журнал с
+            # недописанной строкой сворачиваем всегда: иначе следующая запись
+            # допишется к обрывку и при рестарте пропадёт или испортит журнал
+            self._cache = cache
+            self._compact()
+        return cache
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        cache = self._cache
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        cache.journal.write(line)
+        # Сбрасываем в ОС сразу, fsync делает flush_worker
+        cache.journal.flush()
+        cache.journal_size += len(line.encode("utf-8"))
+        if cache.journal_size > JSONDB_JOURNAL_MAX_BYTES:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Переписать снимок из памяти и обнулить журнал."""
+        cache = self._cache
+        _atomic_dump(self.path, cache.data)
+        # Снимок уже на диске; если упадём до обрезки журнала,
+        # повторное проигрывание идемпотентно
+        cache.journal.close()
+        cache.journal = self.journal_path.open("w", encoding="utf-8")
+        cache.journal_size = 0
+
 
-    
\ No newline at end of file
+def _get_cache(path: Path, factory) -> _FileCache:
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = factory()
+            _caches[path] = cache
+        return cache
+
+
+def _flush_cache(path: Path, cache: _FileCache) -> None:
+    """
+    Под cache.lock только снимается копия (или дескриптор журнала), запись
+    и fsync идут без неё, чтобы не останавливать обращения к файлу.
+    """
+    with cache.flush_lock:
+        with cache.lock:
+            if cache.journal is not None:
+                # Свой дескриптор: сжатие журнала может закрыть и переоткрыть файл
+                fd = os.dup(cache.journal.fileno())
+                data = None
+            elif cache.dirty:
+                # Значения в кэше не меняются на месте (set кладёт новую копию),
+                # поэтому поверхностной копии словаря достаточно
+                data = dict(cache.data)
+                cache.dirty = False
+                fd = None
+            else:
+                return
+        if fd is not None:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            return
+        try:
+            _atomic_dump(path, data)
+        except BaseException:
+            with cache.lock:
+                cache.dirty = True
+            raise
+
+
+def flush_all() -> None:
+    """Сбросить на диск все изменённые резидентные файлы и журналы."""
+    with _caches_lock:
+        items: List = list(_caches.items())
+    for path, cache in items:
+        _flush_cache(path, cache)
+
+
+async def flush_worker(interval: float = JSONDB_FLUSH_INTERVAL) -> None:
+    """
+    Периодически сбрасывает кэшированные файлы и журналы на диск.
+    Запускается вместе с ботом всегда: журнальные файлы (статистика, outbox,
+    рассылки) есть и при JSONDB_MODE=direct, а без открытых кэшей проход
+    ничего не делает. Запись и fsync идут в пуле хранилища, а не в цикле
+    событий.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        await run_blocking(flush_all)
@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+from bot.storage.json_db import DATA_DIR, StorageCorruptedError, _atomic_dump
+
+
+class ShardedJsonDB:
+    """
+    JSON-хранилище «одна запись — один файл».
+
+    Каждый ключ хранится в отдельном файле <dirname>/<key>.json, поэтому
+    чтение и запись одной записи не зависят от общего числа записей.
+    Интерфейс совпадает с JsonDB.
+    """
+
+    def __init__(self, dirname: str) -> None:
+        self.dir = DATA_DIR / dirname
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.dir / f"{key}.json"
+
+    def _read_file(self, path: Path) -> Any:
+        with path.open("r", encoding="utf-8") as f:
+            content = f.read()
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError as e:
+            # Пустой файл тоже повреждение: запись всегда содержит объект.
+            # Не пропускаем файл молча, иначе запись выпадет из обходов и индексов
+            raise StorageCorruptedError(f"Файл {path} повреждён: {e}") from e
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self._read_file(self._path(key))
+        except FileNotFoundError:
+            return default
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Значения нескольких ключей: читаются только их файлы; отсутствующие пропускаются."""
+        result = {}
+        for key in keys:
+            try:
+                result[key] = self._read_file(self._path(key))
+            except FileNotFoundError:
+                continue
+        return result
+
+    def set(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        # Временный файл свой у каждого потока, чтобы параллельные записи не смешивались
+        tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        # fsync и атомарная замена: после сбоя файл пользователя не окажется пустым или недописанным
+        _atomic_dump(path, value, tmp)
+
+    def delete(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def iter_items(self) -> Iterator[Tuple[str, Any]]:
+        """Потоково обходит все записи, не загружая их в память разом."""
+        with os.scandir(self.dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    value = self._read_file(Path(entry.path))
+                except FileNotFoundError:
+                    # Запись удалили между обходом каталога и чтением
+                    continue
+                yield entry.name[: -len(".json")], value
+
+    def get_all(self) -> Dict[str, Any]:
+        return dict(self.iter_items())
+
+    def replace_all(self, data: Dict[str, Any]) -> None:
+        """Полностью заменить содержимое хранилища."""
+        for key, _ in list(self.iter_items()):
+            if key not in data:
+                self.delete(key)
+        for key, value in data.items():
+            self.set(key, value)
@@ -0,0 +1,156 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from bot.storage.json_db import DATA_DIR
+from settings import SQLITE_PATH
+
+
+class SqliteDB:
+    """
+    Общее SQLite-подключение процесса.
+
+    База работает в режиме WAL (читатели не блокируют писателя), запросы
+    выполняются с параметрами, поэтому sqlite3 переиспользует
+    подготовленные выражения из своего кэша.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(
+            str(self.path),
+            isolation_level=None,  # автокоммит; транзакции открываем явно
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.lock = threading.RLock()
+
+    def execute(self, sql: str, params: Tuple = ()) -> sqlite3.Cursor:
+        with self.lock:
+            return self.conn.execute(sql, params)
+
+    def query_one(self, sql: str, params: Tuple = ()) -> Optional[Tuple]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    def query_all(self, sql: str, params: Tuple = ()) -> list:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+
+_databases: Dict[Path, SqliteDB] = {}
+_databases_lock = threading.Lock()
+
+
+def get_sqlite_db(path: Optional[Path] = None) -> SqliteDB:
+    """Возвращает (и при первом вызове открывает) подключение к базе."""
+    if path is None:
+        path = Path(SQLITE_PATH) if SQLITE_PATH else DATA_DIR / "fefus.sqlite3"
+    with _databases_lock:
+        db = _databases.get(path)
+        if db is None:
+            db = SqliteDB(path)
+            _databases[path] = db
+        return db
+
+
+class SqliteKV:
+    """
+    Таблица «ключ → JSON-документ» с интерфейсом JsonDB.
+
+    Позволяет использовать существующие репозитории (пользователи, хобби,
+    настройки админа) поверх SQLite: каждая операция затрагивает одну строку.
+    """
+
+    def __init__(self, db: SqliteDB, table: str, key_column: str = "key") -> None:
+        self.db = db
+        self.table = table
+        self.key_column = key_column
+        self.db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            f"{key_column} TEXT PRIMARY KEY, "
+            f"data TEXT NOT NULL)"
+        )
+        self._sql_get = f"SELECT data FROM {table} WHERE {key_column} = ?"
+        self._sql_set = (
+            f"INSERT INTO {table} ({key_column}, data) VALUES (?, ?) "
+            f"ON CONFLICT({key_column}) DO UPDATE SET data = excluded.data"
+        )
+        self._sql_delete = f"DELETE FROM {table} WHERE {key_column} = ?"
+        self._sql_all = f"SELECT {key_column}, data FROM {table}"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self.db.query_one(self._sql_get, (key,))
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def get_many(self, keys: Iterable[str], batch_size: int = 500) -> Dict[str, Any]:
+        """Значения нескольких ключей запросами WHERE ... IN; отсутствующие ключи пропускаются."""
+        keys = list(keys)
+        result = {}
+        # Пачками: у SQLite есть предел числа параметров в запросе
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            placeholders = ", ".join("?" * len(batch))
+            rows = self.db.query_all(
+                f"{self._sql_all} WHERE {self.key_column} IN ({placeholders})", tuple(batch)
+            )
+            for key, data in rows:
+                result[key] = json.loads(data)
+        return result
+
+    def set(self, key: str, value: Any) -> None:
+        self.db.execute(self._sql_set, (key, json.dumps(value, ensure_ascii=False)))
+
+    def delete(self, key: str) -> None:
+        self.db.execute(self._sql_delete, (key,))
+
+    def iter_items(self, batch_size: int = 500) -> Iterator[Tuple[str, Any]]:
+        """Потоково обходит таблицу пачками, не держа блокировку между пачками."""
+        last_key = None
+        while True:
+            if last_key is None:
+                rows = self.db.query_all(
+                    f"{self._sql_all} ORDER BY {self.key_column} LIMIT ?", (batch_size,)
+                )
+            else:
+                rows = self.db.query_all(
+                    f"{self._sql_all} WHERE {self.key_column} > ? ORDER BY {self.key_column} LIMIT ?",
+                    (last_key, batch_size),
+                )
+            if not rows:
+                return
+            for key, data in rows:
+                yield key, json.loads(data)
+            last_key = rows[-1][0]
+
+    def get_all(self) -> Dict[str, Any]:
+        return dict(self.iter_items())
+
+    def replace_all(self, data: Dict[str, Any]) -> None:
+        """Полностью заменить содержимое таблицы."""
+        with self.db.transaction() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.executemany(
+                self._sql_set,
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in data.items()],
+            )
@@ -2,18 +2,36 @@ import asyncio
 from datetime import datetime, timedelta, date, timezone
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import CommandStart, Command, StateFilter
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 
 from bot.core.config import load_config
-from bot.core.models import PetState, UserSettings, UserState
-from bot.core.repositories import UsersRepository, AdminRepository, HobbiesRepository
+from bot.core.models import Friendship, PetState, UserSettings, UserState
+from bot.core.backends import (
+    get_admin_repo,
+    get_coop_sessions_repo,
+    get_friends_repo,
+    get_hobbies_repo,
+    get_stats_repo,
+    get_users_repo,
+)
 from bot.core.admin_handlers import admin_router, cmd_admin
-from bot.core.reminders import reminders_worker
-from bot.core.health import degrade_pet, touch_pet, get_health_state, get_health_status_message, HealthState
+from bot.core.reminders import reminder_scheduler, reminders_worker
+from bot.core.outbox import outbox
+from bot.core.broadcasts import broadcasts
+from bot.core.timezones import is_known_zone
+from bot.core.user_index import INDEXES_NOT_READY, user_index
+from bot.core.aggregates import bot_aggregates
+from bot.core.indexes import build_indexes
+from bot.core.buttons import ignore, text_router
+from bot.core.charts import stats_chart
+from bot.core.leaderboards import COINS, FRIENDS, HAPPINESS, SLEEP, leaderboards
+from bot.core.health import touch_pet, get_health_state, get_health_status_message, HealthState
 from bot.core.hobby_system import (
     get_hobby_effectiveness,
     get_duration_for_hobby,
@@ -40,17 +58,26 @@ from bot.core.friends_system import (
     format_friendship_info,
     format_coop_result,
 )
-from bot.core.repositories import FriendsRepository, CoopSessionsRepository
-from bot.core.stats import StatsRepository
 from bot.core.menu import (
     main_menu_keyboard,
     actions_menu_keyboard,
     settings_menu_keyboard,
     friends_menu_keyboard,
+    water_norm_setup_keyboard,
+    weekly_advice_answer_keyboard,
     get_today_stats,
     format_weekly_stats,
 )
 from bot.core.advice import get_advice_for_today, get_weekly_advice_summary, get_monthly_advice_summary
+from bot.core.mailboxes import MailboxMiddleware, user_mailboxes
+from bot.core.unit_of_work import (
+    UnitOfWorkMiddleware,
+    UnitOfWorkStatsRepository,
+    UnitOfWorkUsersRepository,
+    degrade_once,
+)
+from bot.storage.async_repo import as_async, run_blocking
+from bot.storage.json_db import flush_all, flush_worker
 
 
 # FSM для ввода кода дружбы
@@ -74,20 +101,43 @@ DISLCAIMER_TEXT = (
 )
 
 
-users_repo = UsersRepository()
-admin_repo = AdminRepository()
-hobbies_repo = HobbiesRepository()
-social_rooms = SocialRooms()
-stats_repo = StatsRepository()
-friends_repo = FriendsRepository()
-coop_sessions_repo = CoopSessionsRepository()
+# Обращения к хранилищу выполняются в пуле потоков, чтобы не блокировать
+# цикл событий; комнаты на JSON меняются «всё целиком», поэтому их вызовы
+# идут строго по одному
+storage_users_repo = as_async(get_users_repo())
+storage_stats_repo = as_async(get_stats_repo())
+admin_repo = as_async(get_admin_repo())
+hobbies_repo = as_async(get_hobbies_repo())
+social_rooms = as_async(SocialRooms(), exclusive=True)
+
+# Любое сохранение пользователя (смена часового пояса, работа, смерть
+# выдры...) обновляет индекс поясов, расписание напоминаний, общую
+# статистику и рейтинги; инкременты статистики и изменения дружб тоже сразу
+# попадают в суммы, рейтинги и индексы
+get_users_repo().add_save_listener(user_index.on_user_saved)
+get_users_repo().add_save_listener(reminder_scheduler.on_user_saved)
+get_users_repo().add_save_listener(bot_aggregates.on_user_saved)
+get_users_repo().add_save_listener(leaderboards.on_user_saved)
+get_friends_repo().add_change_listener(user_index.on_friends_changed)
+get_friends_repo().add_change_listener(bot_aggregates.on_friends_changed)
+get_friends_repo().add_change_listener(leaderboards.on_friends_changed)
+get_stats_repo().add_increment_listener(bot_aggregates.on_stats_increment)
+get_stats_repo().add_increment_listener(leaderboards.on_stats_increment)
+get_stats_repo().add_increment_listener(stats_chart.on_stats_increment)
+
+# Обработчики работают с пользователем текущего апдейта через единицу
+# работы: он загружается один раз, а записывается после обработчика
+users_repo = UnitOfWorkUsersRepository(storage_users_repo)
+stats_repo = UnitOfWorkStatsRepository(storage_stats_repo)
+friends_repo = as_async(get_friends_repo())
+coop_sessions_repo = as_async(get_coop_sessions_repo())
 
 
 # Старое меню оставлено для обратной совместимости, но теперь используется новое главное меню
 
 
 async def cmd_start(message: Message) -> None:
-    existing = users_repo.get_user(message.from_user.id)
+    existing = await users_repo.get_user(message.from_user.id)
 
     if existing is None:
         # Первый запуск пользователя
@@ -106,7 +156,7 @@ async def cmd_start(message: Message) -> None:
 
 async def handle_pet_name(message: Message) -> None:
     # Проверяем, существует ли пользователь
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     
     # Если пользователь уже существует, проверяем, не вводит ли он норму воды
     if user is not None:
@@ -117,7 +167,7 @@ async def handle_pet_name(message: Message) -> None:
             await handle_water_norm_setup(message)
             return
         # Если пользователь существует и норма воды установлена, это не ввод имени
-        await handle_unknown(message)
+        await handle_text_with_inactivity_check(message)
         return
 
     # Пользователя нет в базе - это новый пользователь, вводящий имя выдры
@@ -136,13 +186,13 @@ async def handle_pet_name(message: Message) -> None:
         pet=pet,
         settings=settings,
     )
-    users_repo.save_user(user_state)
+    await users_repo.save_user(user_state)
 
     # Первый пользователь становится администратором
-    admin_settings = admin_repo.get_settings()
+    admin_settings = await admin_repo.get_settings()
     if not admin_settings.admin_ids:
         admin_settings.admin_ids.append(message.from_user.id)
-        admin_repo.save_settings(admin_settings)
+        await admin_repo.save_settings(admin_settings)
 
     # Спрашиваем про норму воды при первом запуске
     if not user_state.settings.water_norm_set:
@@ -162,14 +212,14 @@ async def handle_pet_name(message: Message) -> None:
 
 
 async def cmd_pet_status(message: Message) -> None:
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
 
     # Деградируем состояние выдры перед проверкой
-    degrade_pet(user)
-    users_repo.save_user(user)
+    degrade_once(user)
+    await users_repo.save_user(user)
     
     pet = user.pet
     
@@ -200,12 +250,12 @@ async def cmd_pet_status(message: Message) -> None:
 
 
 async def cmd_my_stats(message: Message) -> None:
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
 
-    stats = stats_repo.get_user_stats(user.user_id)
+    stats = await stats_repo.get_user_stats(user.user_id)
     sleep_hours = stats.total_sleep_minutes / 60
     
     await message.answer(
@@ -219,12 +269,40 @@ async def cmd_my_stats(message: Message) -> None:
     )
 
 
+# (рейтинг, подпись, формат очков)
+LEADERBOARD_LINES = (
+    (COINS, "💰 Монеты", "{:.0f}"),
+    (HAPPINESS, "😊 Счастье", "{:.0f}"),
+    (SLEEP, "💤 Часы сна", "{:.1f}"),
+    (FRIENDS, "🤝 Друзья", "{:.0f}"),
+)
+
+
+async def cmd_leaderboard(message: Message) -> None:
+    user = await users_repo.get_user(message.from_user.id)
+    if user is None:
+        await message.answer("Сначала нажми /start и создай свою выдру 🦦")
+        return
+
+    if not user_index.ready.is_set():
+        await message.answer(INDEXES_NOT_READY)
+        return
+    text = f"🏆 Место {user.pet.name} в рейтингах:\n\n"
+    for board, title, fmt in LEADERBOARD_LINES:
+        rank, score, total = leaderboards.rank(board, user.user_id)
+        if rank is None:
+            text += f"{title}: пока нет в рейтинге\n"
+        else:
+            text += f"{title}: {fmt.format(score)} — {rank} место из {total}\n"
+    await message.answer(text)
+
+
 async def handle_unknown(message: Message) -> None:
     await message.answer("Используй кнопки ниже, чтобы взаимодействовать с выдрой.")
 
 
 async def cmd_settings(message: Message) -> None:
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -240,12 +318,13 @@ async def cmd_settings(message: Message) -> None:
         "/set_name НовоеИмя — изменить имя выдры\n"
         "/set_timezone Region/City — изменить часовой пояс (например, Asia/Vladivostok)\n"
         "/pet_status — показать состояние выдры\n"
-        "/my_stats — показать твою статистику",
+        "/my_stats — показать твою статистику\n"
+        "/leaderboard — твоё место в рейтингах",
     )
 
 
 async def cmd_set_name(message: Message) -> None:
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -265,12 +344,12 @@ async def cmd_set_name(message: Message) -> None:
         user.settings.pet_name = new_name
     else:
         user.settings.pet_name = new_name
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     await message.answer(f"Теперь выдру зовут {new_name} 🦦")
 
 
 async def cmd_set_timezone(message: Message) -> None:
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -284,14 +363,20 @@ async def cmd_set_timezone(message: Message) -> None:
         return
 
     tz = parts[1].strip()
-    # Пока без валидации списка таймзон — просто сохраняем строку
+    if not is_known_zone(tz):
+        await message.answer(
+            f"Не знаю часовой пояс {tz} 🤔\n"
+            "Укажи его в формате Region/City, например: /set_timezone Asia/Vladivostok"
+        )
+        return
+    # Индекс поясов и расписание напоминаний обновятся слушателями сохранения
     user.settings.timezone = tz
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     await message.answer(f"Часовой пояс обновлён: {tz}")
 
 
 async def cmd_revive(message: Message) -> None:
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -310,7 +395,7 @@ async def cmd_revive(message: Message) -> None:
         # Сбрасываем флаг уведомления о смерти (на случай, если была мертва)
         if "death_notification_sent" in user.last_reminders:
             del user.last_reminders["death_notification_sent"]
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         await message.answer(
             "🦦 Выдра вернулась из отпуска и снова активна!\n"
             "Она скучала по тебе и готова к новым приключениям!",
@@ -335,12 +420,12 @@ async def cmd_revive(message: Message) -> None:
         if "death_notification_sent" in user.last_reminders:
             del user.last_reminders["death_notification_sent"]
         touch_pet(user)
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         await message.answer("Выдра воскресла благодаря твоей заботе 🦦❤️")
         return
 
     # Второе воскрешение — через подписку на канал
-    settings = admin_repo.get_settings()
+    settings = await admin_repo.get_settings()
     channel = settings.required_channel_username
     if not channel:
         await message.answer(
@@ -362,7 +447,7 @@ async def cmd_revive(message: Message) -> None:
             if "death_notification_sent" in user.last_reminders:
                 del user.last_reminders["death_notification_sent"]
             touch_pet(user)
-            users_repo.save_user(user)
+            await users_repo.save_user(user)
             await message.answer(
                 "Спасибо за поддержку канала! Выдра воскресла и готова продолжать путь сна и здоровья 🦦✨"
             )
@@ -381,14 +466,14 @@ async def cmd_revive(message: Message) -> None:
 
 
 async def get_or_ask_start(message: Message) -> UserState | None:
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return None
     
     # Деградируем состояние выдры перед проверкой
-    degrade_pet(user)
-    users_repo.save_user(user)
+    degrade_once(user)
+    await users_repo.save_user(user)
     
     pet = user.pet
     
@@ -407,7 +492,7 @@ async def get_or_ask_start(message: Message) -> UserState | None:
             reply_markup=main_menu_keyboard()
         )
         pet.vacation_mode = False
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
     
     return user
 
@@ -437,7 +522,7 @@ async def handle_wake_pet(message: Message) -> None:
         )
         return
 
-    degrade_pet(user)
+    degrade_once(user)
     pet.avatar_key = "awake"
     
     # Учитываем сон: если была запись о начале сна, считаем продолжительность
@@ -448,7 +533,7 @@ async def handle_wake_pet(message: Message) -> None:
             wake_time = datetime.now(timezone.utc)
             sleep_duration = (wake_time - sleep_start).total_seconds() / 60  # минуты
             if sleep_duration > 0:
-                stats_repo.add_sleep_minutes(user.user_id, int(sleep_duration))
+                await stats_repo.add_sleep_minutes(user.user_id, int(sleep_duration))
                 hours = int(sleep_duration // 60)
                 minutes = int(sleep_duration % 60)
                 sleep_msg = f"\nВыдра спала {hours}ч {minutes}м."
@@ -465,7 +550,7 @@ async def handle_wake_pet(message: Message) -> None:
     pet.happiness = min(100, pet.happiness + 5)
     pet.last_wake_time = datetime.now(timezone.utc).isoformat()
     touch_pet(user)
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
 
     await message.answer(
         f"Выдра проснулась и энергично потянулась 🦦{sleep_msg}",
@@ -498,12 +583,12 @@ async def handle_sleep_pet(message: Message) -> None:
         )
         return
 
-    degrade_pet(user)
+    degrade_once(user)
     pet.avatar_key = "sleep"
     from datetime import datetime, timezone
     pet.last_sleep_start = datetime.now(timezone.utc).isoformat()
     touch_pet(user)
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
 
     await message.answer(
         "Выдра уютно устроилась спать. Постарайся и сам(а) лечь вовремя 😴",
@@ -527,12 +612,12 @@ async def handle_feed(message: Message) -> None:
         )
         return
 
-    degrade_pet(user)
+    degrade_once(user)
     pet.hunger = min(100, pet.hunger + 25)
     pet.happiness = min(100, pet.happiness + 5)
     touch_pet(user)
-    users_repo.save_user(user)
-    stats_repo.inc_feed(user.user_id)
+    await users_repo.save_user(user)
+    await stats_repo.inc_feed(user.user_id)
 
     meal_type = "завтрак" if "завтрак" in message.text else "обед" if "обед" in message.text else "ужин"
     await message.answer(
@@ -547,7 +632,7 @@ async def cmd_lunch_together(message: Message) -> None:
     if not user:
         return
 
-    room = social_rooms.join("lunch_default", "lunch", message.from_user.id)
+    room = await social_rooms.join("lunch_default", "lunch", message.from_user.id)
     await message.answer(
         "Ты и твоя выдра присоединились к совместному обеду.\n"
         f"Сейчас за виртуальным столом: {len(room.users)} выдр(ы).\n"
@@ -571,12 +656,12 @@ async def handle_water(message: Message) -> None:
         )
         return
 
-    degrade_pet(user)
+    degrade_once(user)
     pet.thirst = min(100, pet.thirst + 25)
     pet.happiness = min(100, pet.happiness + 3)
     touch_pet(user)
-    users_repo.save_user(user)
-    stats_repo.inc_water(user.user_id)
+    await users_repo.save_user(user)
+    await stats_repo.inc_water(user.user_id)
 
     await message.answer(
         f"Выдра сделала глоток воды. Пойдём и ты выпьешь стаканчик воды 💧\n"
@@ -590,7 +675,7 @@ async def handle_work_start(message: Message) -> None:
     if not user:
         return
 
-    degrade_pet(user)
+    degrade_once(user)
     pet = user.pet
     if pet.at_work:
         await message.answer("Выдра уже на работе.", reply_markup=main_menu_keyboard())
@@ -607,12 +692,6 @@ async def handle_work_start(message: Message) -> None:
 
     # Проверяем лимит работы (10 часов в сутки)
     from datetime import datetime, timezone, date
-    from zoneinfo import ZoneInfo
-    
-    try:
-        tz = ZoneInfo(user.settings.timezone)
-    except Exception:
-        tz = ZoneInfo("Asia/Vladivostok")
     
     today = date.today().isoformat()
     worked_hours_today = user.work_hours_by_date.get(today, 0.0)
@@ -626,11 +705,10 @@ async def handle_work_start(message: Message) -> None:
         return
 
     pet.at_work = True
-    touch_pet(user)
-    users_repo.save_user(user)
-    stats_repo.inc_work(user.user_id)
     pet.last_work_start = datetime.now(timezone.utc).isoformat()
-    users_repo.save_user(user)
+    touch_pet(user)
+    await users_repo.save_user(user)
+    await stats_repo.inc_work(user.user_id)
     
     remaining_hours = 10.0 - worked_hours_today
     await message.answer(
@@ -646,7 +724,7 @@ async def cmd_work_together(message: Message) -> None:
     if not user:
         return
 
-    room = social_rooms.join("work_default", "work", message.from_user.id)
+    room = await social_rooms.join("work_default", "work", message.from_user.id)
     await message.answer(
         "Ты и твоя выдра присоединились к совместной работе.\n"
         f"Сейчас в комнате: {len(room.users)} выдр(ы).\n"
@@ -674,15 +752,9 @@ async def handle_work_end(message: Message) -> None:
         await message.answer("Выдра сейчас не на работе.", reply_markup=main_menu_keyboard())
         return
 
-    degrade_pet(user)
+    degrade_once(user)
 
     from datetime import datetime, timezone, date
-    from zoneinfo import ZoneInfo
-    
-    try:
-        tz = ZoneInfo(user.settings.timezone)
-    except Exception:
-        tz = ZoneInfo("Asia/Vladivostok")
     
     today = date.today().isoformat()
     
@@ -729,7 +801,7 @@ async def handle_work_end(message: Message) -> None:
         pet.happiness = min(100, pet.happiness + 5)
         pet.last_work_start = None
         touch_pet(user)
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         
         total_worked_today = user.work_hours_by_date[today]
         remaining_hours = 10.0 - total_worked_today
@@ -764,7 +836,7 @@ async def handle_work_end(message: Message) -> None:
         await message.answer(f"Ошибка при расчете работы: {e}", reply_markup=main_menu_keyboard())
         pet.at_work = False
         pet.last_work_start = None
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
 
 
 def get_hobby_description(hobby_id: str, hobby_title: str) -> str:
@@ -861,7 +933,7 @@ async def handle_buy_hobby_menu(message: Message) -> None:
             reply_markup=main_menu_keyboard()
         )
         return
-    hobbies = hobbies_repo.get_all()
+    hobbies = await hobbies_repo.get_all()
     
     # Базовое хобби "Прогулка по парку" всегда бесплатно и не продается
     BASE_HOBBY_ID = "walk"
@@ -916,7 +988,7 @@ async def handle_buy_hobby_menu(message: Message) -> None:
 
 async def handle_back_to_menu(message: Message) -> None:
     """Возвращает пользователя в главное меню"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -943,9 +1015,9 @@ async def handle_buy_hobby_button(message: Message) -> None:
     # Извлекаем название хобби (до скобки)
     hobby_title = button_text.split(" (")[0].strip()
     
-    degrade_pet(user)
+    degrade_once(user)
     pet = user.pet
-    hobbies = hobbies_repo.get_all()
+    hobbies = await hobbies_repo.get_all()
     
     # Ищем хобби по названию
     hobby = None
@@ -986,7 +1058,7 @@ async def handle_buy_hobby_button(message: Message) -> None:
     pet.unlocked_hobbies.append(hobby.id)
     pet.happiness = min(100, pet.happiness + 15)
     touch_pet(user)
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     
     # Получаем описание хобби
     hobby_description = get_hobby_description(hobby.id, hobby.title)
@@ -1027,7 +1099,7 @@ async def handle_hobby(message: Message) -> None:
         )
         return
     
-    hobbies = hobbies_repo.get_all()
+    hobbies = await hobbies_repo.get_all()
 
     # Базовое хобби "Прогулка по парку" всегда бесплатно
     BASE_HOBBY_ID = "walk"
@@ -1037,12 +1109,12 @@ async def handle_hobby(message: Message) -> None:
     
     # Если нет купленных хобби, сразу используем базовое
     if not available:
-        degrade_pet(user)
+        degrade_once(user)
         pet.happiness = min(100, pet.happiness + 10)
         pet.avatar_key = "hobby"
         touch_pet(user)
-        users_repo.save_user(user)
-        stats_repo.inc_hobby(user.user_id)
+        await users_repo.save_user(user)
+        await stats_repo.inc_hobby(user.user_id)
         
         await message.answer(
             f"🦦 Твоя выдра пошла прогуляться по парку. "
@@ -1095,8 +1167,8 @@ async def handle_hobby_selection(message: Message) -> None:
         )
         return
     
-    degrade_pet(user)
-    hobbies = hobbies_repo.get_all()
+    degrade_once(user)
+    hobbies = await hobbies_repo.get_all()
     
     from datetime import datetime, timezone, date
     today = date.today().isoformat()
@@ -1142,8 +1214,8 @@ async def handle_hobby_selection(message: Message) -> None:
         pet.avatar_key = "hobby"
         
         touch_pet(user)
-        users_repo.save_user(user)
-        stats_repo.inc_hobby(user.user_id)
+        await users_repo.save_user(user)
+        await stats_repo.inc_hobby(user.user_id)
         
         result_text = format_hobby_session_result(
             walk_hobby,
@@ -1208,8 +1280,8 @@ async def handle_hobby_selection(message: Message) -> None:
         pet.avatar_key = selected_hobby.avatar_key
         
         touch_pet(user)
-        users_repo.save_user(user)
-        stats_repo.inc_hobby(user.user_id)
+        await users_repo.save_user(user)
+        await stats_repo.inc_hobby(user.user_id)
         
         result_text = format_hobby_session_result(
             selected_hobby,
@@ -1239,13 +1311,13 @@ async def cmd_buy_hobby(message: Message) -> None:
         return
 
     hid = parts[1].strip()
-    hobbies = hobbies_repo.get_all()
+    hobbies = await hobbies_repo.get_all()
     hobby = hobbies.get(hid)
     if not hobby:
         await message.answer("Хобби с таким id не найдено.")
         return
 
-    degrade_pet(user)
+    degrade_once(user)
     pet = user.pet
     if hid in pet.unlocked_hobbies:
         await message.answer("Это хобби уже разблокировано.")
@@ -1261,7 +1333,7 @@ async def cmd_buy_hobby(message: Message) -> None:
     pet.unlocked_hobbies.append(hid)
     pet.happiness = min(100, pet.happiness + 15)
     touch_pet(user)
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     await message.answer(
         f"Хобби '{hobby.title}' куплено! 🎉\n"
         f"Осталось монет: {pet.money}\n"
@@ -1272,16 +1344,16 @@ async def cmd_buy_hobby(message: Message) -> None:
 
 # ========== НОВОЕ МЕНЮ ==========
 
-async def handle_main_menu(message: Message) -> None:
+async def handle_main_menu(message: Message, state: FSMContext) -> None:
     """Обработка главного меню"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
     
     from datetime import datetime, timezone
     user.last_main_menu_return = datetime.now(timezone.utc).isoformat()
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     
     text = message.text
     if text == "Действия с выдрой":
@@ -1302,9 +1374,6 @@ async def handle_main_menu(message: Message) -> None:
             reply_markup=settings_menu_keyboard()
         )
     elif text == "Статистика":
-        # Создаем FSM context для передачи в handle_weekly_stats
-        from aiogram.fsm.context import FSMContext
-        state = FSMContext(storage=dp.storage, key=dp.storage.resolve_key(message.chat.id, message.from_user.id))
         await handle_weekly_stats(message, state)
     elif text == "Совет дня":
         await handle_daily_advice(message)
@@ -1319,7 +1388,7 @@ async def handle_main_menu(message: Message) -> None:
 
 async def handle_actions_menu(message: Message) -> None:
     """Меню действий с выдрой - все старые действия + новые"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -1327,7 +1396,7 @@ async def handle_actions_menu(message: Message) -> None:
     text = message.text
     
     # Действия с выдрой (геймификация)
-    elif text == "Разбудить питомца":
+    if text == "Разбудить питомца":
         await handle_wake_pet(message)
         return
     elif text == "Уложить спать":
@@ -1361,7 +1430,7 @@ async def handle_actions_menu(message: Message) -> None:
 
 async def handle_go_to_sleep(message: Message) -> None:
     """Обработка 'Ложусь спать'"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -1374,12 +1443,12 @@ async def handle_go_to_sleep(message: Message) -> None:
     user.pet.last_sleep_start = today_stats.sleep_time
     user.pet.avatar_key = "sleep"
     
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     
     # Выдра тоже ложится спать вместе с пользователем
     today_stats.pet_sleep_minutes = 0  # Сброс, начнем считать с момента пробуждения
     
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     
     await message.answer(
         "😴 Отлично! Записал время, когда ты лёг(ла) спать.\n\n"
@@ -1392,7 +1461,7 @@ async def handle_go_to_sleep(message: Message) -> None:
 
 async def handle_wake_up(message: Message) -> None:
     """Обработка 'Проснулся'"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -1415,7 +1484,7 @@ async def handle_wake_up(message: Message) -> None:
                 today_stats.sleep_minutes = sleep_duration_minutes
                 # Выдра спала столько же, сколько пользователь
                 today_stats.pet_sleep_minutes = sleep_duration_minutes
-                stats_repo.add_sleep_minutes(user.user_id, sleep_duration_minutes)
+                await stats_repo.add_sleep_minutes(user.user_id, sleep_duration_minutes)
         except Exception:
             pass
     
@@ -1424,7 +1493,7 @@ async def handle_wake_up(message: Message) -> None:
     user.pet.energy = min(100, user.pet.energy + 15)
     user.pet.happiness = min(100, user.pet.happiness + 5)
     
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     
     # Форматируем сообщение
     hours = sleep_duration_minutes // 60
@@ -1449,9 +1518,9 @@ async def handle_wake_up(message: Message) -> None:
     )
 
 
-async def handle_settings_menu(message: Message, state: FSMContext = None) -> None:
+async def handle_settings_menu(message: Message, state: FSMContext) -> None:
     """Меню настроек"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -1487,10 +1556,6 @@ async def handle_settings_menu(message: Message, state: FSMContext = None) -> No
         return
     elif text == "Настроить объем стакана":
         # Используем FSM для ввода объема стакана
-        if state is None:
-            # Если state не передан, создаем его
-            from aiogram.fsm.context import FSMContext
-            state = FSMContext(storage=dp.storage, key=dp.storage.resolve_key(message.chat.id, message.from_user.id))
         await state.set_state(WaterSettingsFSM.waiting_for_glass_volume)
         await message.answer(
             "💧 Настройка объема стакана\n\n"
@@ -1502,9 +1567,9 @@ async def handle_settings_menu(message: Message, state: FSMContext = None) -> No
         return
 
 
-async def handle_weekly_stats(message: Message, state: FSMContext = None) -> None:
+async def handle_weekly_stats(message: Message, state: FSMContext) -> None:
     """Статистика за неделю"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -1542,10 +1607,6 @@ async def handle_weekly_stats(message: Message, state: FSMContext = None) -> Non
         
         # Если норма сна не установлена и есть данные о сне, спрашиваем пользователя
         if user.settings.sleep_norm_hours == 0.0 and avg_sleep_hours > 0:
-            if state is None:
-                from aiogram.fsm.context import FSMContext
-                state = FSMContext(storage=dp.storage, key=dp.storage.resolve_key(message.chat.id, message.from_user.id))
-            
             # Сохраняем среднее значение в FSM для использования в обработчике
             await state.update_data(avg_sleep_hours=avg_sleep_hours)
             await state.set_state(SleepNormFSM.waiting_for_sleep_norm_answer)
@@ -1574,7 +1635,7 @@ async def handle_weekly_stats(message: Message, state: FSMContext = None) -> Non
 
 async def handle_sleep_norm_answer(message: Message, state: FSMContext) -> None:
     """Обработка ответа на вопрос о сне"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await state.clear()
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
@@ -1588,7 +1649,7 @@ async def handle_sleep_norm_answer(message: Message, state: FSMContext) -> None:
         # Пользователь нормально высыпается - сохраняем среднее значение как норму
         if avg_sleep_hours > 0:
             user.settings.sleep_norm_hours = avg_sleep_hours
-            users_repo.save_user(user)
+            await users_repo.save_user(user)
             await state.clear()
             await message.answer(
                 f"💤 Отлично! Установлена норма сна: {avg_sleep_hours:.1f} часов в день.\n\n"
@@ -1646,7 +1707,7 @@ async def handle_sleep_norm_answer(message: Message, state: FSMContext) -> None:
 
 async def handle_daily_advice(message: Message) -> None:
     """Совет дня"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -1660,7 +1721,7 @@ async def handle_daily_advice(message: Message) -> None:
             "Завтра сможешь получить новый совет!",
             reply_markup=main_menu_keyboard()
         )
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         return
     
     # Сохраняем дату первого совета для расчета месячного отчета
@@ -1668,7 +1729,7 @@ async def handle_daily_advice(message: Message) -> None:
         from datetime import date
         user.advice_state.first_advice_date = date.today().isoformat()
     
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     
     await message.answer(
         f"💡 Совет дня:\n\n{advice}\n\n"
@@ -1679,7 +1740,7 @@ async def handle_daily_advice(message: Message) -> None:
 
 async def handle_water_norm_setup(message: Message) -> None:
     """Обработка настройки нормы воды"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -1694,12 +1755,12 @@ async def handle_water_norm_setup(message: Message) -> None:
         )
         # Устанавливаем флаг, что пользователь вводит норму
         user.settings.water_norm_set = False  # Временно, чтобы обработать ввод
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         return
     elif text == "Не знаю, предложи норму":
         user.settings.water_norm_liters = 2.5
         user.settings.water_norm_set = True
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         await message.answer(
             f"💧 Установлена стандартная норма: 2.5 литра в день.\n\n"
             f"Ты всегда можешь изменить её в настройках!",
@@ -1709,7 +1770,7 @@ async def handle_water_norm_setup(message: Message) -> None:
     elif text == "2 литра":
         user.settings.water_norm_liters = 2.0
         user.settings.water_norm_set = True
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         await message.answer(
             f"💧 Норма воды установлена: 2 литра в день.",
             reply_markup=main_menu_keyboard()
@@ -1718,7 +1779,7 @@ async def handle_water_norm_setup(message: Message) -> None:
     elif text == "2.5 литра":
         user.settings.water_norm_liters = 2.5
         user.settings.water_norm_set = True
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         await message.answer(
             f"💧 Норма воды установлена: 2.5 литра в день.",
             reply_markup=main_menu_keyboard()
@@ -1727,7 +1788,7 @@ async def handle_water_norm_setup(message: Message) -> None:
     elif text == "3 литра":
         user.settings.water_norm_liters = 3.0
         user.settings.water_norm_set = True
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         await message.answer(
             f"💧 Норма воды установлена: 3 литра в день.",
             reply_markup=main_menu_keyboard()
@@ -1759,7 +1820,7 @@ async def handle_water_norm_setup(message: Message) -> None:
             # Иначе это может быть норма воды
             volume = int(norm)
             user.settings.glass_volume_ml = volume
-            users_repo.save_user(user)
+            await users_repo.save_user(user)
             await message.answer(
                 f"💧 Объем стакана установлен: {volume}мл.",
                 reply_markup=main_menu_keyboard()
@@ -1767,7 +1828,7 @@ async def handle_water_norm_setup(message: Message) -> None:
         elif 0.5 <= norm <= 10:  # Разумные пределы для нормы воды
             user.settings.water_norm_liters = norm
             user.settings.water_norm_set = True
-            users_repo.save_user(user)
+            await users_repo.save_user(user)
             await message.answer(
                 f"💧 Норма воды установлена: {norm} литров в день.",
                 reply_markup=main_menu_keyboard()
@@ -1785,7 +1846,7 @@ async def handle_water_norm_setup(message: Message) -> None:
                 volume = int(text.replace("мл", "").replace("ml", "").replace(" ", "").strip())
                 if 50 <= volume <= 1000:
                     user.settings.glass_volume_ml = volume
-                    users_repo.save_user(user)
+                    await users_repo.save_user(user)
                     await message.answer(
                         f"💧 Объем стакана установлен: {volume}мл.",
                         reply_markup=main_menu_keyboard()
@@ -1809,7 +1870,7 @@ async def handle_water_norm_setup(message: Message) -> None:
 
 async def handle_weekly_advice_answer(message: Message) -> None:
     """Обработка ответа на вопрос о соблюдении советов"""
-    user = users_repo.get_user(message.from_user.id)
+    user = await users_repo.get_user(message.from_user.id)
     if user is None:
         await message.answer("Сначала нажми /start и создай свою выдру 🦦")
         return
@@ -1820,14 +1881,14 @@ async def handle_weekly_advice_answer(message: Message) -> None:
     text = message.text
     if text == "Да":
         user.advice_state.weekly_answers[today] = True
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         await message.answer(
             "На этой неделе ты следовал советам, это очень приятно. Продолжай в том же духе, спасибо. 👍",
             reply_markup=main_menu_keyboard()
         )
     elif text == "Нет":
         user.advice_state.weekly_answers[today] = False
-        users_repo.save_user(user)
+        await users_repo.save_user(user)
         await message.answer(
             "На этой неделе ты не следовал моим советам. 😔\n\n"
             "Но это нормально! Каждый день — новая возможность начать заботиться о себе. "
@@ -1870,7 +1931,7 @@ async def cmd_hobby_stats(message: Message) -> None:
     if not user:
         return
     
-    stats_text = get_hobby_stats_summary(user.pet, hobbies_repo)
+    stats_text = await run_blocking(get_hobby_stats_summary, user.pet, hobbies_repo.sync)
     await message.answer(stats_text, reply_markup=main_menu_keyboard())
 
 
@@ -1924,7 +1985,7 @@ async def cmd_work_together_hobby(message: Message) -> None:
         )
         return
     
-    degrade_pet(user)
+    degrade_once(user)
     
     # Проверяем, не на работе ли выдра
     if pet.at_work:
@@ -1936,7 +1997,7 @@ async def cmd_work_together_hobby(message: Message) -> None:
         return
     
     # Используем социальную комнату для хобби (например, "art_class")
-    room = social_rooms.join("hobby_together", "hobby", message.from_user.id)
+    room = await social_rooms.join("hobby_together", "hobby", message.from_user.id)
     
     # Эффект зависит от числа участников
     num_participants = len(room.users)
@@ -1956,8 +2017,8 @@ async def cmd_work_together_hobby(message: Message) -> None:
     pet.avatar_key = "hobby"
     
     touch_pet(user)
-    users_repo.save_user(user)
-    stats_repo.inc_hobby(user.user_id)
+    await users_repo.save_user(user)
+    await stats_repo.inc_hobby(user.user_id)
     
     result_text = format_social_hobby_result(
         "Совместное хобби 🎉",
@@ -2038,30 +2099,7 @@ async def handle_add_friend_code(message: Message, state: FSMContext) -> None:
             await state.clear()
             return
         
-        # Проверяем, что это не кнопка меню
-        menu_buttons = [
-        "Действия с выдрой", "👥 Друзья", "Настройки", "Статистика", "Совет дня", "Назад в главное меню",
-        "Разбудить питомца", "Уложить спать", "Накормить (завтрак)", "Накормить (обед)", 
-        "Накормить (ужин)", "Дать воды", "Отправить на работу", "Забрать с работы",
-        "Хобби / тренировка", "Купить хобби",
-        "Просмотреть настройки", "Изменить часовой пояс", "Изменить имя выдры",
-        "Настроить норму воды", "Настроить объем стакана", "Знаю свою норму",
-        "Не знаю, предложи норму", "2 литра", "2.5 литра", "3 литра", "Другое",
-        "Назад в настройки", "Да", "Нет", "Назад в меню",
-        "📋 Мои друзья", "🤝 Совместное хобби", "💼 Совместная работа",
-        "🚶 Совместная прогулка", "🍽️ Совместный обед", "💪 Совместная тренировка",
-        "🏆 Спортивный вызов", "🌲 Приключение", "🎁 Подарок другу",
-            "🔗 Мой код дружбы", "➕ Добавить друга",
-        ]
-        
-        if message.text in menu_buttons:
-            await state.clear()
-            if message.text == "Назад в главное меню":
-                await message.answer("🏠 Главное меню", reply_markup=main_menu_keyboard())
-            elif message.text == "👥 Друзья":
-                await handle_friends_menu(message)
-            return
-        
+        # Кнопки меню сюда не приходят: text_router сбрасывает состояние и обрабатывает их сам
         if not message.text:
             await message.answer("❌ Пожалуйста, введи код дружбы (только цифры).")
             return
@@ -2089,7 +2127,7 @@ async def handle_add_friend_code(message: Message, state: FSMContext) -> None:
             return
         
         # Проверяем, существует ли друг
-        friend_user = users_repo.get_user(friend_id)
+        friend_user = await users_repo.get_user(friend_id)
         if not friend_user:
             await message.answer(
                 f"❌ Пользователь с кодом {code} не найден в боте 🤔\n"
@@ -2101,14 +2139,7 @@ async def handle_add_friend_code(message: Message, state: FSMContext) -> None:
             return
         
         # Проверяем, нет ли уже дружбы
-        from bot.core.models import Friendship
-        from dataclasses import asdict
-        
-        # Ищем в обе стороны в друзьях
-        existing = False
-        if user.friendships and friend_id in user.friendships:
-            existing = True
-        
+        existing = await friends_repo.get_friendship(user.user_id, friend_id)
         if existing:
             await message.answer(
                 f"✅ Ты уже дружишь с выдрой {friend_user.pet.name}! 👥",
@@ -2117,7 +2148,7 @@ async def handle_add_friend_code(message: Message, state: FSMContext) -> None:
             await state.clear()
             return
         
-        # Создаём дружбу в обе стороны
+        # Создаём дружбу: одна запись на пару
         now = datetime.now(timezone.utc).isoformat()
         
         new_friendship = Friendship(
@@ -2128,20 +2159,7 @@ async def handle_add_friend_code(message: Message, state: FSMContext) -> None:
             first_met_date=now,
             last_interaction=now,
         )
-        
-        # Инициализируем friendships если его нет
-        if not user.friendships:
-            user.friendships = {}
-        
-        user.friendships[friend_id] = new_friendship
-        users_repo.save_user(user)
-        
-        # Также добавляем обратную ссылку у друга
-        if not friend_user.friendships:
-            friend_user.friendships = {}
-        
-        friend_user.friendships[user.user_id] = new_friendship
-        users_repo.save_user(friend_user)
+        await friends_repo.save_friendship(new_friendship)
         
         await message.answer(
             f"🎉 Поздравляем! Ты теперь друг выдры {friend_user.pet.name}! 👥\n\n"
@@ -2198,7 +2216,7 @@ async def cmd_add_friend(message: Message) -> None:
         return
     
     # Проверяем, существует ли друг
-    friend_user = users_repo.get_user(friend_id)
+    friend_user = await users_repo.get_user(friend_id)
     if not friend_user:
         await message.answer(
             f"Пользователь {friend_id} не найден в боте 🤔",
@@ -2207,7 +2225,7 @@ async def cmd_add_friend(message: Message) -> None:
         return
     
     # Проверяем, нет ли уже дружбы
-    existing = friends_repo.get_friendship(user.user_id, friend_id)
+    existing = await friends_repo.get_friendship(user.user_id, friend_id)
     if existing:
         await message.answer(
             f"Ты уже дружишь с выдрой {friend_user.pet.name}! 👥",
@@ -2228,7 +2246,7 @@ async def cmd_add_friend(message: Message) -> None:
         last_interaction=now,
     )
     
-    friends_repo.save_friendship(friendship)
+    await friends_repo.save_friendship(friendship)
     
     await message.answer(
         f"🎉 Поздравляем! Ты теперь друг выдры {friend_user.pet.name}! 👥\n\n"
@@ -2249,7 +2267,7 @@ async def cmd_list_friends(message: Message) -> None:
     if not user:
         return
     
-    friends = friends_repo.get_all_friends(user.user_id)
+    friends = await friends_repo.get_all_friends(user.user_id)
     
     if not friends:
         await message.answer(
@@ -2261,18 +2279,32 @@ async def cmd_list_friends(message: Message) -> None:
     
     message_text = f"👥 Твои друзья ({len(friends)}):\n\n"
     
+    # Друзья друзей — по списку смежности, без перебора всех дружб
+    suggestions = await friends_repo.suggest_friends(user.user_id, limit=3)
+    # Выдры друзей и подсказок — одним чтением хранилища
+    pets = await users_repo.get_pet_summaries(
+        list(friends) + [candidate_id for candidate_id, _ in suggestions]
+    )
+    
     for friend_id, friendship in friends.items():
-        friend_user = users_repo.get_user(friend_id)
-        if friend_user:
+        pet = pets.get(friend_id)
+        if pet:
             level = friendship.friendship_level
             stars = get_friendship_stars(level)
             sessions = friendship.total_sessions_together
             
             message_text += (
-                f"🦦 {friend_user.pet.name} (ID: {friend_id})\n"
+                f"🦦 {pet.name} (ID: {friend_id})\n"
                 f"{stars} Уровень {level}/10 | {sessions} сессий\n\n"
             )
     
+    if suggestions:
+        message_text += "🤔 Возможно, вы знакомы:\n"
+        for candidate_id, mutual in suggestions:
+            candidate = pets.get(candidate_id)
+            if candidate:
+                message_text += f"🦦 {candidate.name} (ID: {candidate_id}) — общих друзей: {mutual}\n"
+    
     await message.answer(message_text, reply_markup=main_menu_keyboard())
 
 
@@ -2296,7 +2328,7 @@ async def cmd_friend_info(message: Message) -> None:
         await message.answer("ID должен быть числом!", reply_markup=main_menu_keyboard())
         return
     
-    friendship = friends_repo.get_friendship(user.user_id, friend_id)
+    friendship = await friends_repo.get_friendship(user.user_id, friend_id)
     if not friendship:
         await message.answer(
             "Ты не дружишь с этой выдрой 🤔",
@@ -2304,16 +2336,18 @@ async def cmd_friend_info(message: Message) -> None:
         )
         return
     
-    friend_user = users_repo.get_user(friend_id)
+    friend_user = await users_repo.get_user(friend_id)
     if not friend_user:
         await message.answer("Друг не найден!", reply_markup=main_menu_keyboard())
         return
     
     info = format_friendship_info(user.user_id, friend_id, friendship)
+    mutual = await friends_repo.mutual_friends(user.user_id, friend_id)
     
     await message.answer(
         f"🦦 Выдра: {friend_user.pet.name}\n\n"
-        + info,
+        + info
+        + f"\n👥 Общих друзей: {len(mutual)}",
         reply_markup=main_menu_keyboard()
     )
 
@@ -2335,7 +2369,7 @@ async def cmd_coop_walk(message: Message) -> None:
         )
         return
     
-    degrade_pet(user)
+    degrade_once(user)
     
     # Одиночная прогулка (рассчитываем как совместную с 1 участником)
     base_happiness = 15
@@ -2348,7 +2382,7 @@ async def cmd_coop_walk(message: Message) -> None:
     pet.fatigue = max(0, pet.fatigue - 80)
     
     touch_pet(user)
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     
     result_text = format_coop_result(
         "walk",
@@ -2380,7 +2414,7 @@ async def cmd_coop_meal(message: Message) -> None:
         )
         return
     
-    degrade_pet(user)
+    degrade_once(user)
     
     base_happiness = 20
     base_money = 0
@@ -2392,7 +2426,7 @@ async def cmd_coop_meal(message: Message) -> None:
     pet.hunger = min(100, pet.hunger + 30)
     
     touch_pet(user)
-    users_repo.save_user(user)
+    await users_repo.save_user(user)
     
     result_text = format_coop_result(
         "meal",
@@ -2407,15 +2441,87 @@ async def cmd_coop_meal(message: Message) -> None:
     await message.answer(result_text, reply_markup=main_menu_keyboard())
 
 
+async def handle_glass_volume_input(message: Message, state: FSMContext) -> None:
+    """Обработка ввода объема стакана"""
+    user = await users_repo.get_user(message.from_user.id)
+    if user is None:
+        await state.clear()
+        await message.answer("Сначала нажми /start и создай свою выдру 🦦")
+        return
+    
+    # Кнопки меню сюда не приходят: text_router сбрасывает состояние и обрабатывает их сам
+    text = message.text.strip()
+    
+    # Пробуем распарсить как число
+    try:
+        # Убираем "мл" или "ml" если есть
+        clean_text = text.replace("мл", "").replace("ml", "").replace(" ", "").strip()
+        volume = int(clean_text)
+        
+        if 50 <= volume <= 1000:
+            user.settings.glass_volume_ml = volume
+            await users_repo.save_user(user)
+            await state.clear()
+            await message.answer(
+                f"💧 Объем стакана установлен: {volume}мл.",
+                reply_markup=main_menu_keyboard()
+            )
+        else:
+            await message.answer(
+                "💧 Пожалуйста, введи объем от 50 до 1000 мл.",
+                reply_markup=settings_menu_keyboard()
+            )
+    except ValueError:
+        await message.answer(
+            "💧 Не понял. Введи число от 50 до 1000 (например, 250).",
+            reply_markup=settings_menu_keyboard()
+        )
+
+
+async def handle_text_with_inactivity_check(message: Message) -> None:
+    """Свободный текст: после долгого бездействия возвращаем в главное меню"""
+    user = await users_repo.get_user(message.from_user.id)
+    
+    # Если пользователя нет в базе, это может быть ввод имени выдры - пропускаем
+    if user is None:
+        return
+    if user and user.last_main_menu_return:
+        from datetime import datetime, timezone, timedelta
+        try:
+            last_return = datetime.fromisoformat(user.last_main_menu_return)
+            now = datetime.now(timezone.utc)
+            # Если прошло больше 2 часов без взаимодействия, возвращаем в главное меню
+            if (now - last_return).total_seconds() > 2 * 3600:
+                await message.answer(
+                    "🦦 Давно не виделись! Возвращаю тебя в главное меню.",
+                    reply_markup=main_menu_keyboard()
+                )
+                user.last_main_menu_return = now.isoformat()
+                await users_repo.save_user(user)
+                return
+        except Exception:
+            pass
+    
+    await handle_unknown(message)
+
+
 async def main() -> None:
     config = load_config()
-    bot = Bot(token=config.token)
+    # Процесс рисования графиков запускается до рабочих потоков хранилища
+    stats_chart.start()
+    session = None
+    if config.api_server:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(config.api_server))
+    bot = Bot(token=config.token, session=session)
     
     # Инициализируем FSM storage
     from aiogram.fsm.storage.memory import MemoryStorage
     storage = MemoryStorage()
     
     dp = Dispatcher(storage=storage)
+    # Апдейты одного пользователя выполняются по очереди, разных — параллельно
+    dp.update.outer_middleware(MailboxMiddleware(user_mailboxes))
+    dp.message.middleware(UnitOfWorkMiddleware(storage_users_repo, storage_stats_repo))
 
     # Роутер администратора
     dp.include_router(admin_router)
@@ -2446,350 +2552,59 @@ async def main() -> None:
     dp.message.register(cmd_lunch_together, Command("lunch_together"))
     dp.message.register(cmd_pet_status, Command("pet_status"))
     dp.message.register(cmd_my_stats, Command("my_stats"))
+    dp.message.register(cmd_leaderboard, Command("leaderboard"))
 
     dp.message.register(cmd_start, CommandStart())
     
-    # Обработчик имени выдры — только если питомец ещё не создан и это не команда
-    # Также обрабатывает ввод нормы воды, если она не установлена
-    # ВАЖНО: Регистрируем ПЕРЕД другими обработчиками текста, чтобы он обрабатывался первым
-    # Исключаем FSM состояние для добавления друга
-    dp.message.register(
-        handle_pet_name,
-        ~StateFilter(FriendshipFSM.waiting_for_friend_code) &
-        F.text & ~F.text.startswith("/") &
-        ~F.text.in_([
-            "Разбудить питомца",
-            "Уложить спать",
-            "Накормить (завтрак)",
-            "Накормить (обед)",
-            "Накормить (ужин)",
-            "Дать воды",
-            "Отправить на работу",
-            "Забрать с работы",
-            "Хобби / тренировка",
-            "Купить хобби",
-            "Назад в меню",
-            "Действия с выдрой",
-            "👥 Друзья",
-            "Настройки",
-            "Статистика",
-            "Совет дня",
-            "Назад в главное меню",
-            "Просмотреть настройки",
-            "Изменить часовой пояс",
-            "Изменить имя выдры",
-            "Настроить норму воды",
-            "Настроить объем стакана",
-            "Знаю свою норму",
-            "Не знаю, предложи норму",
-            "2 литра",
-            "2.5 литра",
-            "3 литра",
-            "Другое",
-            "Назад в настройки",
-            "Да",
-            "Нет",
-            "📋 Мои друзья",
-            "🤝 Совместное хобби",
-            "💼 Совместная работа",
-            "🚶 Совместная прогулка",
-            "🍽️ Совместный обед",
-            "💪 Совместная тренировка",
-            "🏆 Спортивный вызов",
-            "🌲 Приключение",
-            "🎁 Подарок другу",
-            "🔗 Мой код дружбы",
-            "➕ Добавить друга",
-        ]) & ~F.text.contains("💰") & ~F.text.startswith("🎨 ") & ~F.text.startswith("🆓"),
-    )
+    # Все текстовые сообщения (кроме команд) идут через text_router: сначала
+    # обработчик текущего состояния FSM, затем кнопка по точному тексту (один
+    # поиск в словаре, собранном из клавиатур bot/core/menu.py), и только потом
+    # запасные проверки и свободный текст
+    text_router.state(WaterSettingsFSM.waiting_for_glass_volume, handle_glass_volume_input)
+    text_router.state(SleepNormFSM.waiting_for_sleep_norm_answer, handle_sleep_norm_answer, buttons=("Да", "Нет"))
+    text_router.state(FriendshipFSM.waiting_for_friend_code, handle_add_friend_code)
+
+    # Кнопки, которые обрабатываются не обработчиком своей клавиатуры
+    text_router.button("👥 Друзья", handle_friends_menu)
+    text_router.button("🔗 Мой код дружбы", cmd_my_friend_code)
+    text_router.button("➕ Добавить друга", cmd_add_friend_by_code)
+    # Первая регистрация кнопки выигрывает: «Назад в главное меню» есть в
+    # нескольких клавиатурах, обрабатывает её главное меню
+    text_router.button("Назад в главное меню", handle_main_menu)
+    text_router.keyboard(main_menu_keyboard(), handle_main_menu)
+    text_router.keyboard(actions_menu_keyboard(), handle_actions_menu)
+    text_router.keyboard(settings_menu_keyboard(), handle_settings_menu)
+    text_router.keyboard(water_norm_setup_keyboard(), handle_water_norm_setup)
+    text_router.keyboard(weekly_advice_answer_keyboard(), handle_weekly_advice_answer)
+    # Совместные активности из меню друзей пока без действия
+    text_router.keyboard(friends_menu_keyboard(), ignore)
+    # Клавиатуры хобби собираются на лету из купленных хобби
+    text_router.button("Назад в меню", handle_back_to_menu)
+    text_router.button("🆓 Прогулка по парку", handle_hobby_selection)
+    text_router.fallback(lambda text: "💰" in text and "(" in text, handle_buy_hobby_button)
+    text_router.fallback(lambda text: text.startswith("🎨 "), handle_hobby_selection)
+    # Имя выдры для нового пользователя, норма воды, иначе — общий обработчик текста
+    text_router.default(handle_pet_name)
+
+    dp.message.register(text_router.dispatch, F.text & ~F.text.startswith("/"))
+
+    # Один проход по хранилищу строит все индексы в памяти до приёма апдейтов:
+    # если хранилище не читается, бот не запускается, а не висит на пустых индексах
+    await build_indexes(storage_users_repo, storage_stats_repo, friends_repo)
+    asyncio.create_task(reminders_worker(storage_users_repo))
+    asyncio.create_task(outbox.run(bot))
+    # Продолжаем рассылки, прерванные остановкой бота
+    asyncio.create_task(broadcasts.resume(bot))
+
+    # Кэшированные и журнальные файлы (статистика, outbox и рассылки журнальные
+    # при любом JSONDB_MODE) периодически сбрасываем на диск
+    asyncio.create_task(flush_worker())
 
-    # Новое главное меню
-    dp.message.register(
-        handle_main_menu,
-        F.text.in_([
-            "Действия с выдрой",
-            "Настройки",
-            "Статистика",
-            "Совет дня",
-            "Назад в главное меню",
-        ])
-    )
-    
-    # Меню действий с выдрой - ВСЕ действия
-    dp.message.register(
-        handle_actions_menu,
-        F.text.in_([
-            # Действия с выдрой (геймификация)
-            "Разбудить питомца",
-            "Уложить спать",
-            "Накормить (завтрак)",
-            "Накормить (обед)",
-            "Накормить (ужин)",
-            "Дать воды",
-            "Отправить на работу",
-            "Забрать с работы",
-            "Хобби / тренировка",
-            "Купить хобби",
-        ])
-    )
-    
-    # Меню настроек
-    # Создаем обертку для передачи state
-    async def handle_settings_menu_wrapper(message: Message, state: FSMContext = None) -> None:
-        await handle_settings_menu(message, state)
-    
-    dp.message.register(
-        handle_settings_menu_wrapper,
-        F.text.in_([
-            "Просмотреть настройки",
-            "Изменить часовой пояс",
-            "Изменить имя выдры",
-            "Настроить норму воды",
-            "Настроить объем стакана",
-            "Назад в главное меню",
-        ])
-    )
-    
-    # Обработка настройки нормы воды
-    dp.message.register(
-        handle_water_norm_setup,
-        F.text.in_([
-            "Знаю свою норму",
-            "Не знаю, предложи норму",
-            "2 литра",
-            "2.5 литра",
-            "3 литра",
-            "Другое",
-            "Назад в настройки",
-        ])
-    )
-    
-    # Обработчик ввода объема стакана (FSM)
-    async def handle_glass_volume_input(message: Message, state: FSMContext) -> None:
-        """Обработка ввода объема стакана"""
-        user = users_repo.get_user(message.from_user.id)
-        if user is None:
-            await state.clear()
-            await message.answer("Сначала нажми /start и создай свою выдру 🦦")
-            return
-        
-        text = message.text.strip()
-        
-        # Проверяем, не кнопка ли это меню
-        if text in ["Назад в главное меню", "Настройки", "Назад в настройки"]:
-            await state.clear()
-            if text == "Настройки" or text == "Назад в настройки":
-                await message.answer("⚙️ Настройки", reply_markup=settings_menu_keyboard())
-            else:
-                await message.answer("🏠 Главное меню", reply_markup=main_menu_keyboard())
-            return
-        
-        # Пробуем распарсить как число
-        try:
-            # Убираем "мл" или "ml" если есть
-            clean_text = text.replace("мл", "").replace("ml", "").replace(" ", "").strip()
-            volume = int(clean_text)
-            
-            if 50 <= volume <= 1000:
-                user.settings.glass_volume_ml = volume
-                users_repo.save_user(user)
-                await state.clear()
-                await message.answer(
-                    f"💧 Объем стакана установлен: {volume}мл.",
-                    reply_markup=main_menu_keyboard()
-                )
-            else:
-                await message.answer(
-                    "💧 Пожалуйста, введи объем от 50 до 1000 мл.",
-                    reply_markup=settings_menu_keyboard()
-                )
-        except ValueError:
-            await message.answer(
-                "💧 Не понял. Введи число от 50 до 1000 (например, 250).",
-                reply_markup=settings_menu_keyboard()
-            )
-    
-    dp.message.register(
-        handle_glass_volume_input,
-        StateFilter(WaterSettingsFSM.waiting_for_glass_volume)
-    )
-    
-    # Обработка ответов на еженедельный вопрос о соблюдении советов
-    dp.message.register(
-        handle_weekly_advice_answer,
-        F.text.in_(["Да", "Нет"])
-    )
-    
-    # Обработчик ответа на вопрос о сне (FSM) - регистрируем ПЕРЕД общим обработчиком "Да"/"Нет"
-    dp.message.register(
-        handle_sleep_norm_answer,
-        StateFilter(SleepNormFSM.waiting_for_sleep_norm_answer)
-    )
-    
-    # Обработчик ввода объема стакана (FSM) - регистрируем ПЕРЕД общим обработчиком текста
-    dp.message.register(
-        handle_glass_volume_input,
-        StateFilter(WaterSettingsFSM.waiting_for_glass_volume)
-    )
-    
-    # Обработчик меню друзей
-    dp.message.register(
-        handle_friends_menu,
-        F.text == "👥 Друзья"
-    )
-    
-    # Обработчик отображения моего кода дружбы
-    dp.message.register(
-        cmd_my_friend_code,
-        F.text == "🔗 Мой код дружбы"
-    )
-    
-    # Обработчик кнопки добавления друга по коду
-    dp.message.register(
-        cmd_add_friend_by_code,
-        F.text == "➕ Добавить друга"
-    )
-
-    # Обработчик ввода кода дружбы (обработка текста после нажатия ➕)
-    # ВАЖНО: Регистрируем с фильтром, чтобы не перехватывать команды
-    dp.message.register(
-        handle_add_friend_code,
-        StateFilter(FriendshipFSM.waiting_for_friend_code) & 
-        ~F.text.startswith("/")  # Не обрабатываем команды
-    )
-
-    # Обработчик имени выдры — только если питомец ещё не создан и это не команда
-    # Также обрабатывает ввод нормы воды, если она не установлена
-    # ВАЖНО: Регистрируем ПЕРЕД общим обработчиком текста, чтобы он обрабатывался первым
-    dp.message.register(
-        handle_pet_name,
-        F.text & ~F.text.startswith("/") &
-        ~F.text.in_([
-            "Разбудить питомца",
-            "Уложить спать",
-            "Накормить (завтрак)",
-            "Накормить (обед)",
-            "Накормить (ужин)",
-            "Дать воды",
-            "Отправить на работу",
-            "Забрать с работы",
-            "Хобби / тренировка",
-            "Купить хобби",
-            "Назад в меню",
-            "Действия с выдрой",
-            "👥 Друзья",
-            "Настройки",
-            "Статистика",
-            "Совет дня",
-            "Назад в главное меню",
-            "Просмотреть настройки",
-            "Изменить часовой пояс",
-            "Изменить имя выдры",
-            "Настроить норму воды",
-            "Настроить объем стакана",
-            "Знаю свою норму",
-            "Не знаю, предложи норму",
-            "2 литра",
-            "2.5 литра",
-            "3 литра",
-            "Другое",
-            "Назад в настройки",
-            "Да",
-            "Нет",
-            "📋 Мои друзья",
-            "🤝 Совместное хобби",
-            "💼 Совместная работа",
-            "🚶 Совместная прогулка",
-            "🍽️ Совместный обед",
-            "💪 Совместная тренировка",
-            "🏆 Спортивный вызов",
-            "🌲 Приключение",
-            "🎁 Подарок другу",
-            "🔗 Мой код дружбы",
-            "➕ Добавить друга",
-        ]) & ~F.text.contains("💰") & ~F.text.startswith("🎨 ") & ~F.text.startswith("🆓"),
-    )
-
-    # Старые обработчики теперь обрабатываются через handle_actions_menu
-    # Удаляем дублирующую регистрацию, чтобы избежать конфликтов
-    dp.message.register(handle_buy_hobby_button, F.text.contains("💰") & F.text.contains("("))
-    dp.message.register(handle_back_to_menu, F.text == "Назад в меню")
-    # Обработчик выбора хобби (базовое или купленное)
-    dp.message.register(handle_hobby_selection, F.text.in_(["🆓 Прогулка по парку"]) | F.text.startswith("🎨 "))
-
-    # Общий обработчик текста — не трогаем команды вида /...
-    # Также проверяем долгое бездействие и возвращаем в главное меню
-    # ВАЖНО: Этот обработчик должен быть последним и не перехватывать кнопки меню
-    async def handle_text_with_inactivity_check(message: Message) -> None:
-        # Исключаем все кнопки меню, которые уже обрабатываются другими обработчиками
-        menu_buttons = [
-            "Действия с выдрой", "👥 Друзья", "Настройки", "Статистика", "Совет дня", "Назад в главное меню",
-            "Разбудить питомца", "Уложить спать", "Накормить (завтрак)", "Накормить (обед)", 
-            "Накормить (ужин)", "Дать воды", "Отправить на работу", "Забрать с работы",
-            "Хобби / тренировка", "Купить хобби",
-            "Просмотреть настройки", "Изменить часовой пояс", "Изменить имя выдры",
-            "Настроить норму воды", "Настроить объем стакана", "Знаю свою норму",
-            "Не знаю, предложи норму", "2 литра", "2.5 литра", "3 литра", "Другое",
-            "Назад в настройки", "Да", "Нет", "Назад в меню",
-            "📋 Мои друзья", "🤝 Совместное хобби", "💼 Совместная работа",
-            "🚶 Совместная прогулка", "🍽️ Совместный обед", "💪 Совместная тренировка",
-            "🏆 Спортивный вызов", "🌲 Приключение", "🎁 Подарок другу",
-            "🔗 Мой код дружбы", "➕ Добавить друга",
-        ]
-        
-        if message.text in menu_buttons:
-            # Это кнопка меню, она должна обрабатываться другими обработчиками
-            # Если мы здесь, значит что-то пошло не так - просто игнорируем
-            return
-        
-        user = users_repo.get_user(message.from_user.id)
-        
-        # Если пользователя нет в базе, это может быть ввод имени выдры - пропускаем
-        if user is None:
-            return
-        if user and user.last_main_menu_return:
-            from datetime import datetime, timezone, timedelta
-            try:
-                last_return = datetime.fromisoformat(user.last_main_menu_return)
-                now = datetime.now(timezone.utc)
-                # Если прошло больше 2 часов без взаимодействия, возвращаем в главное меню
-                if (now - last_return).total_seconds() > 2 * 3600:
-                    await message.answer(
-                        "🦦 Давно не виделись! Возвращаю тебя в главное меню.",
-                        reply_markup=main_menu_keyboard()
-                    )
-                    user.last_main_menu_return = now.isoformat()
-                    users_repo.save_user(user)
-                    return
-            except Exception:
-                pass
-        
-        await handle_unknown(message)
-    
-    # Регистрируем общий обработчик последним, чтобы он не перехватывал кнопки меню
-    dp.message.register(
-        handle_text_with_inactivity_check, 
-        F.text & 
-        ~F.text.startswith("/") &
-        ~F.text.in_([
-            "Действия с выдрой", "Настройки", "Статистика", "Совет дня", "Назад в главное меню",
-            "Разбудить питомца", "Уложить спать", "Накормить (завтрак)", "Накормить (обед)", 
-            "Накормить (ужин)", "Дать воды", "Отправить на работу", "Забрать с работы",
-            "Хобби / тренировка", "Купить хобби",
-            "Просмотреть настройки", "Изменить часовой пояс", "Изменить имя выдры",
-            "Настроить норму воды", "Настроить объем стакана", "Знаю свою норму",
-            "Не знаю, предложи норму", "2 литра", "2.5 литра", "3 литра", "Другое",
-            "Назад в настройки", "Да", "Нет", "Назад в меню",
-        ]) &
-        ~F.text.contains("💰") & 
-        ~F.text.startswith("🎨 ") & 
-        ~F.text.startswith("🆓")
-    )
-
-    # Запускаем фоновый воркер напоминаний
-    asyncio.create_task(reminders_worker(bot, users_repo))
-
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # При остановке бота сохраняем всё, что ещё не записано на диск
+        flush_all()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+"""
+Скорость рассылки напоминаний.
+
+Имитирует напоминание для целого часового пояса: N сообщений разным
+пользователям через фальшивого бота с заданной задержкой сети. Сравнивает
+последовательную отправку (как было: await bot.send_message по одному) и
+очередь bot/core/delivery.py с ограничением темпа.
+
+Запуск из корня проекта:
+    python -m scripts.bench_delivery
+    python -m scripts.bench_delivery --messages 300 --latency 0.08 --rate 30 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+# Каталог данных должен быть задан до импорта модулей бота
+os.environ["FEFUS_DATA_DIR"] = tempfile.mkdtemp(prefix="fefus-delivery-")
+
+from bot.core.delivery import DeliveryPipeline  # noqa: E402
+
+
+class FakeBot:
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.sent_at: list = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> None:
+        await asyncio.sleep(self.latency)
+        self.sent_at.append(time.perf_counter())
+
+
+async def sequential(args) -> float:
+    bot = FakeBot(args.latency)
+    started = time.perf_counter()
+    for chat_id in range(args.messages):
+        await bot.send_message(chat_id, "🦦")
+    return time.perf_counter() - started
+
+
+async def pipeline(args) -> tuple:
+    bot = FakeBot(args.latency)
+    pipe = DeliveryPipeline(args.rate, args.concurrency, chat_interval=1.0)
+    started = time.perf_counter()
+    for chat_id in range(args.messages):
+        pipe.send_message(bot, chat_id, "🦦")
+    enqueued = time.perf_counter() - started
+    await pipe.join()
+    elapsed = time.perf_counter() - started
+    # Самая плотная секунда не должна превышать лимит
+    peak = max(
+        sum(1 for t in bot.sent_at if start <= t < start + 1.0)
+        for start in bot.sent_at
+    )
+    return elapsed, enqueued, peak, pipe.stats()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=150)
+    parser.add_argument("--latency", type=float, default=0.1, help="задержка одного запроса к Telegram, с")
+    parser.add_argument("--rate", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    seq = asyncio.run(sequential(args))
+    elapsed, enqueued, peak, stats = asyncio.run(pipeline(args))
+
+    print(f"{args.messages} сообщений, задержка сети {args.latency * 1000:.0f} мс")
+    print(f"  последовательно: {seq:.2f} с ({args.messages / seq:.1f} сообщ./с)")
+    print(
+        f"  очередь:         {elapsed:.2f} с ({args.messages / elapsed:.1f} сообщ./с), "
+        f"постановка в очередь {enqueued * 1000:.1f} мс, пик {peak} сообщ. за секунду (лимит {args.rate:.0f})"
+    )
+    print(
+        f"  задержка в очереди: p50 {stats['lag_p50_ms']:.0f} мс, p99 {stats['lag_p99_ms']:.0f} мс, "
+        f"макс. {stats['lag_max_ms']:.0f} мс"
+    )
+
+
+if __name__ == "__main__":
+    main()
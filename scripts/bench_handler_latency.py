@@ -0,0 +1,111 @@
+"""
+Задержка обработчиков под конкурентной нагрузкой.
+
+Запускает пачку одновременных «нажатий кнопок» (get_user + save_user, как
+в handle_feed) и параллельно меряет, насколько опаздывает цикл событий:
+лёгкие апдейты, которым хранилище не нужно, ждут ровно столько же.
+Сравниваются два варианта: вызовы репозитория прямо в цикле событий
+(как было) и через пул потоков хранилища (as_async).
+
+Запуск из корня проекта:
+    python -m scripts.bench_handler_latency
+    python -m scripts.bench_handler_latency --users 2000 --requests 100 --concurrency 20
+    python -m scripts.bench_handler_latency --engine sqlite --users 10000 --requests 2000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+# Каталог данных должен быть задан до импорта модулей бота
+os.environ["FEFUS_DATA_DIR"] = tempfile.mkdtemp(prefix="fefus-latency-")
+
+from bot.core.models import user_to_dict  # noqa: E402
+from bot.core.repositories import UsersRepository  # noqa: E402
+from bot.storage.async_repo import AsyncRepository  # noqa: E402
+from bot.storage.json_db import DATA_DIR, JsonDB  # noqa: E402
+from bot.storage.sqlite_db import SqliteKV, get_sqlite_db  # noqa: E402
+from scripts.bench_storage import make_user  # noqa: E402
+
+TICK = 0.01
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def loop_lag(stop: asyncio.Event, lags: list) -> None:
+    """Каждые TICK секунд проверяет, на сколько позже запланированного проснулись."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append((time.perf_counter() - start - TICK) * 1000)
+
+
+async def run(repo, offload: bool, args) -> tuple:
+    rnd = random.Random(42)
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies: list = []
+
+    async def handler(uid: int, arrived: float) -> None:
+        # Задержка считается с момента прихода апдейта, включая ожидание в очереди
+        async with sem:
+            if offload:
+                user = await repo.get_user(uid)
+                user.pet.money += 1
+                await repo.save_user(user)
+            else:
+                user = repo.get_user(uid)
+                user.pet.money += 1
+                repo.save_user(user)
+            latencies.append((time.perf_counter() - arrived) * 1000)
+
+    stop = asyncio.Event()
+    lags: list = []
+    lag_task = asyncio.create_task(loop_lag(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(rnd.randint(1, args.users), started) for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+    return latencies, lags or [0.0], elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--engine", choices=["json", "sqlite"], default="json")
+    args = parser.parse_args()
+
+    raw = {str(uid): user_to_dict(make_user(uid)) for uid in range(1, args.users + 1)}
+    if args.engine == "sqlite":
+        db = SqliteKV(get_sqlite_db(DATA_DIR / "latency.sqlite3"), "users", key_column="user_id")
+    else:
+        db = JsonDB("latency_users.json", mode="direct")
+    db.replace_all(raw)
+    repo = UsersRepository(db=db)
+
+    print(
+        f"{args.users} пользователей ({args.engine}), {args.requests} апдейтов, "
+        f"до {args.concurrency} одновременно (мс):"
+    )
+    print(f"  {'вариант':<16}{'p50':>9}{'p99':>9}{'лаг p99':>10}{'лаг max':>10}{'всего, с':>10}")
+    for name, target, offload in (
+        ("в цикле", repo, False),
+        ("пул потоков", AsyncRepository(repo), True),
+    ):
+        latencies, lags, elapsed = asyncio.run(run(target, offload, args))
+        print(
+            f"  {name:<16}{statistics.median(latencies):>9.1f}{percentile(latencies, 0.99):>9.1f}"
+            f"{percentile(lags, 0.99):>10.1f}{max(lags):>10.1f}{elapsed:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Память и сериализация моделей пользователя.
+
+- Память: сколько байт занимает в памяти один пользователь с историей за
+  --days дней (UserState со статистикой дней, советами и выдрой), по
+  tracemalloc на --users пользователях.
+- Сохранение: user_to_dict и user_to_dict + json.dumps для пользователя с
+  разобранной историей (худший случай save_user) в сравнении с тем же
+  словарём через dataclasses.asdict.
+
+Запуск из корня проекта:
+    python -m scripts.bench_models
+    python -m scripts.bench_models --users 500 --days 730 --ops 200
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from dataclasses import asdict
+
+from bot.core.models import (
+    DailyStats,
+    HobbyMastery,
+    PetState,
+    UserSettings,
+    UserState,
+    user_to_dict,
+)
+from bot.core.repositories import user_from_dict
+
+
+def make_user(user_id: int, days: int) -> UserState:
+    user = UserState(
+        user_id=user_id,
+        pet=PetState(
+            name=f"Выдра {user_id}",
+            money=100,
+            unlocked_hobbies=["walk", "yoga"],
+            hobby_mastery={"walk": HobbyMastery(hobby_id="walk", level=2, total_sessions=12)},
+        ),
+        settings=UserSettings(timezone="Asia/Vladivostok"),
+    )
+    for i in range(days):
+        day = f"{2025 + i // 365}-{i % 365 // 28 % 12 + 1:02d}-{i % 28 + 1:02d}"
+        user.daily_stats[day] = DailyStats(date=day, sleep_minutes=420 + i % 60, water_liters=1.5)
+        user.work_hours_by_date[day] = 4.5
+    user.advice_state.shown_advice_ids = [f"advice_{i}" for i in range(7)]
+    return user
+
+
+def asdict_user(user: UserState) -> dict:
+    """Тот же словарь, что user_to_dict, через dataclasses.asdict."""
+    return {
+        "user_id": user.user_id,
+        "pet": asdict(user.pet),
+        "settings": asdict(user.settings),
+        "last_reminders": user.last_reminders,
+        "work_hours_by_date": user.work_hours_by_date,
+        "daily_stats": {date: asdict(stats) for date, stats in user.daily_stats.items()},
+        "advice_state": asdict(user.advice_state),
+        "last_main_menu_return": user.last_main_menu_return,
+        "active_quests": user.active_quests,
+        "work_stats": user.work_stats,
+        "last_fatigue_update": user.last_fatigue_update,
+    }
+
+
+def loaded_user(raw: dict) -> UserState:
+    """Пользователь, как после get_user с обращением ко всей истории."""
+    user = user_from_dict(raw)
+    user.daily_stats
+    user.work_hours_by_date
+    user.advice_state
+    return user
+
+
+def memory_per_user(raw: dict, users: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [loaded_user(raw) for _ in range(users)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(kept) == users
+    return (after - before) / users
+
+
+def timed(fn, ops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - start) / ops * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="пользователей для замера памяти")
+    parser.add_argument("--days", type=int, default=365, help="дней истории у пользователя")
+    parser.add_argument("--ops", type=int, default=500, help="вызовов на замер времени")
+    args = parser.parse_args()
+
+    raw = json.loads(json.dumps(user_to_dict(make_user(1, args.days))))
+    user = loaded_user(raw)
+    assert user_to_dict(user) == asdict_user(user) == raw
+
+    print(f"Пользователь с историей за {args.days} дней:")
+    print(f"  память: {memory_per_user(raw, args.users) / 1024:.1f} КБ на пользователя")
+    print(f"  user_to_dict:            {timed(lambda: user_to_dict(user), args.ops):.3f} мс")
+    print(f"  asdict:                  {timed(lambda: asdict_user(user), args.ops):.3f} мс")
+    print(f"  user_to_dict + json:     {timed(lambda: json.dumps(user_to_dict(user), ensure_ascii=False), args.ops):.3f} мс")
+    print(f"  asdict + json:           {timed(lambda: json.dumps(asdict_user(user), ensure_ascii=False), args.ops):.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Время холодного старта бота.
+
+1. Импорт main под python -X importtime: общее время и самые дорогие
+   пакеты верхнего уровня (по собственному времени их модулей).
+2. Время до первого опроса: main.py запускается как при деплое, но вместо
+   api.telegram.org ходит в локальный фальшивый сервер Bot API
+   (TELEGRAM_API_SERVER); засекается время от запуска процесса до первого
+   getUpdates.
+
+Данные — пустой временный каталог, поэтому измеряется сам старт, а не
+чтение хранилища. Запуск из корня проекта:
+    python -m scripts.bench_startup
+    python -m scripts.bench_startup --runs 5 --top 15 --json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parent.parent
+TOKEN = "42:benchmark"
+
+
+def _env(data_dir: str, **extra: str) -> dict:
+    env = dict(os.environ)
+    env.update(BOT_TOKEN=TOKEN, FEFUS_DATA_DIR=data_dir, **extra)
+    return env
+
+
+def import_profile(top: int) -> tuple:
+    """(время импорта main в мс, [(пакет, мс)] по убыванию)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        env=_env(tempfile.mkdtemp(prefix="fefus-startup-")),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    by_package: dict = defaultdict(int)
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        module = name.strip()
+        by_package[module.split(".")[0]] += int(self_us)
+        if module == "main":
+            total = int(cumulative_us)
+    packages = sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+    return total / 1000, [(name, us / 1000) for name, us in packages]
+
+
+async def time_to_first_poll(timeout: float) -> float:
+    """Секунды от запуска main.py до первого getUpdates."""
+    first_poll = asyncio.get_running_loop().create_future()
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if method == "getMe":
+            result = {"id": 42, "is_bot": True, "first_name": "FEFUS", "username": "fefus_bench_bot"}
+        elif method == "getUpdates":
+            if not first_poll.done():
+                first_poll.set_result(time.perf_counter())
+            # Как long polling без апдейтов
+            await asyncio.sleep(1)
+            result = []
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    env = _env(tempfile.mkdtemp(prefix="fefus-startup-"), TELEGRAM_API_SERVER=f"http://127.0.0.1:{port}")
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "main.py",
+        cwd=ROOT,
+        env=env,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        polled_at = await asyncio.wait_for(first_poll, timeout)
+    finally:
+        process.terminate()
+        await process.wait()
+        await runner.cleanup()
+    return polled_at - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="сколько раз запускать бота")
+    parser.add_argument("--top", type=int, default=10, help="сколько пакетов показать")
+    parser.add_argument("--timeout", type=float, default=60, help="сколько ждать первого опроса, с")
+    parser.add_argument("--json", action="store_true", help="вывести итог одной строкой JSON")
+    args = parser.parse_args()
+
+    import_ms, packages = import_profile(args.top)
+    polls = [asyncio.run(time_to_first_poll(args.timeout)) for _ in range(args.runs)]
+    poll_ms = statistics.median(polls) * 1000
+
+    if args.json:
+        print(json.dumps({
+            "import_main_ms": round(import_ms, 1),
+            "first_poll_ms": round(poll_ms, 1),
+            "first_poll_runs_ms": [round(p * 1000, 1) for p in polls],
+            "packages_ms": {name: round(ms, 1) for name, ms in packages},
+        }, ensure_ascii=False))
+        return
+
+    print(f"Импорт main: {import_ms:.0f} мс")
+    for name, ms in packages:
+        print(f"  {name:<24} {ms:8.1f} мс")
+    print(
+        f"До первого getUpdates: медиана {poll_ms:.0f} мс "
+        f"({', '.join(f'{p * 1000:.0f}' for p in polls)} мс за {args.runs} запуска)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Сравнение JSON- и SQLite-хранилищ.
+
+Сначала прогоняет одинаковый сценарий через оба движка и проверяет, что
+результаты совпадают, затем меряет время типичных операций на 1k/10k/100k
+синтетических пользователей. Данные пишутся во временный каталог.
+
+Запуск из корня проекта:
+    python -m scripts.bench_storage
+    python -m scripts.bench_storage --sizes 1000 10000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+# Каталог данных должен быть задан до импорта модулей бота
+os.environ["FEFUS_DATA_DIR"] = tempfile.mkdtemp(prefix="fefus-bench-")
+
+from bot.core.models import (  # noqa: E402
+    AdminSettings,
+    CoopSession,
+    DailyStats,
+    Friendship,
+    Hobby,
+    PetState,
+    UserSettings,
+    UserState,
+    user_to_dict,
+)
+from bot.core.repositories import (  # noqa: E402
+    AdminRepository,
+    CoopSessionsRepository,
+    FriendsRepository,
+    HobbiesRepository,
+    UsersRepository,
+)
+from bot.core.sqlite_repositories import (  # noqa: E402
+    SqliteCoopSessionsRepository,
+    SqliteFriendsRepository,
+    SqliteStatsRepository,
+)
+from bot.core.stats import StatsRepository  # noqa: E402
+from bot.storage.json_db import DATA_DIR, JsonDB  # noqa: E402
+from bot.storage.sqlite_db import SqliteKV, get_sqlite_db  # noqa: E402
+
+
+def make_user(user_id: int, days: int = 30) -> UserState:
+    user = UserState(
+        user_id=user_id,
+        pet=PetState(name=f"Выдра {user_id}", money=user_id % 100),
+        settings=UserSettings(timezone="Asia/Vladivostok"),
+    )
+    for i in range(days):
+        day = f"2026-01-{i % 28 + 1:02d}" if i < 28 else f"2026-02-{i - 27:02d}"
+        user.daily_stats[day] = DailyStats(date=day, sleep_minutes=420 + i, water_liters=1.5)
+        user.work_hours_by_date[day] = 4.5
+    return user
+
+
+def json_backend(tag: str) -> dict:
+    return {
+        "users": UsersRepository(db=JsonDB(f"{tag}_users.json", mode="direct")),
+        "hobbies": HobbiesRepository(db=JsonDB(f"{tag}_hobbies.json", mode="direct")),
+        "admin": AdminRepository(db=JsonDB(f"{tag}_admin.json", mode="direct")),
+        "friends": _json_repo(FriendsRepository, f"{tag}_friends.json"),
+        "coop": _json_repo(CoopSessionsRepository, f"{tag}_coop.json"),
+        "stats": StatsRepository(db=JsonDB(f"{tag}_stats.json", mode="direct")),
+    }
+
+
+def _json_repo(cls, filename: str):
+    repo = cls()
+    repo._db = JsonDB(filename, mode="direct")
+    return repo
+
+
+def sqlite_backend(tag: str) -> dict:
+    db = get_sqlite_db(DATA_DIR / f"{tag}.sqlite3")
+    return {
+        "users": UsersRepository(db=SqliteKV(db, "users", key_column="user_id")),
+        "hobbies": HobbiesRepository(db=SqliteKV(db, "hobbies", key_column="hobby_id")),
+        "admin": AdminRepository(db=SqliteKV(db, "admin")),
+        "friends": SqliteFriendsRepository(db),
+        "coop": SqliteCoopSessionsRepository(db),
+        "stats": SqliteStatsRepository(db),
+    }
+
+
+def scenario(repos: dict) -> list:
+    """Одинаковый сценарий для обоих движков; возвращает всё, что прочитали."""
+    out = []
+    users = repos["users"]
+    for uid in (1, 2, 3):
+        users.save_user(make_user(uid, days=3))
+    user = users.get_user(2)
+    user.pet.money += 10
+    user.settings.timezone = "Europe/Moscow"
+    users.save_user(user)
+    out.append(user_to_dict(users.get_user(2)))
+    out.append(users.get_user(404))
+    out.append(sorted((uid, user_to_dict(u)["pet"]["money"]) for uid, u in users.get_all_users().items()))
+
+    hobbies = repos["hobbies"]
+    hobbies.save(Hobby(id="tennis", title="Теннис", price=30, avatar_key="hobby"))
+    hobbies.save(Hobby(id="yoga", title="Йога", price=20, avatar_key="hobby"))
+    hobbies.delete("yoga")
+    out.append({k: asdict(v) for k, v in hobbies.get_all().items()})
+
+    admin = repos["admin"]
+    out.append(asdict(admin.get_settings()))
+    admin.save_settings(AdminSettings(admin_ids=[1], required_channel_username="@chan"))
+    out.append(asdict(admin.get_settings()))
+
+    friends = repos["friends"]
+    friends.save_friendship(Friendship(user_id_1=2, user_id_2=1, first_met_date="d", last_interaction="d"))
+    friends.save_friendship(Friendship(user_id_1=1, user_id_2=3, social_bonuses={"happiness": 5}))
+    friendship = friends.get_friendship(1, 2)
+    friendship.friendship_level = 3
+    friends.save_friendship(friendship)
+    out.append(asdict(friends.get_friendship(2, 1)))
+    out.append(sorted((k, asdict(v)) for k, v in friends.get_all_friends(1).items()))
+    friends.delete_friendship(3, 1)
+    out.append(sorted(friends.get_all_friends(1)))
+    out.append(friends.get_friendship(1, 3))
+
+    coop = repos["coop"]
+    for i in range(5):
+        coop.save_session(CoopSession(
+            id=f"s{i}",
+            activity_type="walk",
+            user_ids=[1, 2] if i % 2 else [1, 3],
+            start_time=f"2026-01-0{i + 1}T10:00:00",
+            duration_minutes=30,
+            result_happiness={1: 5, 2: 5},
+        ))
+    out.append([asdict(s) for s in coop.get_user_coop_history(1, limit=3)])
+    out.append([s.id for s in coop.get_user_coop_history(2)])
+
+    stats = repos["stats"]
+    stats.inc_feed(1)
+    stats.inc_feed(1)
+    stats.inc_water(1)
+    stats.inc_work(2)
+    stats.inc_hobby(2)
+    stats.add_sleep_minutes(1, 90)
+    stats.add_sleep_minutes(1, -5)
+    out.append(asdict(stats.get_user_stats(3)))
+    out.append(sorted((k, asdict(v)) for k, v in stats.get_all().items()))
+    return out
+
+
+def check_parity() -> None:
+    json_result = scenario(json_backend("parity"))
+    sqlite_result = scenario(sqlite_backend("parity"))
+    for i, (a, b) in enumerate(zip(json_result, sqlite_result)):
+        if a != b:
+            print(f"Расхождение в шаге {i}:\n  json:   {a}\n  sqlite: {b}")
+            sys.exit(1)
+    print(f"Поведение совпадает ({len(json_result)} проверок)\n")
+
+
+def timed(fn, ops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - start) / ops * 1000
+
+
+def bench_size(n: int, ops: int) -> None:
+    raw = {str(uid): user_to_dict(make_user(uid)) for uid in range(1, n + 1)}
+    rnd = random.Random(n)
+    results = []
+    for name, factory in (("json", json_backend), ("sqlite", sqlite_backend)):
+        repos = factory(f"bench{n}")
+        repos["users"]._db.replace_all(raw)
+        users, stats = repos["users"], repos["stats"]
+
+        def get_user():
+            users.get_user(rnd.randint(1, n))
+
+        def save_user():
+            user = users.get_user(rnd.randint(1, n))
+            user.pet.money += 1
+            users.save_user(user)
+
+        def inc_feed():
+            stats.inc_feed(rnd.randint(1, n))
+
+        results.append((name, timed(get_user, ops), timed(save_user, ops), timed(inc_feed, ops)))
+
+    print(f"{n} пользователей, {ops} операций на замер (мс на операцию):")
+    print(f"  {'движок':<8}{'get_user':>12}{'get+save':>12}{'inc_feed':>12}")
+    for name, get_ms, save_ms, inc_ms in results:
+        print(f"  {name:<8}{get_ms:>12.3f}{save_ms:>12.3f}{inc_ms:>12.3f}")
+    print()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--ops", type=int, default=None, help="операций на замер (по умолчанию зависит от размера)")
+    args = parser.parse_args()
+
+    print(f"Каталог данных: {Path(DATA_DIR)}\n")
+    check_parity()
+    for n in args.sizes:
+        # JSON-движок на 100k пользователей тратит секунды на операцию, поэтому число замеров уменьшаем
+        ops = args.ops or max(3, min(50, 20_000 // n))
+        bench_size(n, ops)
+
+
+if __name__ == "__main__":
+    main()
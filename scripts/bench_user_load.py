@@ -0,0 +1,125 @@
+"""
+Стоимость загрузки пользователя с длинной историей.
+
+Пользователь с историей за --days дней (статистика дней, отработанные
+часы, ответы на еженедельные советы) сохраняется в SQLite и в
+шардированное JSON-хранилище, затем меряется время одного вызова:
+
+- разбор записи: только json.loads, без UserState;
+- get_user + pet.name: как в /start и «Назад в меню», история не разбирается;
+- get_user + вся история: обращение к daily_stats, work_hours_by_date и
+  advice_state — столько раньше стоил любой get_user;
+- get + save: изменение выдры и запись обратно; неразобранная история
+  записывается как есть.
+
+Запуск из корня проекта:
+    python -m scripts.bench_user_load
+    python -m scripts.bench_user_load --days 730 --ops 2000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Каталог данных должен быть задан до импорта модулей бота
+os.environ["FEFUS_DATA_DIR"] = tempfile.mkdtemp(prefix="fefus-bench-")
+
+from bot.core.models import DailyStats, PetState, UserSettings, UserState, user_to_dict  # noqa: E402
+from bot.core.repositories import UsersRepository  # noqa: E402
+from bot.storage.json_db import DATA_DIR  # noqa: E402
+from bot.storage.sharded_db import ShardedJsonDB  # noqa: E402
+from bot.storage.sqlite_db import SqliteKV, get_sqlite_db  # noqa: E402
+
+USER_ID = 1
+
+
+def make_user(days: int) -> UserState:
+    user = UserState(
+        user_id=USER_ID,
+        pet=PetState(name="Выдра", money=100, age_days=days),
+        settings=UserSettings(timezone="Asia/Vladivostok"),
+    )
+    start = date(2025, 1, 1)
+    for i in range(days):
+        day = (start + timedelta(days=i)).isoformat()
+        user.daily_stats[day] = DailyStats(
+            date=day,
+            sleep_minutes=420 + i % 60,
+            water_liters=1.5,
+            wake_time=f"{day}T07:00:00+10:00",
+            sleep_time=f"{day}T23:00:00+10:00",
+            pet_sleep_minutes=480,
+            pet_water_glasses=6,
+        )
+        user.work_hours_by_date[day] = 4.5
+        if i % 7 == 0:
+            user.advice_state.weekly_answers[day] = i % 14 == 0
+    user.advice_state.shown_advice_ids = [f"advice_{i}" for i in range(7)]
+    user.advice_state.monthly_advice_summary = {"sleep": ["advice_1", "advice_2"], "water": ["advice_3"]}
+    return user
+
+
+def timed(fn, ops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - start) / ops * 1000
+
+
+def touch_history(user: UserState) -> None:
+    user.daily_stats
+    user.work_hours_by_date
+    user.advice_state
+
+
+def bench(repo: UsersRepository, ops: int) -> dict:
+    def pet_only():
+        repo.get_user(USER_ID).pet.name
+
+    def full():
+        touch_history(repo.get_user(USER_ID))
+
+    def get_save():
+        user = repo.get_user(USER_ID)
+        user.pet.money += 1
+        repo.save_user(user)
+
+    return {
+        "get_user + pet.name": timed(pet_only, ops),
+        "get_user + вся история": timed(full, ops),
+        "get + save": timed(get_save, ops),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=365, help="дней истории у пользователя")
+    parser.add_argument("--ops", type=int, default=1000, help="вызовов на замер")
+    args = parser.parse_args()
+
+    data = user_to_dict(make_user(args.days))
+    encoded = json.dumps(data, ensure_ascii=False)
+    print(f"Запись пользователя: {len(encoded.encode()) / 1024:.0f} КБ, {args.days} дней истории")
+    print(f"  разбор записи (json.loads): {timed(lambda: json.loads(encoded), args.ops):.3f} мс\n")
+
+    backends = {
+        "sqlite": UsersRepository(db=SqliteKV(get_sqlite_db(DATA_DIR / "bench.sqlite3"), "users", key_column="user_id")),
+        "sharded": UsersRepository(db=ShardedJsonDB("users")),
+    }
+    results = {}
+    for name, repo in backends.items():
+        repo._db.set(str(USER_ID), data)
+        results[name] = bench(repo, args.ops)
+        # Запись обратно не должна терять историю
+        assert user_to_dict(repo.get_user(USER_ID))["daily_stats"] == data["daily_stats"]
+
+    print(f"Мс на вызов ({args.ops} вызовов):")
+    print(f"  {'':<26}" + "".join(f"{name:>12}" for name in backends))
+    for label in next(iter(results.values())):
+        print(f"  {label:<26}" + "".join(f"{results[name][label]:>12.3f}" for name in backends))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Перенос дружб из записей пользователей в хранилище дружб.
+
+Раньше добавление друга по коду записывало Friendship в поле friendships
+обоих пользователей. Теперь дружбы хранятся только в FriendsRepository
+(одна запись на пару); скрипт переносит туда старые записи и убирает поле
+friendships у пользователей. Если пара уже есть в хранилище дружб, она не
+перезаписывается.
+
+Запускать при остановленном боте, до первого запуска новой версии: бот
+больше не читает поле friendships и при сохранении пользователя удалит его.
+Запуск из корня проекта:
+    python -m scripts.migrate_friendships
+"""
+from typing import Tuple
+
+from bot.core.backends import get_friends_repo
+from bot.core.models import Friendship
+from bot.storage.json_db import JsonDB, flush_all
+from settings import STORAGE_BACKEND, USERS_STORAGE
+
+
+def _users_db():
+    """Сырое хранилище пользователей выбранного движка (словари, а не UserState)."""
+    if STORAGE_BACKEND == "sqlite":
+        from bot.storage.sqlite_db import SqliteKV, get_sqlite_db
+
+        return SqliteKV(get_sqlite_db(), "users", key_column="user_id")
+    if USERS_STORAGE == "sharded":
+        from bot.storage.sharded_db import ShardedJsonDB
+
+        return ShardedJsonDB("users")
+    return JsonDB("users.json", mode="direct")
+
+
+def migrate() -> Tuple[int, int]:
+    """(перенесено дружб, очищено пользователей)."""
+    users = _users_db()
+    friends = get_friends_repo()
+
+    moved = 0
+    cleaned = []
+    for uid, data in users.iter_items():
+        if not data or "friendships" not in data:
+            continue
+        for friendship_data in (data["friendships"] or {}).values():
+            try:
+                friendship = Friendship(**friendship_data)
+            except TypeError:
+                continue  # Пропускаем некорректные данные
+            if friends.get_friendship(friendship.user_id_1, friendship.user_id_2) is None:
+                friends.save_friendship(friendship)
+                moved += 1
+        cleaned.append(uid)
+
+    # Поле убираем после обхода, чтобы не менять хранилище во время итерации
+    for uid in cleaned:
+        data = users.get(uid)
+        data.pop("friendships", None)
+        users.set(uid, data)
+    # В кэширующем и журнальном режимах friends.json пишется на диск только здесь
+    flush_all()
+    return moved, len(cleaned)
+
+
+if __name__ == "__main__":
+    moved, cleaned = migrate()
+    print(f"Перенесено дружб: {moved}, очищено пользователей: {cleaned}")
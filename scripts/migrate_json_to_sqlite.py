@@ -0,0 +1,66 @@
+"""
+Перенос данных из JSON-файлов bot/data/*.json в SQLite.
+
+Запуск из корня проекта:
+    python -m scripts.migrate_json_to_sqlite
+
+После переноса включи STORAGE_BACKEND=sqlite в .env. JSON-файлы не удаляются.
+"""
+from bot.core.models import CoopSession, Friendship
+from bot.core.sqlite_repositories import (
+    SqliteCoopSessionsRepository,
+    SqliteFriendsRepository,
+    SqliteStatsRepository,
+)
+from bot.storage.json_db import JsonDB
+from bot.storage.sqlite_db import SqliteKV, get_sqlite_db
+
+
+def migrate() -> None:
+    db = get_sqlite_db()
+
+    users_raw = JsonDB("users.json", mode="direct").get_all()
+    SqliteKV(db, "users", key_column="user_id").replace_all(users_raw)
+    print(f"Пользователей: {len(users_raw)}")
+
+    hobbies_raw = JsonDB("hobbies.json", mode="direct").get_all()
+    SqliteKV(db, "hobbies", key_column="hobby_id").replace_all(hobbies_raw)
+    print(f"Хобби: {len(hobbies_raw)}")
+
+    admin_raw = JsonDB("admin.json", mode="direct").get_all()
+    SqliteKV(db, "admin").replace_all(admin_raw)
+
+    friends = SqliteFriendsRepository(db)
+    friends_raw = JsonDB("friends.json", mode="direct").get_all()
+    for data in friends_raw.values():
+        friends.save_friendship(Friendship(**data))
+    print(f"Дружб: {len(friends_raw)}")
+
+    sessions = SqliteCoopSessionsRepository(db)
+    sessions_raw = JsonDB("coop_sessions.json", mode="direct").get_all()
+    for data in sessions_raw.values():
+        sessions.save_session(CoopSession(**data))
+    print(f"Совместных сессий: {len(sessions_raw)}")
+
+    stats = SqliteStatsRepository(db)
+    stats_raw = JsonDB("stats.json", mode="direct").get_all()
+    for data in stats_raw.values():
+        user_id = data["user_id"]
+        stats.get_user_stats(user_id)
+        db.execute(
+            "UPDATE user_stats SET total_sleep_minutes = ?, feed_events = ?, water_events = ?, "
+            "work_sessions = ?, hobby_sessions = ? WHERE user_id = ?",
+            (
+                data.get("total_sleep_minutes", 0),
+                data.get("feed_events", 0),
+                data.get("water_events", 0),
+                data.get("work_sessions", 0),
+                data.get("hobby_sessions", 0),
+                user_id,
+            ),
+        )
+    print(f"Записей статистики: {len(stats_raw)}")
+
+
+if __name__ == "__main__":
+    migrate()
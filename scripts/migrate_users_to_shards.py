@@ -0,0 +1,32 @@
+"""
+Перенос пользователей из монолитного users.json в шардированное
+хранилище bot/data/users/<user_id>.json.
+
+Запуск из корня проекта:
+    python -m scripts.migrate_users_to_shards
+
+Исходный users.json не удаляется. После переноса включи
+USERS_STORAGE=sharded в .env.
+"""
+from bot.storage.json_db import JsonDB
+from bot.storage.sharded_db import ShardedJsonDB
+
+
+def migrate() -> int:
+    source = JsonDB("users.json", mode="direct")
+    target = ShardedJsonDB("users")
+
+    raw = source.get_all()
+    for uid, data in raw.items():
+        target.set(uid, data)
+
+    # Проверяем, что все пользователи на месте
+    missing = [uid for uid in raw if target.get(uid) is None]
+    if missing:
+        raise RuntimeError(f"Не удалось перенести пользователей: {', '.join(missing)}")
+    return len(raw)
+
+
+if __name__ == "__main__":
+    count = migrate()
+    print(f"Перенесено пользователей: {count}")
@@ -4,13 +4,72 @@ import os
 # Загружаем переменные окружения из файла .env в корне проекта
 load_dotenv()
 
-# Токен Telegram-бота
+# Токен Telegram-бота; проверяется при запуске бота (load_config), а не при
+# импорте, чтобы скрипты и бенчмарки работали без него
 BOT_TOKEN: str | None = os.getenv("BOT_TOKEN")
 
+# Адрес своего сервера Bot API (например, http://localhost:8081); по умолчанию api.telegram.org
+TELEGRAM_API_SERVER: str | None = os.getenv("TELEGRAM_API_SERVER")
+
 # Часовой пояс по умолчанию (Владивосток, GMT+10)
 DEFAULT_TIMEZONE: str = "Asia/Vladivostok"
 
-if not BOT_TOKEN:
-    raise RuntimeError(
-        "BOT_TOKEN не найден. Убедись, что в файле .env задана переменная BOT_TOKEN=..."
-    )
\ No newline at end of file
+# Режим JSON-хранилища: "direct" (читать/писать файл на каждый вызов),
+# "cached" (держать данные в памяти и периодически сбрасывать на диск)
+# или "journal" (данные в памяти, каждая запись дописывается в журнал)
+JSONDB_MODE: str = os.getenv("JSONDB_MODE", "direct")
+
+# Как часто (в секундах) сбрасывать кэшированные файлы на диск
+JSONDB_FLUSH_INTERVAL: float = float(os.getenv("JSONDB_FLUSH_INTERVAL", "5"))
+
+# Размер журнала (в байтах), после которого снимок переписывается, а журнал обнуляется
+JSONDB_JOURNAL_MAX_BYTES: int = int(os.getenv("JSONDB_JOURNAL_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# Режим файла stats.json; по умолчанию "journal": счётчики в памяти,
+# каждый инкремент дописывается в журнал одной строкой
+STATS_JSONDB_MODE: str = os.getenv("STATS_JSONDB_MODE", "journal")
+
+# Где хранить пользователей: "json" (один users.json) или "sharded"
+# (отдельный файл на пользователя в bot/data/users/)
+USERS_STORAGE: str = os.getenv("USERS_STORAGE", "json")
+
+# Движок хранения всех репозиториев: "json" (файлы в bot/data) или "sqlite"
+STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "json")
+
+# Путь к файлу SQLite (по умолчанию bot/data/fefus.sqlite3)
+SQLITE_PATH: str | None = os.getenv("SQLITE_PATH")
+
+# Сколько потоков выполняют обращения к хранилищу вне цикла событий
+STORAGE_IO_WORKERS: int = int(os.getenv("STORAGE_IO_WORKERS", "4"))
+
+# Сколько пользователей обслуживается одновременно (апдейты одного
+# пользователя всегда идут по очереди)
+UPDATE_WORKERS: int = int(os.getenv("UPDATE_WORKERS", "32"))
+
+# Исходящие сообщения (напоминания): общий лимит в секундах (у Telegram
+# около 30), число одновременных отправок и пауза между сообщениями в один чат
+DELIVERY_RATE: float = float(os.getenv("DELIVERY_RATE", "30"))
+DELIVERY_CONCURRENCY: int = int(os.getenv("DELIVERY_CONCURRENCY", "16"))
+DELIVERY_CHAT_INTERVAL: float = float(os.getenv("DELIVERY_CHAT_INTERVAL", "1"))
+
+# Исходящий ящик уведомлений: сколько раз пробовать отправить сообщение,
+# пауза после первой неудачи и её предел (в секундах, пауза удваивается),
+# сколько часов помнить отправленные сообщения ради защиты от повторов
+OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_BACKOFF_BASE: float = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))
+OUTBOX_BACKOFF_MAX: float = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+OUTBOX_KEEP_HOURS: float = float(os.getenv("OUTBOX_KEEP_HOURS", "48"))
+
+# Рассылки /broadcast: сообщений в секунду (часть общего лимита
+# DELIVERY_RATE остаётся напоминаниям), размер пачки и как часто (в
+# секундах) обновлять сообщение о ходе рассылки
+BROADCAST_RATE: float = float(os.getenv("BROADCAST_RATE", "20"))
+BROADCAST_CONCURRENCY: int = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_PROGRESS_INTERVAL: float = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# График /stats: до скольких пользователей рисовать столбец на каждого
+# (дальше рисуются распределения по пользователям)
+CHART_MAX_BARS: int = int(os.getenv("CHART_MAX_BARS", "50"))
+
+# Каталог с данными (по умолчанию bot/data); удобно для бенчмарков и отладки
+DATA_DIR: str | None = os.getenv("FEFUS_DATA_DIR")
\ No newline at end of file